@@ -4,11 +4,12 @@ from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_wtf import CSRFProtect
 from config import Config
+from .engines import RoutingSession
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import time
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -16,50 +17,34 @@ login_manager.login_message = 'Пожалуйста, войдите для до
 csrf = CSRFProtect()
 
 def setup_logging(app):
-    """Настройка логирования"""
-    if not app.debug:
-        log_dir = 'logs'
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        
-        file_handler = RotatingFileHandler(
-            os.path.join(log_dir, 'app.log'),
-            maxBytes=10240,
-            backupCount=10
-        )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s '
-            '[in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        
-        app.logger.addHandler(file_handler)
-        app.logger.setLevel(logging.INFO)
-        app.logger.info('Food Delivery запущен')
-    
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
-    console_handler.setFormatter(formatter)
-    
-    logging.getLogger().addHandler(console_handler)
-    logging.getLogger().setLevel(logging.DEBUG)
+    """Настройка логирования (JSON через очередь и фоновый поток, см. log_pipeline)"""
+    from .log_pipeline import configure_logging
+    configure_logging(app)
+    app.logger.info('Food Delivery запущен')
 
 def create_app(config_class=Config):
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config_class)
     
     setup_logging(app)
     
+    from .engines import configure_engines, init_routing
+    configure_engines(app)
     db.init_app(app)
+    init_routing(app)
+    from .sqlite_profile import init_sqlite
+    init_sqlite(app)
+    from .querycount import init_querycount
+    init_querycount(app)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
     
     @login_manager.user_loader
     def load_user(user_id):
-        from .models import User
-        return User.query.get(int(user_id))
+        from .identity import load_user as load_cached_user
+        return load_cached_user(user_id)
     
     from .routes import main
     from .auth import auth
@@ -69,6 +54,15 @@ def create_app(config_class=Config):
     app.register_blueprint(auth, url_prefix='/auth')
     app.register_blueprint(user_bp, url_prefix='/user')
     
+    from .perf import init_perf
+    init_perf(app)
+    
+    from .metrics import init_metrics
+    init_metrics(app)
+    
+    from .profiling import init_profiling
+    init_profiling(app)
+    
     try:
         from .admin import init_admin, admin_parsing_bp
         app.register_blueprint(admin_parsing_bp)
@@ -82,24 +76,17 @@ def create_app(config_class=Config):
     from .commands import init_app as commands_init
     commands_init(app)
     
-    with app.app_context():
-        try:
-            db.create_all()
-            app.logger.info("Таблицы БД созданы/проверены")
-            
-            from .models import User
-            admin_user = User.query.filter_by(username='admin').first()
-            if not admin_user:
-                admin_user = User(
-                    username='admin',
-                    is_admin=True
-                )
-                admin_user.set_password('25102510')
-                db.session.add(admin_user)
-                db.session.commit()
-                app.logger.info("Администратор создан (логин: admin, пароль: 25102510)")
-                
-        except Exception as e:
-            app.logger.error(f"Ошибка инициализации БД: {e}")
+    if app.config.get('AUTO_INIT_DB'):
+        # Локальный запуск; в продакшене схема готовится командой flask prepare-db
+        from .bootstrap import prepare_database, dispose_engines
+        with app.app_context():
+            try:
+                prepare_database()
+            except Exception as e:
+                app.logger.error(f"Ошибка инициализации БД: {e}")
+            # Соединения, открытые при запуске, не должны достаться форкам воркеров
+            dispose_engines()
+    
+    app.logger.info(f"Приложение создано за {(time.perf_counter() - started) * 1000:.0f} мс")
     
     return app
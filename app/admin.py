@@ -1,14 +1,32 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app, g
+from flask import Response, stream_with_context
 from flask_admin import Admin, AdminIndexView, expose
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form import SecureForm
 from flask_login import login_required, current_user
+from sqlalchemy.orm import undefer, joinedload, ColumnProperty
+from urllib.parse import urlencode
+from werkzeug.utils import secure_filename
 from wtforms import PasswordField, TextAreaField, FloatField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Length, NumberRange
 from . import db
 from .models import User, Category, Dish, Order, OrderItem, Favorite, ImageQueue
-from .parsers.nsm_parser import NSMParser
+from .favorites import invalidate_favorites
+from .identity import invalidate_user
+from .querycount import QueryBudgetExceeded, QueryCounter
+from .pagination import decode_cursor, encode_cursor, row_key, seek, estimate_count
+from .queue_stats import get_queue_stats, notify_queue_changed
+from . import rollups
+from . import order_totals
+from . import metrics
+from . import perf
+from . import profiling
 import logging
+import os
+import csv
+import io
+import zlib
 from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -38,6 +56,8 @@ def parse_nsm_action():
     base_url = request.form.get('base_url', 'https://nsm-22.ru/')
     specific_section = request.form.get('specific_section')
     
+    # Парсер (requests, bs4) импортируется при первом использовании, а не при запуске воркера
+    from .parsers.nsm_parser import NSMParser
     parser = NSMParser(base_url)
     
     if specific_section:
@@ -70,19 +90,15 @@ def process_image_queue():
         flash('Доступ запрещен', 'danger')
         return redirect(url_for('main.index'))
     
-    from .parsers.nsm_parser import process_image_queue, get_queue_stats
+    from .parsers.nsm_parser import process_image_queue
     
     limit = request.form.get('limit', 5, type=int)
     cleanup = request.form.get('cleanup', 'true') == 'true'
     
     try:
-        # Сначала показываем статистику до обработки
-        stats_before = get_queue_stats()
-        
-        # Обрабатываем очередь
         result = process_image_queue(limit=limit, cleanup=cleanup)
         
-        # Получаем статистику после обработки
+        # Статистика после обработки (очередь изменилась - кэш уже сброшен)
         stats_after = get_queue_stats()
         
         flash(
@@ -109,8 +125,12 @@ def clear_image_queue():
     from .parsers.nsm_parser import clear_image_queue
     
     try:
-        deleted = clear_image_queue()
-        flash(f'✅ Очередь изображений очищена: удалено {deleted} задач', 'success')
+        deleted, remaining = clear_image_queue()
+        if remaining:
+            flash(f'Удалено {deleted} задач, в очереди осталось {remaining} - '
+                  f'не уложились в лимит времени, повторите очистку', 'warning')
+        else:
+            flash(f'✅ Очередь изображений очищена: удалено {deleted} задач', 'success')
     except Exception as e:
         logger.error(f"Ошибка очистки очереди: {e}")
         flash(f'Ошибка при очистке очереди: {e}', 'danger')
@@ -124,8 +144,6 @@ def queue_stats():
     if not current_user.is_admin:
         return jsonify({'error': 'Доступ запрещен'}), 403
     
-    from .parsers.nsm_parser import get_queue_stats
-    
     try:
         stats = get_queue_stats()
         return jsonify(stats)
@@ -133,6 +151,21 @@ def queue_stats():
         logger.error(f"Ошибка получения статистики очереди: {e}")
         return jsonify({'error': str(e)}), 500
 
+@admin_parsing_bp.route('/queue-events')
+@login_required
+def queue_events():
+    """Поток server-sent events со статистикой очереди изображений"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    from .queue_stats import stream_queue_events
+    
+    return Response(
+        stream_with_context(stream_queue_events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @admin_parsing_bp.route('/update-category-images', methods=['POST'])
 @login_required
 def update_category_images():
@@ -158,6 +191,14 @@ def update_category_images():
     
     return redirect(url_for('admin_parsing.parse_nsm'))
 
+def _parse_ids(value):
+    """Список ID из строки '1,2,3' (для массовых действий)"""
+    return [int(part) for part in (value or '').split(',') if part.strip().isdigit()]
+
+def _related_value(column, foreign_key):
+    """Значение связанной записи коррелированным подзапросом (для экспорта без JOIN)"""
+    return db.select(column).where(column.class_.id == foreign_key).scalar_subquery()
+
 # ============================================================================
 # 2. FLASK-ADMIN панель управления (остается как есть, только добавляем ImageQueueAdminView)
 # ============================================================================
@@ -173,6 +214,18 @@ class SecureModelView(ModelView):
     column_display_pk = True
     column_hide_backrefs = False
     column_list = ['id']
+    # Отложенные колонки (агрегаты-подзапросы), которые подгружаются в запросе списка
+    column_undefer_list = ()
+    # Колонки ключа keyset-пагинации (по убыванию), например ('created_at', 'id').
+    # Используются при сортировке по умолчанию; соседние страницы идут по курсору
+    keyset_columns = ()
+    # SQL-выражения для колонок экспорта, которых нет в таблице модели
+    # (связи, вычисляемые поля). Экспорт идет потоком кортежей без ORM-объектов
+    column_export_sql = {}
+    export_batch_size = 1000
+    # Массовые формы, которые можно применить ко всем записям текущего фильтра списка:
+    # [(endpoint, подпись)]; ссылки на них - в меню списка "По фильтру"
+    filter_bulk_views = ()
     
     def is_accessible(self):
         return current_user.is_authenticated and current_user.is_admin
@@ -180,6 +233,195 @@ class SecureModelView(ModelView):
     def inaccessible_callback(self, name, **kwargs):
         flash('У вас нет прав для доступа к этой странице.', 'danger')
         return redirect(url_for('main.index'))
+    
+    def get_query(self):
+        query = super().get_query()
+        if self.column_undefer_list:
+            query = query.options(*[undefer(getattr(self.model, name)) for name in self.column_undefer_list])
+        return query
+    
+    def _keyset_key(self):
+        return [getattr(self.model, name) for name in self.keyset_columns]
+    
+    def _get_list_extra_args(self):
+        # Курсоры относятся только к текущей странице и не переносятся в другие ссылки
+        view_args = super()._get_list_extra_args()
+        view_args.extra_args.pop('after', None)
+        view_args.extra_args.pop('before', None)
+        return view_args
+    
+    def _get_list_url(self, view_args):
+        url = super()._get_list_url(view_args)
+        cursors = g.get('keyset_cursors', {}).get(self.endpoint)
+        if not cursors or not view_args.page:
+            return url
+        
+        page, first, last = cursors
+        if view_args.page == page + 1 and last:
+            cursor = {'after': last}
+        elif view_args.page == page - 1 and first:
+            cursor = {'before': first}
+        else:
+            return url
+        return url + ('&' if '?' in url else '?') + urlencode(cursor)
+    
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        page_size = self.page_size if page_size is None else page_size
+        if not self.keyset_columns or sort_column is not None or not page_size or not execute:
+            return super().get_list(page, sort_column, sort_desc, search, filters,
+                                    execute=execute, page_size=page_size)
+        
+        joins, count_joins = {}, {}
+        query = self.get_query()
+        count_query = self.get_count_query()
+        
+        if self._search_supported and search:
+            query, count_query, joins, count_joins = self._apply_search(
+                query, count_query, joins, count_joins, search)
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters)
+        
+        # Без фильтров точный COUNT(*) большой таблицы не нужен - хватает оценки
+        count = count_query.scalar() if (search or filters) else estimate_count(self.model)
+        
+        for j in self._auto_joins:
+            query = query.options(joinedload(j))
+        
+        key = self._keyset_key()
+        after = decode_cursor(request.args.get('after'), key)
+        before = decode_cursor(request.args.get('before'), key) if after is None else None
+        query = seek(query, key, after, before)
+        if after is None and before is None and page:
+            # Переход на произвольную страницу без курсора
+            query = query.offset(page * page_size)
+        
+        rows = query.limit(page_size).all()
+        if before is not None:
+            rows.reverse()
+        
+        if rows:
+            g.setdefault('keyset_cursors', {})[self.endpoint] = (
+                page or 0,
+                encode_cursor(row_key(rows[0], key)),
+                encode_cursor(row_key(rows[-1], key))
+            )
+        return count, rows
+    
+    def _filtered_ids(self):
+        """Запрос ID всех записей с текущими фильтрами и поиском списка (без сортировки и страниц)"""
+        view_args = self._get_list_extra_args()
+        joins = {}
+        query = self.session.query(self.model.id)
+        if self._search_supported and view_args.search:
+            query, _, joins, _ = self._apply_search(query, None, joins, {}, view_args.search)
+        if view_args.filters and self._filters:
+            query, _, joins, _ = self._apply_filters(query, None, joins, {}, view_args.filters)
+        return query
+    
+    def _bulk_scope(self):
+        """Записи массовой формы: (выбранные ID или подзапрос фильтра, их число)"""
+        if request.args.get('scope') == 'filter':
+            query = self._filtered_ids()
+            return query.scalar_subquery(), query.order_by(None).count()
+        ids = _parse_ids(request.values.get('ids'))
+        return ids, len(ids)
+    
+    def _export_expressions(self):
+        """Выражения для всех колонок экспорта или None, если какую-то не выразить в SQL"""
+        expressions = []
+        for name, _ in self._export_columns:
+            expression = self.column_export_sql.get(name)
+            if expression is None:
+                attr = getattr(self.model, name, None)
+                if not isinstance(getattr(attr, 'property', None), ColumnProperty):
+                    return None
+                expression = attr
+            expressions.append(expression)
+        return expressions
+    
+    @staticmethod
+    def _export_value(value):
+        if value is None:
+            return ''
+        if isinstance(value, datetime):
+            return value.strftime('%d.%m.%Y %H:%M')
+        return value
+    
+    def _export_csv(self, return_url):
+        """Потоковый CSV: строки читаются пачками (yield_per) и сразу отдаются клиенту"""
+        expressions = self._export_expressions()
+        if expressions is None:
+            return super()._export_csv(return_url)
+        
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        if sort_column is not None:
+            sort_column = sort_column[0]
+        
+        joins = {}
+        query = self.session.query(*expressions).select_from(self.model)
+        if self._search_supported and view_args.search:
+            query, _, joins, _ = self._apply_search(query, None, joins, {}, view_args.search)
+        if view_args.filters and self._filters:
+            query, _, joins, _ = self._apply_filters(query, None, joins, {}, view_args.filters)
+        query, joins = self._apply_sorting(query, joins, sort_column, view_args.sort_desc)
+        if self.export_max_rows:
+            query = query.limit(self.export_max_rows)
+        # Серверный курсор на PostgreSQL, пачки фиксированного размера на любой БД
+        query = query.yield_per(self.export_batch_size)
+        
+        titles = [title for _, title in self._export_columns]
+        batch_size = self.export_batch_size
+        
+        def generate_csv():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(titles)
+            for number, row in enumerate(query, 1):
+                writer.writerow([self._export_value(value) for value in row])
+                if number % batch_size == 0:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue().encode('utf-8')
+        
+        headers = {
+            'Content-Disposition': 'attachment;filename=%s' % secure_filename(self.get_export_name(export_type='csv'))
+        }
+        body = generate_csv()
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and current_app.config.get('ADMIN_EXPORT_GZIP', True):
+            body = self._gzip_stream(body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        
+        return Response(stream_with_context(body), headers=headers, mimetype='text/csv')
+    
+    @staticmethod
+    def _gzip_stream(chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    @expose('/')
+    def index_view(self):
+        # Число запросов на страницу списка не должно зависеть от числа строк
+        strict = current_app.debug or current_app.testing
+        with QueryCounter(keep_statements=strict) as counter:
+            response = super().index_view()
+        
+        budget = current_app.config.get('ADMIN_LIST_QUERY_BUDGET', 0)
+        if budget and counter.count > budget:
+            message = f"Список {self.endpoint}: {counter.count} SQL-запросов при бюджете {budget}"
+            if strict:
+                # В отладке и тестах N+1 в списке - ошибка, а не строка в логе
+                raise QueryBudgetExceeded(message + '\n' + '\n'.join(counter.statements))
+            logger.warning(message)
+        return response
 
 class ImageQueueAdminView(SecureModelView):
     """Админка для очереди изображений"""
@@ -188,6 +430,10 @@ class ImageQueueAdminView(SecureModelView):
     column_filters = ['status', 'priority', 'dish']
     column_sortable_list = ['id', 'priority', 'created_at', 'updated_at']
     column_default_sort = ('priority', True)
+    column_export_sql = {
+        'dish': _related_value(Dish.name, ImageQueue.dish_id),
+        'image_url_short': ImageQueue.image_url
+    }
     
     form_columns = ['dish', 'image_url', 'status', 'priority', 'retry_count']
     
@@ -212,16 +458,23 @@ class ImageQueueAdminView(SecureModelView):
     def on_model_delete(self, model):
         # При удалении из админки логируем
         logger.info(f"Удалена задача очереди: {model.id} (блюдо: {model.dish_id})")
+    
+    def after_model_change(self, form, model, is_created):
+        notify_queue_changed()
+    
+    def after_model_delete(self, model):
+        notify_queue_changed()
 
 class UserAdminView(SecureModelView):
     """Админка для пользователей"""
     column_list = ['id', 'username', 'is_admin', 'is_active', 'created_at', 'orders']
     column_searchable_list = ['username']
     column_filters = ['is_admin', 'is_active', 'created_at']
-    column_sortable_list = ['id', 'username', 'created_at']
+    column_sortable_list = ['id', 'username', 'created_at', ('orders', 'orders_count')]
     column_default_sort = ('id', True)
+    column_export_sql = {'orders': User.orders_count}
     
-    form_columns = ['username', 'is_admin', 'is_active']
+    form_columns = ['username', 'is_admin', 'is_active', 'password']
     
     form_extra_fields = {
         'password': PasswordField('Новый пароль (оставьте пустым, чтобы не менять)')
@@ -238,13 +491,22 @@ class UserAdminView(SecureModelView):
     
     column_formatters = {
         'created_at': lambda v, c, m, p: m.created_at.strftime('%d.%m.%Y %H:%M'),
-        'orders': lambda v, c, m, p: len(m.orders) if m.orders else 0
+        'orders': lambda v, c, m, p: m.orders_count
     }
     
     def on_model_change(self, form, model, is_created):
         if form.password.data:
-            from . import bcrypt
-            model.password_hash = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+            model.set_password(form.password.data)
+            if not is_created:
+                # Завершаем существующие сессии пользователя
+                model.auth_version = (model.auth_version or 0) + 1
+    
+    def after_model_change(self, form, model, is_created):
+        if not is_created:
+            invalidate_user(model.id)
+    
+    def after_model_delete(self, model):
+        invalidate_user(model.id)
 
 class CategoryAdminView(SecureModelView):
     """Админка для категорий"""
@@ -253,6 +515,8 @@ class CategoryAdminView(SecureModelView):
     column_filters = ['name']
     column_sortable_list = ['id', 'name']
     column_default_sort = ('id', True)
+    column_undefer_list = ('dishes_count',)
+    column_export_sql = {'dishes': Category.dishes_count}
     
     form_columns = ['name', 'image']
     
@@ -264,7 +528,7 @@ class CategoryAdminView(SecureModelView):
     }
     
     column_formatters = {
-        'dishes': lambda v, c, m, p: len(m.dishes) if m.dishes else 0
+        'dishes': lambda v, c, m, p: m.dishes_count
     }
     
     def after_model_change(self, form, model, is_created):
@@ -277,6 +541,9 @@ class DishAdminView(SecureModelView):
     column_filters = ['is_available', 'category', 'price']
     column_sortable_list = ['id', 'name', 'price']
     column_default_sort = ('id', True)
+    column_export_sql = {'category': _related_value(Category.name, Dish.category_id)}
+    list_template = 'admin/model/bulk_list.html'
+    filter_bulk_views = [('.bulk_price_view', 'Изменить цену')]
     
     form_columns = ['name', 'description', 'price', 'category', 'is_available', 'image']
     
@@ -302,6 +569,68 @@ class DishAdminView(SecureModelView):
         
         if not model.image:
             model.image = 'default.jpg'
+    
+    def after_model_change(self, form, model, is_created):
+        rollups.clear_popular_cache()
+    
+    # Массовые действия: один UPDATE на все выбранные блюда или на все блюда текущего фильтра
+    
+    def _set_available(self, ids, is_available):
+        try:
+            updated = Dish.query.filter(Dish.id.in_(ids)).update(
+                {Dish.is_available: is_available}, synchronize_session=False)
+            db.session.commit()
+            rollups.clear_popular_cache()
+            flash(f'Обновлено блюд: {updated}', 'success')
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Ошибка массового изменения доступности блюд: {e}")
+            flash(f'Ошибка: {e}', 'danger')
+    
+    @action('make_unavailable', 'Снять с продажи', 'Снять выбранные блюда с продажи?')
+    def action_make_unavailable(self, ids):
+        self._set_available(ids, False)
+    
+    @action('make_available', 'Вернуть в продажу', 'Вернуть выбранные блюда в продажу?')
+    def action_make_available(self, ids):
+        self._set_available(ids, True)
+    
+    @action('change_price', 'Изменить цену (в процентах)')
+    def action_change_price(self, ids):
+        return redirect(self.get_url('.bulk_price_view', ids=','.join(ids)))
+    
+    @expose('/bulk-price/', methods=['GET', 'POST'])
+    def bulk_price_view(self):
+        ids, count = self._bulk_scope()
+        if not count:
+            flash('Не выбрано ни одного блюда', 'warning')
+            return redirect(self.get_url('.index_view'))
+        
+        if request.method == 'POST':
+            percent = request.form.get('percent', type=float)
+            if percent is None or not -90 <= percent <= 500:
+                flash('Укажите изменение цены от -90% до 500%', 'danger')
+            else:
+                factor = 1 + percent / 100
+                try:
+                    new_price = db.func.round(db.cast(Dish.price * factor, db.Numeric(10, 2)), 2)
+                    updated = Dish.query.filter(Dish.id.in_(ids)).update(
+                        {Dish.price: new_price}, synchronize_session=False)
+                    db.session.commit()
+                    rollups.clear_popular_cache()
+                    flash(f'Цена изменена на {percent:+g}% у {updated} блюд', 'success')
+                    return redirect(self.get_url('.index_view'))
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Ошибка массового изменения цен: {e}")
+                    flash(f'Ошибка: {e}', 'danger')
+        
+        return self.render('admin/bulk_update.html',
+                           title='Изменение цены',
+                           ids=','.join(map(str, ids)) if isinstance(ids, list) else '',
+                           count=count,
+                           field='percent',
+                           label='Изменение цены, %')
 
 class OrderAdminView(SecureModelView):
     """Админка для заказов"""
@@ -310,6 +639,10 @@ class OrderAdminView(SecureModelView):
     column_filters = ['status', 'created_at', 'total']
     column_sortable_list = ['id', 'total', 'created_at']
     column_default_sort = ('created_at', True)
+    keyset_columns = ('created_at', 'id')
+    column_export_sql = {'customer': _related_value(User.username, Order.user_id)}
+    list_template = 'admin/model/bulk_list.html'
+    filter_bulk_views = [('.bulk_status_view', 'Сменить статус')]
     
     form_columns = ['customer_name', 'address', 'phone', 'total', 'status', 'customer']
     can_create = False
@@ -341,12 +674,82 @@ class OrderAdminView(SecureModelView):
         'total': lambda v, c, m, p: f"{m.total} ₽",
         'customer': lambda v, c, m, p: m.customer.username if m.customer else 'Гость'
     }
+    
+    def on_model_change(self, form, model, is_created):
+        # До flush user_id еще прежний, а форма уже записала нового пользователя в customer;
+        # история атрибутов читается до запросов ниже, их autoflush ее сбрасывает
+        old_user_id = None if is_created else model.user_id
+        new_user_id = model.customer.id if model.customer else None
+        state = db.inspect(model)
+        status_history = state.attrs.status.history
+        total_history = state.attrs.total.history
+        if is_created:
+            # Float-колонку total Flask-Admin в форму не включает: сумму ведут позиции заказа
+            if model.total is None:
+                model.total = sum((item.quantity or 0) * (item.price or 0) for item in model.items)
+            rollups.record_order(model, [(item.dish_id, item.quantity) for item in model.items])
+        elif status_history.has_changes() or total_history.has_changes():
+            old_status = status_history.deleted[0] if status_history.deleted else model.status
+            old_total = total_history.deleted[0] if total_history.deleted else model.total
+            rollups.move_order(model.created_at, old_status, old_total, model.status, model.total)
+        
+        if old_user_id != new_user_id:
+            User.adjust_counters(old_user_id, orders=-1)
+            User.adjust_counters(new_user_id, orders=1)
+    
+    def on_model_delete(self, model):
+        User.adjust_counters(model.user_id, orders=-1)
+        rollups.forget_order(model)
+    
+    @action('change_status', 'Сменить статус')
+    def action_change_status(self, ids):
+        return redirect(self.get_url('.bulk_status_view', ids=','.join(ids)))
+    
+    @expose('/bulk-status/', methods=['GET', 'POST'])
+    def bulk_status_view(self):
+        ids, count = self._bulk_scope()
+        if not count:
+            flash('Не выбрано ни одного заказа', 'warning')
+            return redirect(self.get_url('.index_view'))
+        
+        statuses = [value for value, _ in self.form_choices['status']]
+        if request.method == 'POST':
+            status = request.form.get('status')
+            if status not in statuses:
+                flash('Неизвестный статус', 'danger')
+            else:
+                try:
+                    # Сводка и статус меняются в одной транзакции
+                    updated = rollups.move_orders_status(ids, status)
+                    db.session.commit()
+                    flash(f'Статус "{status}" установлен у {updated} заказов', 'success')
+                    return redirect(self.get_url('.index_view'))
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Ошибка массовой смены статуса заказов: {e}")
+                    flash(f'Ошибка: {e}', 'danger')
+        
+        return self.render('admin/bulk_update.html',
+                           title='Смена статуса заказов',
+                           ids=','.join(map(str, ids)) if isinstance(ids, list) else '',
+                           count=count,
+                           field='status',
+                           label='Новый статус',
+                           choices=statuses)
 
 class OrderItemAdminView(SecureModelView):
     """Админка для позиций заказа"""
     column_list = ['id', 'order', 'dish', 'quantity', 'price', 'total']
     column_filters = ['order', 'dish']
     column_sortable_list = ['id', 'quantity', 'price']
+    column_default_sort = ('id', True)
+    # У позиций нет даты создания - id растет монотонно и служит ключом
+    keyset_columns = ('id',)
+    column_export_sql = {
+        'order': OrderItem.order_id,
+        'dish': _related_value(Dish.name, OrderItem.dish_id),
+        'total': OrderItem.quantity * OrderItem.price
+    }
     
     form_columns = ['order', 'dish', 'quantity', 'price']
     
@@ -359,23 +762,52 @@ class OrderItemAdminView(SecureModelView):
         'total': 'Сумма'
     }
     
+    form_extra_fields = {
+        'price': FloatField('Цена за шт.', validators=[DataRequired(), NumberRange(min=0)])
+    }
+    
     column_formatters = {
         'total': lambda v, c, m, p: f"{m.quantity * m.price} ₽",
         'price': lambda v, c, m, p: f"{m.price} ₽"
     }
     
+    @staticmethod
+    def _old_value(state, name):
+        history = state.attrs[name].history
+        if history.deleted:
+            return history.deleted[0]
+        return getattr(state.object, name)
+    
     def on_model_change(self, form, model, is_created):
-        order = model.order
-        if order:
-            total = sum(item.quantity * item.price for item in order.items)
-            order.total = total
-            db.session.commit()
+        # Сумма заказа меняется на разницу старой и новой стоимости позиции
+        # в транзакции Flask-Admin, без перечитывания всех позиций
+        new_amount = (model.quantity or 0) * (model.price or 0)
+        new_order = model.order
+        if is_created:
+            old_order, old_amount = None, 0
+        else:
+            state = db.inspect(model)
+            old_order = self._old_value(state, 'order')
+            old_amount = (self._old_value(state, 'quantity') or 0) * (self._old_value(state, 'price') or 0)
+        
+        if old_order is not None and new_order is not None and old_order.id == new_order.id:
+            order_totals.apply_total_delta(new_order, new_amount - old_amount)
+        else:
+            order_totals.apply_total_delta(old_order, -old_amount)
+            order_totals.apply_total_delta(new_order, new_amount)
+    
+    def on_model_delete(self, model):
+        order_totals.apply_total_delta(model.order, -(model.quantity or 0) * (model.price or 0))
 
 class FavoriteAdminView(SecureModelView):
     """Админка для избранного"""
     column_list = ['id', 'user', 'dish', 'added_at']
     column_filters = ['user', 'dish', 'added_at']
     column_sortable_list = ['id', 'added_at']
+    column_export_sql = {
+        'user': _related_value(User.username, Favorite.user_id),
+        'dish': _related_value(Dish.name, Favorite.dish_id)
+    }
     
     form_columns = ['user', 'dish']
     
@@ -389,6 +821,28 @@ class FavoriteAdminView(SecureModelView):
     column_formatters = {
         'added_at': lambda v, c, m, p: m.added_at.strftime('%d.%m.%Y %H:%M')
     }
+    
+    def on_model_change(self, form, model, is_created):
+        # До flush user_id еще прежний, а форма уже записала нового пользователя в user
+        old_user_id = None if is_created else model.user_id
+        new_user_id = model.user.id if model.user else None
+        if old_user_id != new_user_id:
+            User.adjust_counters(old_user_id, favorites=-1)
+            User.adjust_counters(new_user_id, favorites=1)
+        # Кэш избранного прежнего владельца сбрасывается после коммита
+        model._previous_user_id = old_user_id
+    
+    def on_model_delete(self, model):
+        User.adjust_counters(model.user_id, favorites=-1)
+    
+    def after_model_change(self, form, model, is_created):
+        previous_user_id = getattr(model, '_previous_user_id', None)
+        if previous_user_id and previous_user_id != model.user_id:
+            invalidate_favorites(previous_user_id)
+        invalidate_favorites(model.user_id)
+    
+    def after_model_delete(self, model):
+        invalidate_favorites(model.user_id)
 
 class MyAdminIndexView(AdminIndexView):
     def is_accessible(self):
@@ -405,63 +859,52 @@ class MyAdminIndexView(AdminIndexView):
         from .models import User, Order, Dish, Category, ImageQueue
         
         users_count = User.query.count()
-        orders_count = Order.query.count()
+        orders_count, total_revenue = rollups.order_totals()
         dishes_count = Dish.query.count()
         categories_count = Category.query.count()
         
-        # Статистика очереди изображений
-        queue_total = ImageQueue.query.count()
-        queue_pending = ImageQueue.query.filter_by(status='pending').count()
-        queue_failed = ImageQueue.query.filter_by(status='failed').count()
+        # Статистика очереди изображений (один запрос, с кэшем)
+        queue = get_queue_stats()
         
-        today = datetime.now().date()
-        today_orders = Order.query.filter(
-            db.func.date(Order.created_at) == today
-        ).count()
-        
-        # Заказы за последнюю неделю
-        week_ago = datetime.now().date() - timedelta(days=7)
-        recent_orders = Order.query.filter(
-            Order.created_at >= week_ago
-        ).count()
-        
-        # Общая выручка
-        total_revenue = db.session.query(db.func.sum(Order.total)).scalar() or 0
+        # Заказы за сегодня и за последнюю неделю из дневной сводки
+        periods = rollups.dashboard_periods()
+        today_orders = periods['orders_today']
+        recent_orders = periods['orders_week']
         
         # Получаем последние заказы
         orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
         
-        # Получаем популярные блюда
-        from sqlalchemy import func
-        popular_dishes = db.session.query(
-            Dish.name,
-            db.func.count(OrderItem.dish_id).label('count')
-        ).join(OrderItem).group_by(Dish.id).order_by(db.func.count(OrderItem.dish_id).desc()).limit(5).all()
+        # Популярные блюда из счетчиков (кэшируются)
+        popular_dishes = rollups.popular_dishes(limit=5)
+        popular_week = rollups.popular_dishes(days=7, limit=5)
         
         stats = {
             'users_count': users_count,
             'orders_count': orders_count,
             'dishes_count': dishes_count,
             'categories_count': categories_count,
-            'queue_total': queue_total,
-            'queue_pending': queue_pending,
-            'queue_failed': queue_failed,
+            'queue_total': queue['total'],
+            'queue_pending': queue['pending'],
+            'queue_failed': queue['failed'],
             'today_orders': today_orders,
             'recent_orders': recent_orders,
             'total_revenue': total_revenue,
-            'popular_dishes': popular_dishes
+            'popular_dishes': popular_dishes,
+            'popular_week': popular_week
         }
         
         return self.render('admin/index.html', stats=stats, orders=orders)
 
-# Инициализация Flask-Admin
-flask_admin = Admin(name='Food Delivery Admin', 
-                   template_mode='bootstrap4',
-                   url='/admin',
-                   index_view=MyAdminIndexView())
-
 def init_admin(app):
-    """Инициализация админ-панели"""
+    """Инициализация админ-панели.
+
+    Admin создается на каждое приложение: представления Flask-Admin нельзя
+    зарегистрировать во втором приложении (тесты создают приложение на модуль).
+    """
+    flask_admin = Admin(name='Food Delivery Admin', 
+                       template_mode='bootstrap4',
+                       url='/admin',
+                       index_view=MyAdminIndexView())
     flask_admin.init_app(app)
     
     # Добавляем представления моделей
@@ -493,7 +936,8 @@ def init_admin(app):
         new_users = User.query.filter(User.created_at >= week_ago).count()
         
         users_by_date = db.session.query(
-            db.func.date(User.created_at).label('date'),
+            # type_=Date: SQLite возвращает date() строкой, а шаблон вызывает strftime
+            db.func.date(User.created_at, type_=db.Date).label('date'),
             db.func.count(User.id).label('count')
         ).group_by(db.func.date(User.created_at)).order_by(db.func.date(User.created_at).desc()).limit(30).all()
         
@@ -505,7 +949,7 @@ def init_admin(app):
             'users_by_date': users_by_date
         }
         
-        return render_template('admin/user_stats.html', stats=stats)
+        return flask_admin.index_view.render('admin/user_stats.html', stats=stats)
     
     @app.route('/admin/order-stats')
     @login_required
@@ -514,54 +958,87 @@ def init_admin(app):
             flash('Доступ запрещен', 'danger')
             return redirect(url_for('main.index'))
         
-        from .models import Order
-        
-        total_orders = Order.query.count()
-        total_revenue = db.session.query(db.func.sum(Order.total)).scalar() or 0
-        
-        status_stats = db.session.query(
-            Order.status,
-            db.func.count(Order.id).label('count'),
-            db.func.sum(Order.total).label('revenue')
-        ).group_by(Order.status).all()
-        
-        today = datetime.now().date()
-        week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
-        
-        orders_today = Order.query.filter(db.func.date(Order.created_at) == today).count()
-        orders_week = Order.query.filter(db.func.date(Order.created_at) >= week_ago).count()
-        orders_month = Order.query.filter(db.func.date(Order.created_at) >= month_ago).count()
-        
-        revenue_today = db.session.query(db.func.sum(Order.total)).filter(
-            db.func.date(Order.created_at) == today
-        ).scalar() or 0
-        
-        revenue_week = db.session.query(db.func.sum(Order.total)).filter(
-            db.func.date(Order.created_at) >= week_ago
-        ).scalar() or 0
-        
-        revenue_month = db.session.query(db.func.sum(Order.total)).filter(
-            db.func.date(Order.created_at) >= month_ago
-        ).scalar() or 0
-        
-        orders_by_date = db.session.query(
-            db.func.date(Order.created_at).label('date'),
-            db.func.count(Order.id).label('count'),
-            db.func.sum(Order.total).label('revenue')
-        ).group_by(db.func.date(Order.created_at)).order_by(db.func.date(Order.created_at).desc()).limit(30).all()
+        total_orders, total_revenue = rollups.order_totals()
+        status_stats = rollups.status_totals()
+        periods = rollups.dashboard_periods()
+        orders_by_date = rollups.daily_totals(limit=30)
         
         stats = {
             'total_orders': total_orders,
             'total_revenue': total_revenue,
             'status_stats': status_stats,
-            'orders_today': orders_today,
-            'orders_week': orders_week,
-            'orders_month': orders_month,
-            'revenue_today': revenue_today,
-            'revenue_week': revenue_week,
-            'revenue_month': revenue_month,
+            'orders_today': periods['orders_today'],
+            'orders_week': periods['orders_week'],
+            'orders_month': periods['orders_month'],
+            'revenue_today': periods['revenue_today'],
+            'revenue_week': periods['revenue_week'],
+            'revenue_month': periods['revenue_month'],
             'orders_by_date': orders_by_date
         }
         
-        return render_template('admin/order_stats.html', stats=stats)
\ No newline at end of file
+        return flask_admin.index_view.render('admin/order_stats.html', stats=stats)
+    
+    @app.route('/admin/perf')
+    @login_required
+    def perf_stats():
+        if not current_user.is_admin:
+            flash('Доступ запрещен', 'danger')
+            return redirect(url_for('main.index'))
+        
+        return flask_admin.index_view.render(
+            'admin/perf.html',
+            endpoints=perf.endpoint_summary(),
+            slow_queries=perf.slow_queries(),
+            enabled=current_app.config.get('PERF_ENABLED', True),
+            slow_query_ms=current_app.config.get('PERF_SLOW_QUERY_MS'),
+            pid=os.getpid(),
+            workers=metrics.worker_pids()
+        )
+    
+    @app.route('/admin/perf/reset', methods=['POST'])
+    @login_required
+    def perf_reset():
+        if not current_user.is_admin:
+            flash('Доступ запрещен', 'danger')
+            return redirect(url_for('main.index'))
+        
+        perf.reset()
+        flash('Метрики этого процесса сброшены', 'success')
+        return redirect(url_for('perf_stats'))
+    
+    @app.route('/admin/memory')
+    @login_required
+    def memory_stats():
+        if not current_user.is_admin:
+            flash('Доступ запрещен', 'danger')
+            return redirect(url_for('main.index'))
+        
+        group_by = request.args.get('group_by', 'lineno')
+        if group_by not in ('lineno', 'filename', 'traceback'):
+            group_by = 'lineno'
+        limit = request.args.get('limit', 25, type=int)
+        
+        return flask_admin.index_view.render(
+            'admin/memory.html',
+            status=profiling.memory_status(),
+            growth=profiling.growth_since_baseline(limit=limit, group_by=group_by),
+            top=profiling.top_allocations(limit=limit, group_by=group_by),
+            group_by=group_by
+        )
+    
+    @app.route('/admin/memory/<action>', methods=['POST'])
+    @login_required
+    def memory_action(action):
+        if not current_user.is_admin:
+            flash('Доступ запрещен', 'danger')
+            return redirect(url_for('main.index'))
+        
+        if action == 'baseline':
+            profiling.take_baseline()
+            flash('Базовый снимок памяти сохранен', 'success')
+        elif action == 'stop':
+            profiling.stop_tracing()
+            flash('Отслеживание памяти остановлено', 'info')
+        else:
+            flash('Неизвестное действие', 'danger')
+        return redirect(url_for('memory_stats'))
\ No newline at end of file
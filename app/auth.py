@@ -1,12 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user, login_required
-from . import db, bcrypt  # Относительный импорт
+from . import db  # Относительный импорт
 from .models import User
 from .forms import LoginForm, RegistrationForm
+from .passwords import PasswordHasherBusy, needs_rehash
+from .sqlite_profile import deferred_write
+import logging
+
+logger = logging.getLogger(__name__)
 
 auth = Blueprint('auth', __name__)
 
 @auth.route('/register', methods=['GET', 'POST'])
+@deferred_write
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -14,7 +20,11 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('Сервер перегружен, попробуйте зарегистрироваться позже.', 'warning')
+            return render_template('auth/register.html', form=form), 503
         
         db.session.add(user)
         db.session.commit()
@@ -25,6 +35,7 @@ def register():
     return render_template('auth/register.html', form=form)
 
 @auth.route('/login', methods=['GET', 'POST'])
+@deferred_write
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -33,11 +44,28 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         
-        if user and user.check_password(form.password.data):
+        try:
+            password_ok = user is not None and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('Сервер перегружен, попробуйте войти через несколько секунд.', 'warning')
+            return render_template('auth/login.html', form=form), 503
+        
+        if password_ok:
             if not user.is_active:
                 flash('Ваш аккаунт деактивирован.', 'danger')
                 return redirect(url_for('auth.login'))
             
+            # Переводим старые хеши на текущую стоимость bcrypt
+            if needs_rehash(user.password_hash):
+                try:
+                    user.set_password(form.password.data)
+                    db.session.commit()
+                except PasswordHasherBusy:
+                    logger.info(f"Перехеширование пароля {user.id} отложено: пул занят")
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Ошибка перехеширования пароля {user.id}: {e}")
+            
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
             
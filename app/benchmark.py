@@ -0,0 +1,334 @@
+"""Нагрузочный тест витрины и оформления заказа.
+
+Виртуальные пользователи - потоки со своей сессией requests. Каждый
+регистрируется, входит и по кругу проходит сценарий покупателя: главная ->
+меню категории -> добавление в корзину -> корзина -> оформление заказа, иногда
+переключая избранное. По каждому шагу считаются p50/p95/p99 и запросы в
+секунду; отчет сохраняется в JSON, чтобы сравнивать прогоны между коммитами.
+
+Запуск: flask bench (локальный сервер на временной базе) или
+flask bench --url http://127.0.0.1:8000 (уже запущенный gunicorn с данными).
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from config import Config
+from .perf import percentile
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_LINK = re.compile(r'href="/menu/(\d+)"')
+DISH_ID = re.compile(r'data-dish-id="(\d+)"')
+CSRF_META = re.compile(r'<meta name="csrf-token" content="([^"]*)"')
+
+# Доля сессий, в которых пользователь переключает избранное
+FAVORITE_SHARE = 0.3
+CHECKOUT_FORM = {'address': 'ул. Ленина, дом 1, кв. 1', 'phone': '+79990000000'}
+# Оформленный заказ - редирект в историю заказов; редирект в корзину или обратно
+# на /checkout значит, что заказ не создан (пустая корзина, ошибка, недоступное блюдо)
+CHECKOUT_SUCCESS_PATH = '/user/orders'
+
+# ----------------------------------------------------------------------------
+# Локальный сервер
+# ----------------------------------------------------------------------------
+
+def bench_config(database_url):
+    """Конфигурация локального прогона: своя база, тихие логи, дешевый bcrypt"""
+    return type('BenchConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'AUTO_INIT_DB': True,
+        'LOG_TO_STDOUT': True,
+        'LOG_LEVEL': 'WARNING',
+        # Регистрация виртуальных пользователей не должна упираться в bcrypt
+        'BCRYPT_LOG_ROUNDS': 4,
+    })
+
+@contextmanager
+def local_server(database_url=None):
+    """Поднимает приложение на 127.0.0.1 в отдельном потоке и отдает его адрес.
+
+    Без database_url используется временная SQLite-база. Пустая база
+    заполняется небольшим набором seed_scale.
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from . import create_app, db
+    from .bootstrap import dispose_engines
+    from .models import Category
+    from .seed_scale import SMALL_DATASET, rebuild_derived, seed_scale
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    workdir = None
+    if database_url is None:
+        workdir = tempfile.mkdtemp(prefix='bench-')
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    try:
+        app = create_app(bench_config(database_url))
+        with app.app_context():
+            if db.session.query(Category.id).first() is None:
+                seed_scale(**SMALL_DATASET)
+                rebuild_derived()
+
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, name='bench-server', daemon=True)
+        thread.start()
+        try:
+            yield f'http://127.0.0.1:{server.server_port}'
+        finally:
+            server.shutdown()
+            thread.join()
+            with app.app_context():
+                dispose_engines()
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+# ----------------------------------------------------------------------------
+# Виртуальные пользователи
+# ----------------------------------------------------------------------------
+
+class Recorder:
+    """Время ответов и ошибки по шагам сценария, общий для всех потоков"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        # Окно шага: начало первого и конец последнего запроса (perf_counter)
+        self.windows = {}
+        self._lock = threading.Lock()
+
+    def add(self, step, elapsed_ms, ok):
+        finished = time.perf_counter()
+        started = finished - elapsed_ms / 1000
+        with self._lock:
+            self.samples.setdefault(step, []).append(elapsed_ms)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+            window = self.windows.get(step)
+            if window is None:
+                self.windows[step] = [started, finished]
+            else:
+                window[0] = min(window[0], started)
+                window[1] = max(window[1], finished)
+
+    def window(self):
+        """Длительность от первого до последнего записанного запроса, секунд"""
+        with self._lock:
+            if not self.windows:
+                return 0
+            return (max(finished for _, finished in self.windows.values()) -
+                    min(started for started, _ in self.windows.values()))
+
+    def summary(self):
+        """Перцентили по шагам; RPS шага - за его собственное окно.
+
+        Регистрация и вход проходят до общего окна замера, поэтому их запросы
+        нельзя делить на длительность замера.
+        """
+        steps = {}
+        for step, values in sorted(self.samples.items()):
+            values = sorted(values)
+            started, finished = self.windows[step]
+            window = finished - started
+            steps[step] = {
+                'count': len(values),
+                'errors': self.errors.get(step, 0),
+                'window': round(window, 2),
+                'rps': round(len(values) / window, 2) if window else 0,
+                'p50': round(percentile(values, 50), 2),
+                'p95': round(percentile(values, 95), 2),
+                'p99': round(percentile(values, 99), 2),
+                'max': round(values[-1], 2),
+                'mean': round(sum(values) / len(values), 2),
+            }
+        return steps
+
+class VirtualUser:
+    """Один покупатель: своя сессия (cookie, CSRF-токен) и свой генератор случайных чисел"""
+
+    def __init__(self, base_url, username, recorder, rng, think=0.0):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.http = requests.Session()
+        self.csrf_token = ''
+        self.orders = 0
+
+    def request(self, step, method, path, expect_location=None, **kwargs):
+        """Выполняет запрос без перехода по редиректам и записывает его время.
+
+        С expect_location успешен только редирект на этот путь, иначе - ответ с кодом < 400.
+        """
+        if method == 'POST':
+            kwargs.setdefault('headers', {})['X-CSRFToken'] = self.csrf_token
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, allow_redirects=False,
+                                         timeout=30, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.add(f'{method} {step}', (time.perf_counter() - started) * 1000, False)
+            logger.debug("Ошибка запроса %s %s: %s", method, path, e)
+            return None
+        self.recorder.add(f'{method} {step}', (time.perf_counter() - started) * 1000,
+                          _succeeded(response, expect_location))
+
+        token = CSRF_META.search(response.text) if 'text/html' in response.headers.get('Content-Type', '') else None
+        if token and token.group(1):
+            self.csrf_token = token.group(1)
+        if self.think:
+            time.sleep(self.rng.uniform(0, 2 * self.think))
+        return response
+
+    def sign_up(self, password):
+        self.request('auth.register', 'GET', '/auth/register')
+        self.request('auth.register', 'POST', '/auth/register', data={
+            'username': self.username, 'password': password, 'confirm_password': password
+        })
+        self.request('auth.login', 'POST', '/auth/login',
+                     data={'username': self.username, 'password': password})
+
+    def shopping_session(self):
+        """Один проход сценария покупателя"""
+        index = self.request('main.index', 'GET', '/')
+        categories = sorted(set(CATEGORY_LINK.findall(index.text))) if index is not None else []
+        if not categories:
+            return
+
+        menu = self.request('main.menu', 'GET', f'/menu/{self.rng.choice(categories)}')
+        dishes = sorted(set(DISH_ID.findall(menu.text))) if menu is not None else []
+        if not dishes:
+            return
+
+        for dish_id in self.rng.sample(dishes, min(len(dishes), self.rng.randint(1, 3))):
+            self.request('main.add_to_cart', 'POST', f'/add_to_cart/{dish_id}')
+        self.request('main.cart', 'GET', '/cart')
+
+        if self.rng.random() < FAVORITE_SHARE:
+            self.request('main.add_to_favorites', 'POST', f'/add_to_favorites/{self.rng.choice(dishes)}')
+
+        self.request('main.checkout', 'GET', '/checkout')
+        response = self.request('main.checkout', 'POST', '/checkout', data=CHECKOUT_FORM,
+                                expect_location=CHECKOUT_SUCCESS_PATH)
+        if response is not None and _succeeded(response, CHECKOUT_SUCCESS_PATH):
+            self.orders += 1
+
+def _succeeded(response, expect_location=None):
+    if expect_location is None:
+        return response.status_code < 400
+    return response.is_redirect and urlsplit(response.headers['Location']).path == expect_location
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmark(base_url, users=10, duration=30.0, think=0.0, seed=1):
+    """Гоняет users виртуальных пользователей duration секунд. Возвращает отчет"""
+    recorder = Recorder()
+    # Имена уникальны между прогонами: база может быть постоянной (--url, --database-url)
+    run_id = f'{int(time.time()):x}'
+    deadline = None
+    signed_up = threading.Barrier(users + 1)
+    started = threading.Event()
+    sessions = []
+    orders = []
+
+    def worker(number):
+        user = VirtualUser(base_url, f'bench_{run_id}_{number}', recorder,
+                           random.Random(seed * 1000 + number), think)
+        user.sign_up('bench-pass')
+        signed_up.wait()
+        started.wait()
+        completed = 0
+        while time.monotonic() < deadline:
+            user.shopping_session()
+            completed += 1
+        sessions.append(completed)
+        orders.append(user.orders)
+
+    threads = [threading.Thread(target=worker, args=(number,), name=f'bench-vu-{number}', daemon=True)
+               for number in range(users)]
+    for thread in threads:
+        thread.start()
+
+    # Регистрация в отчет входит, но окно измерения RPS начинается после нее
+    signed_up.wait()
+    window_started = time.perf_counter()
+    deadline = time.monotonic() + duration
+    started.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - window_started
+
+    steps = recorder.summary()
+    total = sum(step['count'] for step in steps.values())
+    # Общий RPS - по окну всех записанных запросов, включая регистрацию
+    window = recorder.window()
+    return {
+        'commit': _git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'target': base_url,
+        'users': users,
+        'duration': duration,
+        'think': think,
+        'seed': seed,
+        'python': platform.python_version(),
+        'elapsed': round(elapsed, 2),
+        'sessions': sum(sessions),
+        'orders': sum(orders),
+        'requests': total,
+        'errors': sum(step['errors'] for step in steps.values()),
+        'rps': round(total / window, 2) if window else 0,
+        'steps': steps,
+    }
+
+# ----------------------------------------------------------------------------
+# Отчеты
+# ----------------------------------------------------------------------------
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare_reports(baseline, report):
+    """Изменения p95 и RPS по шагам относительно прошлого прогона, в процентах"""
+    rows = []
+    for step, stats in report['steps'].items():
+        before = baseline['steps'].get(step)
+        if before is None:
+            continue
+        rows.append({
+            'step': step,
+            'p95_before': before['p95'],
+            'p95': stats['p95'],
+            'p95_change': round((stats['p95'] / before['p95'] - 1) * 100, 1) if before['p95'] else None,
+            'rps_before': before['rps'],
+            'rps': stats['rps'],
+            'rps_change': round((stats['rps'] / before['rps'] - 1) * 100, 1) if before['rps'] else None,
+        })
+    return rows
@@ -0,0 +1,95 @@
+from . import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMIN_USERNAME = 'admin'
+DEFAULT_ADMIN_PASSWORD = '25102510'
+
+def create_schema():
+    """Создает недостающие таблицы, колонки и индексы.
+
+    create_all не трогает существующие таблицы: новые колонки и индексы
+    добавляют шаги app/migrations.py.
+    """
+    from .migrations import upgrade_schema
+    upgrade_schema()
+    logger.info("Таблицы БД созданы/проверены")
+
+def ensure_admin():
+    """Создает администратора по умолчанию, если его еще нет. Возвращает True, если создан"""
+    from .models import User
+    if User.query.filter_by(username=DEFAULT_ADMIN_USERNAME).first():
+        return False
+
+    admin_user = User(username=DEFAULT_ADMIN_USERNAME, is_admin=True)
+    admin_user.set_password(DEFAULT_ADMIN_PASSWORD)
+    db.session.add(admin_user)
+    db.session.commit()
+    logger.info(f"Администратор создан (логин: {DEFAULT_ADMIN_USERNAME}, пароль: {DEFAULT_ADMIN_PASSWORD})")
+    return True
+
+def prepare_database():
+    """Шаг релиза: схема и администратор. Выполняется один раз, а не в каждом воркере"""
+    create_schema()
+    return ensure_admin()
+
+def dispose_engines(close=True):
+    """Сбрасывает пулы соединений всех движков.
+
+    В родителе перед fork соединения закрываются (close=True). В дочернем
+    процессе после fork (gunicorn --preload) - close=False: сокеты родителя
+    только забываются, чтобы не закрыть их из воркера.
+    """
+    for engine in db.engines.values():
+        engine.dispose(close=close)
+
+# ----------------------------------------------------------------------------
+# Профиль времени импорта
+# ----------------------------------------------------------------------------
+
+_BOOT_SCRIPT = 'from app import create_app; create_app()'
+
+def _parse_importtime(output):
+    """Разбирает вывод python -X importtime: [(уровень, имя, собственное мкс, общее мкс)]"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # строка заголовка
+        name = parts[2].rstrip()
+        level = (len(name) - len(name.lstrip())) // 2
+        rows.append((level, name.strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+def import_profile(limit=15):
+    """Запускает create_app в отдельном процессе с -X importtime.
+
+    Возвращает общее время импорта (мкс), самые долгие импорты верхнего
+    уровня и пакеты с наибольшим собственным временем.
+    """
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ, AUTO_INIT_DB='false')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _BOOT_SCRIPT],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    rows = _parse_importtime(result.stderr)
+
+    top_level = sorted((row for row in rows if row[0] == 0), key=lambda row: row[3], reverse=True)
+    packages = {}
+    for level, name, own, cumulative in rows:
+        root = name.split('.')[0]
+        packages[root] = packages.get(root, 0) + own
+
+    return {
+        'total': sum(row[3] for row in top_level),
+        'top_level': [(name, cumulative) for level, name, own, cumulative in top_level[:limit]],
+        'packages': sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+    }
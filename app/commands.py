@@ -2,7 +2,6 @@ import click
 from flask import current_app
 from . import db
 from .models import User, Category, Dish
-from .parsers.nsm_parser import save_nsm_menu_to_db
 import json
 import os
 
@@ -31,6 +30,9 @@ def init_app(app):
     def init_database():
         """Инициализация базы данных с тестовыми данными"""
         with app.app_context():
+            from .bootstrap import create_schema
+            create_schema()
+            
             # Создаём категории
             categories_data = [
                 {'name': 'Пицца', 'image': 'pizza.jpg'},
@@ -98,6 +100,240 @@ def init_app(app):
             else:
                 click.echo('❌ Не удалось получить меню')
     
+    @app.cli.command('recount-users')
+    def recount_users():
+        """Пересчет счетчиков заказов и избранного у пользователей"""
+        with app.app_context():
+            updated = User.recount_counters()
+            db.session.commit()
+            click.echo(f'Счетчики пересчитаны для {updated} пользователей')
+    
+    @app.cli.command('calibrate-bcrypt')
+    @click.option('--target-ms', default=250, show_default=True, help='Целевое время проверки пароля')
+    def calibrate_bcrypt(target_ms):
+        """Подбор стоимости bcrypt под целевую задержку на этом сервере"""
+        from .passwords import calibrate_rounds
+        
+        click.echo(f'Замеряю проверку пароля (цель: {target_ms} мс)...')
+        best, results = calibrate_rounds(target_ms)
+        for rounds, elapsed in results:
+            click.echo(f'  rounds={rounds}: {elapsed:.1f} мс')
+        
+        click.echo(f'Рекомендуемое значение: BCRYPT_LOG_ROUNDS={best} '
+                   f'(сейчас {app.config["BCRYPT_LOG_ROUNDS"]})')
+        click.echo('Старые хеши будут перехешированы при следующем входе пользователей')
+    
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups():
+        """Пересборка сводки заказов и популярности блюд"""
+        with app.app_context():
+            from .rollups import rebuild_daily_stats, rebuild_dish_stats
+            
+            rows = rebuild_daily_stats()
+            click.echo(f'Сводка заказов пересобрана: {rows} строк')
+            rows = rebuild_dish_stats()
+            click.echo(f'Популярность блюд пересобрана: {rows} дневных строк')
+    
+    @app.cli.command('build-recommendations')
+    @click.option('--full', is_flag=True, help='Пересчитать с нуля, а не только новые заказы')
+    def build_recommendations_command(full):
+        """Построение рекомендаций "с этим также заказывают" """
+        with app.app_context():
+            from .recommendations import build_recommendations
+            
+            pairs = build_recommendations(full=full)
+            click.echo(f'Рекомендации обновлены: обработано {pairs} пар блюд')
+    
+    @app.cli.command('check-order-totals')
+    @click.option('--fix', is_flag=True, help='Исправить найденные расхождения')
+    def check_order_totals_command(fix):
+        """Проверка сумм заказов по их позициям"""
+        with app.app_context():
+            from .order_totals import drifted_orders, repair_order_totals
+            
+            drifted = drifted_orders(limit=20)
+            if not drifted:
+                click.echo('Суммы всех заказов совпадают с позициями')
+                return
+            
+            for order_id, total, items_total in drifted:
+                click.echo(f'  Заказ #{order_id}: {total} ₽, по позициям {items_total} ₽')
+            
+            if fix:
+                repaired = repair_order_totals()
+                click.echo(f'Исправлено заказов: {repaired}')
+            else:
+                click.echo('Запустите с --fix, чтобы исправить суммы')
+    
+    @app.cli.command('compact-image-queue')
+    @click.option('--all', 'drain', is_flag=True, help='Удалить все задачи, а не только устаревшие')
+    @click.option('--batch-size', default=1000, help='Задач в одном DELETE')
+    @click.option('--time-budget', default=300, help='Максимальное время работы, секунд')
+    def compact_image_queue_command(drain, batch_size, time_budget):
+        """Очистка очереди изображений по сроку хранения (для запуска по расписанию)"""
+        with app.app_context():
+            from .queue_retention import compact_queue, drain_queue, remaining_count
+            
+            if drain:
+                deleted = drain_queue(batch_size=batch_size, time_budget=time_budget)
+            else:
+                deleted = compact_queue(batch_size=batch_size, time_budget=time_budget)
+            click.echo(f'Удалено задач из очереди: {deleted}')
+            remaining = remaining_count() if drain else 0
+            if remaining:
+                click.echo(f'Не уложились в --time-budget, осталось задач: {remaining}')
+    
+    @app.cli.command('prepare-db')
+    def prepare_db_command():
+        """Создание таблиц и администратора (шаг релиза, до запуска воркеров)"""
+        with app.app_context():
+            from .bootstrap import prepare_database
+            
+            created = prepare_database()
+            click.echo('Таблицы БД созданы/проверены')
+            if created:
+                click.echo('Администратор создан (логин: admin)')
+    
+    @app.cli.command('import-profile')
+    @click.option('--limit', default=15, help='Сколько строк показать в каждом разделе')
+    def import_profile_command(limit):
+        """Профиль времени импорта при запуске приложения (python -X importtime)"""
+        from .bootstrap import import_profile
+        
+        report = import_profile(limit=limit)
+        if not report['top_level']:
+            click.echo('Не удалось получить профиль импорта')
+            return
+        
+        click.echo(f"Импорт при запуске: {report['total'] / 1000:.1f} мс")
+        click.echo('\nИмпорты верхнего уровня (с зависимостями):')
+        for name, cumulative in report['top_level']:
+            click.echo(f'  {cumulative / 1000:8.1f} мс  {name}')
+        click.echo('\nПакеты (собственное время):')
+        for name, own in report['packages']:
+            click.echo(f'  {own / 1000:8.1f} мс  {name}')
+    
+    @app.cli.command('bench')
+    @click.option('--users', default=10, show_default=True, help='Число виртуальных пользователей')
+    @click.option('--duration', default=30.0, show_default=True, help='Длительность замера, секунд')
+    @click.option('--think', default=0.0, show_default=True, help='Средняя пауза между запросами, секунд')
+    @click.option('--seed', default=1, show_default=True, help='Seed сценариев пользователей')
+    @click.option('--url', default=None, help='Адрес запущенного сервера вместо локального')
+    @click.option('--database-url', default=None, help='База для локального сервера (по умолчанию временная SQLite)')
+    @click.option('--output', default=None, help='Файл отчета JSON (по умолчанию bench-results/)')
+    @click.option('--compare', 'compare_path', default=None, help='Сравнить с прошлым отчетом JSON')
+    def bench_command(users, duration, think, seed, url, database_url, output, compare_path):
+        """Нагрузочный тест сценариев покупателя: p50/p95/p99 и RPS по шагам"""
+        from contextlib import nullcontext
+        from datetime import datetime
+        from .benchmark import compare_reports, load_report, local_server, run_benchmark, save_report
+        
+        server = nullcontext(url) if url else local_server(database_url)
+        with server as base_url:
+            click.echo(f'Нагрузка на {base_url}: {users} пользователей, {duration:g} с')
+            report = run_benchmark(base_url, users=users, duration=duration, think=think, seed=seed)
+        
+        click.echo(f"{'шаг':32} {'запр.':>7} {'ошиб.':>6} {'RPS':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for step, stats in report['steps'].items():
+            click.echo(f"{step:32} {stats['count']:7} {stats['errors']:6} {stats['rps']:8.1f} "
+                       f"{stats['p50']:8.1f} {stats['p95']:8.1f} {stats['p99']:8.1f}")
+        click.echo(f"Всего: {report['requests']} запросов, {report['errors']} ошибок, "
+                   f"{report['rps']:.1f} RPS, сессий {report['sessions']}, "
+                   f"заказов {report['orders']} (время в мс)")
+        
+        if output is None:
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            output = os.path.join('bench-results', f"bench-{stamp}-{report['commit'] or 'nogit'}.json")
+        save_report(report, output)
+        click.echo(f'Отчет сохранен: {output}')
+        
+        if compare_path:
+            baseline = load_report(compare_path)
+            click.echo(f"Сравнение с {compare_path} (коммит {baseline.get('commit') or '-'}):")
+            for row in compare_reports(baseline, report):
+                p95_change = '-' if row['p95_change'] is None else f"{row['p95_change']:+.1f}%"
+                rps_change = '-' if row['rps_change'] is None else f"{row['rps_change']:+.1f}%"
+                click.echo(f"  {row['step']:32} p95 {row['p95_before']:8.1f} -> {row['p95']:8.1f} ({p95_change})  "
+                           f"RPS {row['rps_before']:8.1f} -> {row['rps']:8.1f} ({rps_change})")
+    
+    @app.cli.command('seed-scale')
+    @click.option('--categories', default=15, show_default=True)
+    @click.option('--dishes', default=3000, show_default=True)
+    @click.option('--users', default=100_000, show_default=True)
+    @click.option('--orders', default=1_000_000, show_default=True)
+    @click.option('--favorites', default=300_000, show_default=True, help='Попыток добавить в избранное (дубли отбрасываются)')
+    @click.option('--image-queue', default=50_000, show_default=True, help='Задач в бэклоге очереди изображений')
+    @click.option('--days', default=365, show_default=True, help='Период заказов в днях')
+    @click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Последний день периода (по умолчанию сегодня)')
+    @click.option('--seed', default=42, show_default=True)
+    @click.option('--password', default='scale-pass', show_default=True, help='Пароль всех созданных пользователей')
+    @click.option('--batch-size', default=10_000, show_default=True)
+    @click.option('--skip-derived', is_flag=True, help='Не пересобирать сводки, счетчики и рекомендации')
+    @click.option('--yes', is_flag=True, help='Добавить данные в непустую базу')
+    def seed_scale_command(categories, dishes, users, orders, favorites, image_queue, days, until,
+                           seed, password, batch_size, skip_derived, yes):
+        """Генерация данных в больших объемах для нагрузочных тестов"""
+        import time
+        from .seed_scale import existing_rows, rebuild_derived, seed_scale
+        
+        reported = {}
+        
+        def progress(table, written):
+            # Не чаще раза в 100 тысяч строк на таблицу
+            if written - reported.get(table, 0) >= 100_000 or table not in reported:
+                reported[table] = written
+                click.echo(f'  {table}: {written}')
+        
+        with app.app_context():
+            existing = existing_rows()
+            if existing and not yes:
+                click.echo('В базе уже есть данные: ' +
+                           ', '.join(f'{table} {count}' for table, count in existing.items()))
+                click.echo('Сгенерированные строки добавятся к ним (это не тестовая база?). '
+                           'Запустите с --yes, чтобы продолжить')
+                raise SystemExit(1)
+            
+            started = time.perf_counter()
+            counts = seed_scale(
+                dishes=dishes, categories=categories, users=users, orders=orders,
+                favorites=favorites, image_queue=image_queue, days=days, seed=seed,
+                until=until.date() if until else None, password=password,
+                batch_size=batch_size, progress=progress
+            )
+            click.echo(f'Вставлено за {time.perf_counter() - started:.1f} с: ' +
+                       ', '.join(f'{table} {count}' for table, count in counts.items()))
+            
+            if not skip_derived:
+                started = time.perf_counter()
+                rebuild_derived()
+                click.echo(f'Сводки, счетчики блюд и рекомендации пересобраны за {time.perf_counter() - started:.1f} с')
+    
+    @app.cli.command('sqlite-bench')
+    @click.option('--profile', 'profiles', multiple=True, type=click.Choice(['default', 'wal', 'wal+queue']),
+                  help='Профили для сравнения (по умолчанию все)')
+    @click.option('--processes', default=4, show_default=True, help='Процессов, как воркеров gunicorn')
+    @click.option('--threads', default=4, show_default=True, help='Потоков в каждом процессе')
+    @click.option('--seconds', default=10, show_default=True)
+    @click.option('--write-share', default=0.3, show_default=True, help='Доля пишущих операций')
+    @click.option('--no-parser', is_flag=True, help='Без долгой пишущей транзакции')
+    def sqlite_bench(profiles, processes, threads, seconds, write_share, no_parser):
+        """Сравнение профилей SQLite под конкурентной записью и чтением"""
+        from .sqlite_profile import compare_profiles
+        
+        report = compare_profiles(profiles or None, processes=processes, threads=threads,
+                                  seconds=seconds, write_share=write_share, parser=not no_parser)
+        
+        click.echo(f"{'профиль':10} {'операция':8} {'всего':>7} {'в сек.':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for name, summary in report.items():
+            for kind in ('read', 'write', 'parser'):
+                stats = summary[kind]
+                click.echo(f"{name:10} {kind:8} {stats['count']:7} {stats['per_second']:8.1f} "
+                           f"{stats['p50']:8.1f} {stats['p95']:8.1f} {stats['p99']:8.1f}")
+            errors = ', '.join(f'{kind} {count}' for kind, count in sorted(summary['errors'].items()))
+            click.echo(f"{name:10} ошибки: {errors or 'нет'}")
+        click.echo('Время в мс')
+    
     # НОВАЯ КОМАНДА: Обновление изображений категорий
     @app.cli.command('update-category-images')
     def update_category_images():
@@ -0,0 +1,153 @@
+"""Профили движков БД и чтение с реплики.
+
+Профиль (DB_ENGINE_PROFILE) задает пул соединений, pre-ping, recycle и
+statement_timeout; отдельные значения переопределяются переменными DB_POOL_*.
+
+Если задан DATABASE_REPLICA_URL, сессия RoutingSession отправляет запросы
+read-only страниц (главная, меню, статистика и экспорт админки) на bind
+'replica'. Запись, все остальные страницы, CLI и фоновые задачи работают с
+основной базой. После записи клиент несколько секунд (DB_REPLICA_STICKY_SECONDS)
+читает с основной базы, чтобы видеть свои изменения несмотря на отставание реплики.
+"""
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+import click
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+ENGINE_PROFILES = {
+    # Воркер gunicorn с потоками: пул не меньше числа потоков, ограничение времени запроса
+    'web': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10, 'pool_recycle': 1800,
+            'pool_pre_ping': True, 'statement_timeout_ms': 15000},
+    # CLI и фоновые задачи: мало соединений, долгие пересчеты без ограничения
+    'worker': {'pool_size': 2, 'max_overflow': 2, 'pool_timeout': 30, 'pool_recycle': 1800,
+               'pool_pre_ping': True, 'statement_timeout_ms': 0},
+    # Маленький тариф БД с лимитом соединений на все воркеры
+    'small': {'pool_size': 2, 'max_overflow': 1, 'pool_timeout': 10, 'pool_recycle': 300,
+              'pool_pre_ping': True, 'statement_timeout_ms': 15000},
+}
+
+OVERRIDES = {
+    'pool_size': 'DB_POOL_SIZE',
+    'max_overflow': 'DB_MAX_OVERFLOW',
+    'pool_timeout': 'DB_POOL_TIMEOUT',
+    'pool_recycle': 'DB_POOL_RECYCLE',
+    'pool_pre_ping': 'DB_POOL_PRE_PING',
+    'statement_timeout_ms': 'DB_STATEMENT_TIMEOUT_MS',
+}
+
+# Эндпоинты, которые читают с реплики (GET), и суффиксы эндпоинтов Flask-Admin
+REPLICA_ENDPOINTS = {
+    'main.index', 'main.menu',
+    'admin.index', 'user_stats', 'order_stats', 'admin_parsing.queue_stats',
+}
+REPLICA_ENDPOINT_SUFFIXES = ('.export',)
+
+def default_profile():
+    """Профиль без DB_ENGINE_PROFILE: worker для команд flask, иначе web.
+
+    Приложение команды CLI создается внутри контекста click; миграции и
+    пересчеты в prepare-db и по расписанию не должны упираться в statement_timeout
+    веб-профиля. flask run (локальная разработка) тоже получает worker.
+    """
+    return 'worker' if click.get_current_context(silent=True) is not None else 'web'
+
+def engine_options(config, url):
+    """Параметры create_engine для url по профилю и переопределениям из config"""
+    profile_name = config.get('DB_ENGINE_PROFILE') or default_profile()
+    if profile_name not in ENGINE_PROFILES:
+        logger.warning("Неизвестный профиль движка %s, используется web", profile_name)
+        profile_name = 'web'
+    options = dict(ENGINE_PROFILES[profile_name])
+    for option, config_key in OVERRIDES.items():
+        if config.get(config_key) is not None:
+            options[option] = config[config_key]
+
+    statement_timeout = options.pop('statement_timeout_ms')
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Для базы в памяти Flask-SQLAlchemy ставит StaticPool: параметров пула у него нет
+        return {}
+    if backend == 'postgresql' and statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+def configure_engines(app):
+    """Заполняет SQLALCHEMY_ENGINE_OPTIONS и bind реплики до db.init_app"""
+    config = app.config
+    if not config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_url, **engine_options(config, replica_url)}
+        config['SQLALCHEMY_BINDS'] = binds
+
+# ----------------------------------------------------------------------------
+# Маршрутизация чтения
+# ----------------------------------------------------------------------------
+
+def _replica_allowed():
+    return has_request_context() and g.get('db_replica', False) and not g.get('db_wrote', False)
+
+class RoutingSession(Session):
+    """Сессия Flask-SQLAlchemy, которая в read-only запросах читает с реплики"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False) \
+                and _replica_allowed():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _mark_write(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+def _on_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+def is_replica_endpoint(endpoint):
+    endpoints = current_app.extensions.get('db_replica_endpoints', REPLICA_ENDPOINTS)
+    return endpoint in endpoints or (endpoint or '').endswith(REPLICA_ENDPOINT_SUFFIXES)
+
+def _choose_bind():
+    if request.method not in READ_METHODS or not is_replica_endpoint(request.endpoint):
+        return
+    # Недавно писавший клиент читает с основной базы
+    if session.get('db_primary_until', 0) > time.time():
+        return
+    g.db_replica = True
+
+def _remember_write(response):
+    if g.get('db_wrote'):
+        session['db_primary_until'] = time.time() + current_app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+    return response
+
+_listening = False
+
+def init_routing(app):
+    """Подключает чтение с реплики, если задан DATABASE_REPLICA_URL"""
+    global _listening
+    if not app.config.get('DATABASE_REPLICA_URL'):
+        return
+    if not _listening:
+        event.listen(RoutingSession, 'after_flush', _mark_write)
+        event.listen(RoutingSession, 'do_orm_execute', _on_orm_execute)
+        _listening = True
+    endpoints = REPLICA_ENDPOINTS | set(app.config.get('DB_REPLICA_ENDPOINTS') or ())
+    app.extensions['db_replica_endpoints'] = endpoints
+    app.before_request(_choose_bind)
+    app.after_request(_remember_write)
+    app.logger.info("Чтение с реплики включено для %d эндпоинтов", len(endpoints))
@@ -0,0 +1,90 @@
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import Favorite, User
+from . import metrics
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Кэш избранного: user_id -> (время загрузки, битовая маска dish_id)
+_bitmap_cache = {}
+_bitmap_lock = threading.Lock()
+
+def _cache_ttl():
+    return current_app.config.get('FAVORITES_CACHE_TTL', 0)
+
+def _load_bitmap(user_id):
+    """Собирает битовую маску всех избранных блюд пользователя"""
+    bitmap = 0
+    rows = db.session.query(Favorite.dish_id).filter(
+        Favorite.user_id == user_id,
+        Favorite.dish_id.isnot(None)
+    )
+    for (dish_id,) in rows:
+        bitmap |= 1 << dish_id
+    return bitmap
+
+def _get_bitmap(user_id, ttl):
+    now = time.monotonic()
+    with _bitmap_lock:
+        cached = _bitmap_cache.get(user_id)
+    if cached and now - cached[0] < ttl:
+        metrics.record_cache('favorites', True)
+        return cached[1]
+
+    metrics.record_cache('favorites', False)
+    bitmap = _load_bitmap(user_id)
+    with _bitmap_lock:
+        _bitmap_cache[user_id] = (now, bitmap)
+    return bitmap
+
+def invalidate_favorites(user_id):
+    """Сбрасывает кэш избранного пользователя"""
+    with _bitmap_lock:
+        _bitmap_cache.pop(user_id, None)
+
+def get_favorite_ids(user_id, dish_ids):
+    """Возвращает множество избранных блюд среди переданных dish_ids"""
+    dish_ids = list(dish_ids)
+    if not dish_ids:
+        return set()
+
+    ttl = _cache_ttl()
+    if ttl > 0:
+        bitmap = _get_bitmap(user_id, ttl)
+        return {dish_id for dish_id in dish_ids if bitmap >> dish_id & 1}
+
+    rows = db.session.query(Favorite.dish_id).filter(
+        Favorite.user_id == user_id,
+        Favorite.dish_id.in_(dish_ids)
+    )
+    return {dish_id for (dish_id,) in rows}
+
+def toggle_favorite(user_id, dish_id):
+    """Добавляет или удаляет блюдо из избранного без предварительного SELECT.
+
+    Возвращает 'added' или 'removed'. Коммит и сброс кэша
+    (invalidate_favorites) остаются за вызывающим кодом.
+    """
+    deleted = Favorite.query.filter_by(
+        user_id=user_id,
+        dish_id=dish_id
+    ).delete(synchronize_session=False)
+
+    if deleted:
+        User.adjust_counters(user_id, favorites=-deleted)
+        action = 'removed'
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Favorite(user_id=user_id, dish_id=dish_id))
+            User.adjust_counters(user_id, favorites=1)
+        except IntegrityError:
+            # Параллельный запрос уже добавил это блюдо
+            logger.debug(f"Избранное user:{user_id} dish:{dish_id} уже существует")
+        action = 'added'
+
+    return action
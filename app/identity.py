@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from . import db
+from .models import User
+from .stamps import read_stamp, touch_stamp
+from . import metrics
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# LRU кэш пользователей процесса: (user_id, auth_version) -> (истекает, значения колонок)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stamp_seen = None
+
+def _parse_token(token):
+    """Разбирает идентификатор сессии вида 'id:version' (или старый 'id')"""
+    user_id, _, version = str(token).partition(':')
+    try:
+        return int(user_id), int(version) if version else None
+    except ValueError:
+        return None, None
+
+def _read_stamp():
+    return read_stamp(current_app.config['IDENTITY_CACHE_STAMP'])
+
+def _sync_with_stamp():
+    """Сбрасывает кэш, если другой процесс отметил изменение пользователей"""
+    global _stamp_seen
+    stamp = _read_stamp()
+    with _cache_lock:
+        if stamp != _stamp_seen:
+            _cache.clear()
+            _stamp_seen = stamp
+
+def _snapshot(user):
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def _restore(values):
+    """Прикрепляет пользователя из кэша к текущей сессии без запроса к БД"""
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def _is_valid(user, version):
+    if user is None or not user.is_active:
+        return False
+    return version is None or user.auth_version == version
+
+def load_user(token):
+    """Загружает пользователя для Flask-Login с кэшированием в памяти процесса"""
+    user_id, version = _parse_token(token)
+    if user_id is None:
+        return None
+
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if ttl <= 0:
+        user = db.session.get(User, user_id)
+        return user if _is_valid(user, version) else None
+
+    _sync_with_stamp()
+    key = (user_id, version)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            values = entry[1]
+        else:
+            _cache.pop(key, None)
+            values = None
+
+    metrics.record_cache('identity', values is not None)
+    if values is not None:
+        return _restore(values)
+
+    user = db.session.get(User, user_id)
+    if not _is_valid(user, version):
+        return None
+
+    with _cache_lock:
+        _cache[key] = (now + ttl, _snapshot(user))
+        while len(_cache) > current_app.config.get('IDENTITY_CACHE_SIZE', 1024):
+            _cache.popitem(last=False)
+    return user
+
+def invalidate_user(user_id):
+    """Убирает пользователя из кэша этого процесса и сбрасывает кэш остальных"""
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == user_id]:
+            del _cache[key]
+    touch_stamp(current_app.config['IDENTITY_CACHE_STAMP'])
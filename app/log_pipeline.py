@@ -0,0 +1,146 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+
+# Поля LogRecord, которые не попадают в JSON как extra
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra=... добавляются как есть"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _QueueHandler(QueueHandler):
+    """Кладет запись в очередь, не форматируя её в потоке запроса.
+
+    Сообщение собирается из аргументов (они могут измениться позже), а
+    traceback превращается в текст, но JSON и запись в файл делает поток
+    QueueListener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_exception_formatter = logging.Formatter()
+
+# Текущий конвейер процесса: (обработчик очереди в корневом логгере, слушатель)
+_pipeline = None
+_lock = threading.Lock()
+
+def _build_handlers(app):
+    formatter = JsonFormatter() if app.config.get('LOG_FORMAT') == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    if not app.debug and not app.config.get('LOG_TO_STDOUT'):
+        log_dir = 'logs'
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        handlers.append(RotatingFileHandler(
+            os.path.join(log_dir, 'app.log'),
+            maxBytes=app.config.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=app.config.get('LOG_FILE_BACKUP_COUNT', 5),
+            encoding='utf-8'
+        ))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def _start(handlers):
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return _QueueHandler(log_queue), listener
+
+def _stop():
+    global _pipeline
+    if _pipeline is None:
+        return
+    queue_handler, listener = _pipeline
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    _pipeline = None
+
+def configure_logging(app):
+    """Настраивает неблокирующее логирование процесса.
+
+    Корневой логгер получает только QueueHandler; вывод в консоль и файл
+    делает фоновый поток QueueListener. Уровни: LOG_LEVEL для корня
+    (DEBUG в режиме отладки) и LOG_LEVELS для отдельных логгеров.
+    Повторный вызов (несколько create_app) заменяет конвейер.
+    """
+    global _pipeline
+    from flask.logging import default_handler
+
+    with _lock:
+        _stop()
+        queue_handler, listener = _start(_build_handlers(app))
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(logging.DEBUG if app.debug else app.config.get('LOG_LEVEL', 'INFO').upper())
+        _pipeline = (queue_handler, listener)
+
+    for name, level in app.config.get('LOG_LEVELS', {}).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    # Записи app.logger идут в корень, собственный обработчик Flask дублировал бы их
+    app.logger.removeHandler(default_handler)
+
+def _restart_after_fork():
+    """В дочернем процессе (gunicorn --preload) потока-писателя нет: запускаем новый"""
+    global _pipeline, _lock
+    _lock = threading.Lock()
+    if _pipeline is None:
+        return
+    queue_handler, listener = _pipeline
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *listener.handlers, respect_handler_level=True)
+    listener.start()
+    queue_handler.queue = log_queue
+    _pipeline = (queue_handler, listener)
+
+def _flush_at_exit():
+    with _lock:
+        _stop()
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(_flush_at_exit)
@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import db
+import os
+import threading
+import time
+import logging
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+        generate_latest, multiprocess
+    )
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    generate_latest = None
+
+logger = logging.getLogger(__name__)
+
+# Метрики пишутся в общий каталог (mmap-файлы на процесс), если он задан:
+# так /metrics любого воркера gunicorn отдает сумму по всем воркерам
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+_enabled = False
+
+if generate_latest is not None:
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', 'Время обработки HTTP-запроса',
+        ['endpoint', 'method']
+    )
+    REQUESTS = Counter(
+        'http_requests_total', 'HTTP-запросы по эндпоинтам и статусам',
+        ['endpoint', 'method', 'status']
+    )
+    POOL_CHECKOUT_WAIT = Histogram(
+        'db_pool_checkout_wait_seconds', 'Ожидание соединения из пула SQLAlchemy',
+        buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+    )
+    POOL_CONNECTIONS = Gauge(
+        'db_pool_connections', 'Соединения пулов SQLAlchemy по состояниям',
+        ['bind', 'state'], multiprocess_mode='livesum'
+    )
+    PARSER_RUNS = Histogram(
+        'parser_run_duration_seconds', 'Длительность операций парсера',
+        ['task', 'outcome'],
+        buckets=(.5, 1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800)
+    )
+    CACHE_REQUESTS = Counter(
+        'cache_requests_total', 'Обращения к кэшам процесса (hit/miss)',
+        ['cache', 'result']
+    )
+
+# ----------------------------------------------------------------------------
+# Вызовы из кода приложения (без prometheus_client ничего не делают)
+# ----------------------------------------------------------------------------
+
+def record_cache(cache, hit):
+    """Учитывает попадание или промах кэша cache"""
+    if _enabled:
+        CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+@contextmanager
+def parser_run(task):
+    """Замеряет операцию парсера; можно использовать как декоратор"""
+    if not _enabled:
+        yield
+        return
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        PARSER_RUNS.labels(task, outcome).observe(time.perf_counter() - started)
+
+# ----------------------------------------------------------------------------
+# Запросы и пул соединений
+# ----------------------------------------------------------------------------
+
+# Начало ожидания соединения: первый запрос сессии вне транзакции
+_local = threading.local()
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    return response
+
+def _before_orm_execute(orm_execute_state):
+    if not orm_execute_state.session.in_transaction():
+        _local.checkout_started = time.perf_counter()
+
+def _update_pool_gauges(pool, bind, returning=0):
+    """returning=1 при checkin: событие приходит до возврата соединения в пул"""
+    values = {}
+    for state, method in (('size', 'size'), ('checked_out', 'checkedout'),
+                          ('idle', 'checkedin'), ('overflow', 'overflow')):
+        getter = getattr(pool, method, None)
+        if getter is not None:
+            values[state] = getter()
+    if 'checked_out' in values:
+        values['checked_out'] -= returning
+    if 'idle' in values:
+        values['idle'] += returning
+    for state, value in values.items():
+        POOL_CONNECTIONS.labels(bind, state).set(max(value, 0))
+
+def _watch_engine(engine, bind):
+    # Слушатели пула переживают engine.dispose(): новый пул получает те же события
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        started = getattr(_local, 'checkout_started', None)
+        if started is not None:
+            _local.checkout_started = None
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+        _update_pool_gauges(engine.pool, bind)
+
+    def on_checkin(dbapi_connection, connection_record):
+        _update_pool_gauges(engine.pool, bind, returning=1)
+
+    event.listen(engine.pool, 'checkout', on_checkout)
+    event.listen(engine.pool, 'checkin', on_checkin)
+
+# ----------------------------------------------------------------------------
+# Экспорт
+# ----------------------------------------------------------------------------
+
+class _QueueCollector:
+    """Глубина очереди изображений читается из БД в момент сбора, а не хранится в процессах"""
+
+    def collect(self):
+        from .queue_stats import get_queue_stats, STATUSES
+        stats = get_queue_stats()
+        depth = GaugeMetricFamily('image_queue_depth', 'Задачи очереди изображений по статусам',
+                                  labels=['status'])
+        for status in STATUSES:
+            depth.add_metric([status], stats.get(status, 0))
+        yield depth
+
+def render_metrics():
+    """Текст в формате Prometheus: метрики процессов и глубина очереди"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    queue_registry = CollectorRegistry()
+    queue_registry.register(_QueueCollector())
+    return generate_latest(registry) + generate_latest(queue_registry)
+
+def worker_pids():
+    """PID живых процессов, пишущих метрики в общий каталог (воркеры gunicorn)"""
+    if not MULTIPROC_DIR or not os.path.isdir(MULTIPROC_DIR):
+        return []
+    pids = set()
+    for name in os.listdir(MULTIPROC_DIR):
+        pid = name.rsplit('_', 1)[-1].removesuffix('.db')
+        if name.endswith('.db') and pid.isdigit():
+            pids.add(int(pid))
+    alive = []
+    for pid in sorted(pids):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        alive.append(pid)
+    return alive
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        # Без токена метрики открыты только в режиме отладки
+        if not current_app.debug:
+            abort(403)
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+def init_metrics(app):
+    """Подключает метрики Prometheus и эндпоинт /metrics"""
+    global _enabled
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    if generate_latest is None:
+        app.logger.warning("prometheus_client не установлен, /metrics отключен")
+        return
+
+    if not _enabled:
+        event.listen(Session, 'do_orm_execute', _before_orm_execute)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            # Основная база - bind None, реплика - 'replica'
+            _watch_engine(engine, key or 'primary')
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    _enabled = True
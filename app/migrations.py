@@ -0,0 +1,259 @@
+"""Обновление схемы существующей базы (шаг релиза flask prepare-db).
+
+db.create_all создает только недостающие таблицы: колонки и индексы,
+добавленные в модели уже существующих таблиц, появляются здесь. Каждый шаг
+идемпотентен - сначала смотрит на схему и ничего не делает, если изменение
+уже есть, - поэтому шаги безопасно выполнять при каждом деплое. Данные,
+которые зависят от новой колонки (счетчики и т.п.), заполняются в том же
+шаге сразу после ее добавления.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from . import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (имя, функция шага); функция получает таблицы, существовавшие до create_all,
+# и возвращает True, если что-то изменила
+MIGRATIONS = []
+
+def migration(name):
+    def register(step):
+        MIGRATIONS.append((name, step))
+        return step
+    return register
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+def _columns(table_name):
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+def add_columns(model, *names):
+    """Добавляет колонки модели, которых нет в таблице. Возвращает добавленные имена.
+
+    DDL колонки берется из модели: тип, NOT NULL и server_default (без него
+    NOT NULL-колонку в непустую таблицу не добавить).
+    """
+    table = model.__table__
+    existing = _columns(table.name)
+    added = []
+    with db.engine.begin() as connection:
+        for name in names:
+            if name in existing:
+                continue
+            column_ddl = CreateColumn(table.c[name]).compile(dialect=db.engine.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {_quote(table.name)} ADD COLUMN {column_ddl}')
+            added.append(name)
+    if added:
+        logger.info("Добавлены колонки %s.%s", table.name, ', '.join(added))
+    return added
+
+def _index_state(name):
+    """None - индекса нет, True - есть, False - недостроенный (INVALID) индекс PostgreSQL"""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            return connection.execute(
+                db.text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'),
+                {'name': _quote(name)}
+            ).scalar()
+    return True if name in _indexes() else None
+
+def _indexes():
+    inspector = inspect(db.engine)
+    return {index['name'] for table in inspector.get_table_names()
+            for index in inspector.get_indexes(table)}
+
+def create_indexes(model, *names):
+    """Создает индексы модели, которых нет в базе. Возвращает созданные имена.
+
+    На PostgreSQL - CREATE INDEX CONCURRENTLY вне транзакции, чтобы не
+    блокировать запись в таблицу на время построения. Индекс, оставшийся
+    INVALID после прерванного построения, сначала удаляется.
+    """
+    postgres = db.engine.dialect.name == 'postgresql'
+    indexes = {index.name: index for index in model.__table__.indexes}
+    created = []
+    for name in names:
+        state = _index_state(name)
+        if state:
+            continue
+        ddl = str(CreateIndex(indexes[name]).compile(dialect=db.engine.dialect))
+        if not postgres:
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(ddl)
+        else:
+            ddl = ddl.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1)
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                if state is False:
+                    connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {_quote(name)}')
+                connection.exec_driver_sql(ddl)
+        created.append(name)
+    if created:
+        logger.info("Созданы индексы %s", ', '.join(created))
+    return created
+
+def upgrade_schema():
+    """Создает недостающие таблицы и выполняет шаги MIGRATIONS. Возвращает имена выполненных шагов"""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    if not existing_tables:
+        # Новая база: create_all уже создал все по моделям
+        return []
+
+    applied = []
+    for name, step in MIGRATIONS:
+        if step(existing_tables):
+            applied.append(name)
+            logger.info("Миграция %s выполнена", name)
+    return applied
+
+# ----------------------------------------------------------------------------
+# Шаги (выполняются в порядке объявления)
+# ----------------------------------------------------------------------------
+
+@migration('order_indexes')
+def _order_indexes(existing_tables):
+    from .models import Order, OrderItem
+
+    # Первым шагом: пересчеты ниже читают заказы и позиции по user_id, order_id,
+    # dish_id и дате, без индексов каждый из них - полный просмотр таблиц
+    created = create_indexes(Order, 'ix_order_created_id', 'ix_order_user_created_id')
+    created += create_indexes(OrderItem, 'ix_order_item_order_id', 'ix_order_item_dish_id')
+    return bool(created)
+
+@migration('order_created_at_not_null')
+def _order_created_at_not_null(existing_tables):
+    from .rollups import rebuild_daily_stats, rebuild_dish_stats
+
+    column = next(column for column in inspect(db.engine).get_columns('order')
+                  if column['name'] == 'created_at')
+    if not column['nullable']:
+        return False
+
+    # Keyset-пагинация заказов идет по (created_at, id), и строки с NULL из нее
+    # выпадают. Пустую дату берем у ближайшего заказа до него (ID растут вместе
+    # со временем), у самых первых - у ближайшего после
+    table = _quote('order')
+    neighbour = (f"(SELECT near.created_at FROM {table} near WHERE near.id {{}} {table}.id "
+                 f"AND near.created_at IS NOT NULL ORDER BY near.id {{}} LIMIT 1)")
+    with db.engine.begin() as connection:
+        filled = connection.exec_driver_sql(
+            f"UPDATE {table} SET created_at = COALESCE({neighbour.format('<', 'DESC')}, "
+            f"{neighbour.format('>', 'ASC')}, CURRENT_TIMESTAMP) WHERE created_at IS NULL"
+        ).rowcount
+        if db.engine.dialect.name == 'postgresql':
+            # SQLite не меняет ограничения колонок без пересборки таблицы: там NOT NULL
+            # только у новых баз, а старые строки заполнены выше
+            connection.exec_driver_sql(f'ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL')
+    if not filled:
+        return db.engine.dialect.name == 'postgresql'
+
+    logger.info("Заполнена дата у %s заказов без created_at", filled)
+    # Сводки по дням учитывали эти заказы без даты
+    if 'daily_order_stats' in existing_tables:
+        rebuild_daily_stats()
+    if 'dish_daily_sales' in existing_tables:
+        rebuild_dish_stats()
+    return True
+
+@migration('user_counters')
+def _user_counters(existing_tables):
+    from .models import User
+
+    if not add_columns(User, 'orders_count', 'favorites_count'):
+        return False
+    User.recount_counters()
+    db.session.commit()
+    return True
+
+@migration('user_auth_version')
+def _user_auth_version(existing_tables):
+    from .models import User
+
+    # Токены старых сессий ('id' без версии) load_user принимает и после добавления колонки
+    return bool(add_columns(User, 'auth_version'))
+
+@migration('daily_order_stats')
+def _daily_order_stats(existing_tables):
+    from .rollups import rebuild_daily_stats
+
+    # Сводку только что создал create_all: заполняем её по уже существующим заказам
+    if 'daily_order_stats' in existing_tables or 'order' not in existing_tables:
+        return False
+    rebuild_daily_stats()
+    return True
+
+@migration('dish_popularity')
+def _dish_popularity(existing_tables):
+    from .models import Dish
+    from .rollups import rebuild_dish_stats
+
+    added = add_columns(Dish, 'orders_count', 'quantity_sold')
+    if not added and 'dish_daily_sales' in existing_tables:
+        return False
+    # Счетчики блюд и дневные продажи считаются из позиций существующих заказов
+    rebuild_dish_stats()
+    return True
+
+@migration('recommendation_marks')
+def _recommendation_marks(existing_tables):
+    from .models import OrderItem
+
+    if 'dish_pair_count' not in existing_tables:
+        # Рекомендаций на этой базе еще не было. Все позиции остаются неучтенными,
+        # и первый запуск flask build-recommendations (cron) обработает всю историю -
+        # не в prepare-db, чтобы долгий пересчет не задерживал старт веб-сервиса
+        if add_columns(OrderItem, 'in_recommendations'):
+            logger.info("Рекомендации будут построены при следующем flask build-recommendations")
+        return True
+
+    if not add_columns(OrderItem, 'in_recommendations'):
+        return False
+    # Прежняя отметка - последний учтенный ID заказа в job_state
+    if 'job_state' in existing_tables:
+        with db.engine.begin() as connection:
+            connection.execute(db.text(
+                "UPDATE order_item SET in_recommendations = :counted WHERE order_id <= "
+                "(SELECT last_id FROM job_state WHERE name = 'recommendations')"
+            ), {'counted': True})
+    return True
+
+@migration('favorite_unique')
+def _favorite_unique(existing_tables):
+    from .models import Favorite, User
+
+    if _index_state('ix_favorite_user_dish'):
+        return False
+    # Уникальный индекс не построится, пока в избранном есть повторы: оставляем
+    # самую раннюю запись пары (пользователь, блюдо) и пересчитываем счетчики
+    with db.engine.begin() as connection:
+        removed = connection.execute(db.text(
+            "DELETE FROM favorite WHERE id NOT IN "
+            "(SELECT min(id) FROM favorite GROUP BY user_id, dish_id)"
+        )).rowcount
+    if removed:
+        logger.info("Удалено повторов в избранном: %s", removed)
+        User.recount_counters()
+        db.session.commit()
+    return bool(create_indexes(Favorite, 'ix_favorite_user_dish'))
+
+@migration('dish_orders_count_index')
+def _dish_orders_count_index(existing_tables):
+    from .models import Dish
+
+    return bool(create_indexes(Dish, 'ix_dish_orders_count'))
+
+@migration('image_queue_status_index')
+def _image_queue_status_index(existing_tables):
+    from .models import ImageQueue
+
+    return bool(create_indexes(ImageQueue, 'ix_image_queue_status_updated'))
+
+@migration('order_item_recommendation_index')
+def _order_item_recommendation_index(existing_tables):
+    from .models import OrderItem
+
+    # Колонку добавляет шаг recommendation_marks
+    return bool(create_indexes(OrderItem, 'ix_order_item_in_recommendations'))
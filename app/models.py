@@ -1,6 +1,7 @@
 from datetime import datetime
 from flask_login import UserMixin
-from . import db, bcrypt
+from . import db
+from .passwords import hash_password, verify_password
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,15 +11,54 @@ class User(UserMixin, db.Model):
     is_active = db.Column(db.Boolean, default=True)
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Версия учетных данных: при смене пароля старые сессии перестают действовать
+    auth_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Денормализованные счетчики для профиля (пересчет: flask recount-users)
+    orders_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    favorites_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     orders = db.relationship('Order', backref='customer', lazy=True)
     favorites = db.relationship('Favorite', backref='user', lazy='dynamic')
     
+    def get_id(self):
+        return f'{self.id}:{self.auth_version or 0}'
+    
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    @classmethod
+    def adjust_counters(cls, user_id, orders=0, favorites=0):
+        """Атомарно изменяет счетчики пользователя в текущей транзакции"""
+        if not user_id or not (orders or favorites):
+            return
+        
+        values = {}
+        if orders:
+            values[cls.orders_count] = cls.orders_count + orders
+        if favorites:
+            values[cls.favorites_count] = cls.favorites_count + favorites
+        cls.query.filter_by(id=user_id).update(values, synchronize_session=False)
+    
+    @classmethod
+    def recount_counters(cls):
+        """Пересчитывает счетчики всех пользователей одним UPDATE. Возвращает число строк"""
+        orders_count = db.select(db.func.count(Order.id)).where(
+            Order.user_id == cls.id
+        ).scalar_subquery()
+        favorites_count = db.select(db.func.count(Favorite.id)).where(
+            Favorite.user_id == cls.id
+        ).scalar_subquery()
+        
+        return db.session.execute(
+            db.update(cls).values(
+                orders_count=orders_count,
+                favorites_count=favorites_count
+            )
+        ).rowcount
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -41,12 +81,20 @@ class Dish(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     is_available = db.Column(db.Boolean, default=True)
     
+    # Счетчики популярности (пересчет: flask rebuild-rollups)
+    orders_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    quantity_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     favorites = db.relationship('Favorite', backref='dish', lazy='dynamic')
     
     def __repr__(self):
         return f'<Dish {self.name}>'
 
 class Favorite(db.Model):
+    __table_args__ = (
+        db.Index('ix_favorite_user_dish', 'user_id', 'dish_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'))
@@ -55,6 +103,15 @@ class Favorite(db.Model):
     def __repr__(self):
         return f'<Favorite user:{self.user_id} dish:{self.dish_id}>'
 
+# Количество блюд категории одним коррелированным подзапросом (для списков админки).
+# Отложенное: подгружается только там, где запрошено через undefer
+Category.dishes_count = db.column_property(
+    db.select(db.func.count(Dish.id)).where(
+        Dish.category_id == Category.id
+    ).correlate_except(Dish).scalar_subquery(),
+    deferred=True
+)
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(100), nullable=False)
@@ -62,9 +119,16 @@ class Order(db.Model):
     phone = db.Column(db.String(20), nullable=True)
     total = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='Новый')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # NOT NULL: по created_at идет keyset-пагинация (миграция order_created_at_not_null)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     
+    # Индексы под keyset-пагинацию истории заказов и списка в админке
+    __table_args__ = (
+        db.Index('ix_order_created_id', 'created_at', 'id'),
+        db.Index('ix_order_user_created_id', 'user_id', 'created_at', 'id'),
+    )
+    
     items = db.relationship('OrderItem', backref='order', lazy=True)
     
     def __repr__(self):
@@ -72,10 +136,14 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
-    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'))
+    # Позиции заказа (joinedload Order.items) и продажи блюда (flask rebuild-rollups)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), index=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), index=True)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
+    # Позиция учтена в матрице совместных покупок (flask build-recommendations)
+    in_recommendations = db.Column(db.Boolean, nullable=False, default=False,
+                                   server_default=db.false(), index=True)
 
     dish = db.relationship('Dish')
     
@@ -93,7 +161,61 @@ class ImageQueue(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Выборка задач на удаление по сроку хранения
+    __table_args__ = (
+        db.Index('ix_image_queue_status_updated', 'status', 'updated_at'),
+    )
+    
     dish = db.relationship('Dish', backref='image_queue_items')
     
     def __repr__(self):
-        return f'<ImageQueue dish:{self.dish_id} url:{self.image_url[:30]}>'
\ No newline at end of file
+        return f'<ImageQueue dish:{self.dish_id} url:{self.image_url[:30]}>'
+
+class ImageDownload(db.Model):
+    """Компактный индекс результатов загрузки по URL (архив удаленных задач очереди)"""
+    url_hash = db.Column(db.String(32), primary_key=True)  # md5 от URL
+    status = db.Column(db.String(20), nullable=False)  # completed, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ImageDownload {self.url_hash}: {self.status}>'
+
+class DailyOrderStats(db.Model):
+    """Дневная сводка заказов по статусам (пересчет: flask rebuild-rollups)"""
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DailyOrderStats {self.day} {self.status}: {self.orders_count}>'
+
+class DishDailySales(db.Model):
+    """Продажи блюда за день - основа для популярности за 7/30 дней"""
+    day = db.Column(db.Date, primary_key=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DishDailySales {self.day} dish:{self.dish_id}: {self.quantity}>'
+
+class DishPairCount(db.Model):
+    """Сколько раз два блюда встречались в одном заказе (хранятся обе пары a-b и b-a)"""
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    other_dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DishPairCount {self.dish_id}-{self.other_dish_id}: {self.count}>'
+
+class DishRecommendation(db.Model):
+    """Top-K блюд, которые чаще всего заказывают вместе с данным"""
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    recommended_dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    
+    def __repr__(self):
+        return f'<DishRecommendation {self.dish_id} #{self.rank}: {self.recommended_dish_id}>'
@@ -0,0 +1,51 @@
+from . import db
+from .models import Order, OrderItem
+from . import rollups
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Допустимое расхождение суммы заказа из-за округления float
+TOLERANCE = 0.005
+
+def apply_total_delta(order, delta):
+    """Изменяет сумму заказа на delta одним UPDATE и переносит изменение в сводку.
+
+    Коммит за вызывающим кодом.
+    """
+    if order is None or not delta:
+        return
+    Order.query.filter_by(id=order.id).update(
+        {Order.total: Order.total + delta}, synchronize_session=False)
+    rollups.apply_order_delta(order.created_at, order.status, 0, delta)
+    db.session.expire(order, ['total'])
+
+def _items_total():
+    return db.select(db.func.coalesce(db.func.sum(OrderItem.quantity * OrderItem.price), 0)).where(
+        OrderItem.order_id == Order.id
+    ).scalar_subquery()
+
+def drifted_orders(limit=None):
+    """Заказы, у которых сумма не совпадает с суммой позиций: [(id, total, сумма позиций)]"""
+    items_total = _items_total()
+    query = db.session.query(Order.id, Order.total, items_total).filter(
+        db.func.abs(Order.total - items_total) > TOLERANCE
+    ).order_by(Order.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def repair_order_totals():
+    """Исправляет все разошедшиеся суммы одним UPDATE и пересобирает сводку"""
+    items_total = _items_total()
+    repaired = db.session.execute(
+        db.update(Order).where(
+            db.func.abs(Order.total - items_total) > TOLERANCE
+        ).values(total=items_total)
+    ).rowcount
+    db.session.commit()
+
+    if repaired:
+        logger.warning(f"Исправлены суммы {repaired} заказов")
+        rollups.rebuild_daily_stats()
+    return repaired
@@ -0,0 +1,135 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from flask import abort, current_app
+from . import db
+from . import metrics
+import binascii
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------------
+# Курсоры keyset-пагинации
+# ----------------------------------------------------------------------------
+
+def encode_cursor(values):
+    """Кодирует значения ключа строки (created_at, id, ...) в курсор для URL"""
+    parts = [value.isoformat() if isinstance(value, datetime) else str(value) for value in values]
+    return urlsafe_b64encode('|'.join(parts).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, columns):
+    """Разбирает курсор обратно в значения по типам колонок; None без курсора.
+
+    Испорченный курсор - ошибка 400, а не тихий возврат на первую страницу.
+    """
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        parts = raw.split('|')
+        if len(parts) != len(columns):
+            raise ValueError('число значений не совпадает с ключом')
+        values = []
+        for column, part in zip(columns, parts):
+            if isinstance(column.type, db.DateTime):
+                values.append(datetime.fromisoformat(part))
+            elif isinstance(column.type, db.Integer):
+                values.append(int(part))
+            else:
+                values.append(part)
+        return values
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        logger.debug(f"Некорректный курсор пагинации {token}: {e}")
+        abort(400, description='Некорректный курсор пагинации')
+
+def row_key(row, columns):
+    return [getattr(row, column.key) for column in columns]
+
+def seek(query, columns, after=None, before=None, desc=True):
+    """Добавляет к запросу условие и порядок keyset-пагинации.
+
+    after - значения ключа последней строки предыдущей страницы,
+    before - первой строки следующей. При before порядок обратный,
+    строки нужно развернуть после выборки.
+    """
+    key = db.tuple_(*columns)
+    if after is not None:
+        query = query.filter(key < db.tuple_(*after) if desc else key > db.tuple_(*after))
+    elif before is not None:
+        query = query.filter(key > db.tuple_(*before) if desc else key < db.tuple_(*before))
+
+    reverse = before is not None
+    descending = desc != reverse
+    return query.order_by(None).order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    )
+
+class KeysetPage:
+    """Страница keyset-пагинации со ссылками вперед/назад по курсорам"""
+
+    def __init__(self, items, columns, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = encode_cursor(row_key(items[-1], columns)) if items and has_next else None
+        self.prev_cursor = encode_cursor(row_key(items[0], columns)) if items and has_prev else None
+
+def keyset_paginate(query, columns, per_page, after=None, before=None, desc=True):
+    """Выбирает одну страницу по курсору (строки с ключом после/до курсора)"""
+    after = decode_cursor(after, columns)
+    before = decode_cursor(before, columns) if after is None else None
+
+    rows = seek(query, columns, after, before, desc).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before is not None:
+        rows.reverse()
+        return KeysetPage(rows, columns, has_next=True, has_prev=has_more)
+    return KeysetPage(rows, columns, has_next=has_more, has_prev=after is not None)
+
+# ----------------------------------------------------------------------------
+# Оценка количества строк
+# ----------------------------------------------------------------------------
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+def _planner_estimate(table):
+    """Оценка числа строк по статистике PostgreSQL (pg_class.reltuples)"""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    name = db.engine.dialect.identifier_preparer.format_table(table)
+    estimate = db.session.execute(
+        db.text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)'),
+        {'name': name}
+    ).scalar()
+    # -1 - таблица еще не анализировалась
+    return int(estimate) if estimate is not None and estimate >= 0 else None
+
+def estimate_count(model):
+    """Примерное число строк таблицы для пагинаторов.
+
+    Для больших таблиц PostgreSQL берется оценка планировщика, иначе точный
+    COUNT(*), закэшированный на COUNT_CACHE_TTL секунд.
+    """
+    table = model.__table__
+    threshold = current_app.config.get('ESTIMATED_COUNT_THRESHOLD', 10000)
+    estimate = _planner_estimate(table)
+    if estimate is not None and estimate >= threshold:
+        return estimate
+
+    ttl = current_app.config.get('COUNT_CACHE_TTL', 60)
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(table.name)
+    metrics.record_cache('row_count', bool(cached and cached[0] > now))
+    if cached and cached[0] > now:
+        return cached[1]
+
+    count = db.session.query(db.func.count()).select_from(table).scalar()
+    with _count_lock:
+        _count_cache[table.name] = (now + ttl, count)
+    return count
@@ -4,6 +4,8 @@ import os
 from urllib.parse import urljoin, urlparse
 from app import db
 from app.models import Category, Dish, ImageQueue
+from app import queue_stats, queue_retention, metrics
+from flask import current_app
 import hashlib
 import re
 from decimal import Decimal
@@ -28,6 +30,7 @@ class NSMParser:
         self.timeout = 15
         self.downloaded_urls = set()  # Кэш уже скачанных URL
         self.failed_urls = set()  # Кэш неудачных URL
+        self.known_outcomes = {}  # Итоги загрузок из индекса: url -> (status, attempts) или None
     
     def safe_float(self, price_str):
         """Безопасное преобразование строки в float"""
@@ -142,6 +145,7 @@ class NSMParser:
             {'name': 'Детское меню', 'url': 'https://nsm-22.ru/detskoe-menyu/'},
         ]
     
+    @metrics.parser_run('parse_section')
     def parse_section(self, section_url, section_name):
         """Парсит конкретный раздел меню"""
         try:
@@ -235,7 +239,7 @@ class NSMParser:
             
             # Удаляем блюдо, если цена <= 0
             if price <= 0:
-                logger.debug(f"Блюдо '{name}' удалено - цена отсутствует или равна 0")
+                logger.debug("Блюдо '%s' удалено - цена отсутствует или равна 0", name)
                 return None
             
             # Вес/описание
@@ -282,7 +286,7 @@ class NSMParser:
             }
             
         except Exception as e:
-            logger.debug(f"Ошибка при парсинге блюда из колонки: {e}")
+            logger.debug("Ошибка при парсинге блюда из колонки: %s", e)
             return None
     
     def _parse_dish_from_wrapper(self, wrapper, section_name):
@@ -312,7 +316,7 @@ class NSMParser:
             
             # Удаляем блюдо, если цена <= 0
             if price <= 0:
-                logger.debug(f"Блюдо '{name}' удалено - цена отсутствует или равна 0")
+                logger.debug("Блюдо '%s' удалено - цена отсутствует или равна 0", name)
                 return None
             
             # Описание
@@ -340,7 +344,7 @@ class NSMParser:
             }
             
         except Exception as e:
-            logger.debug(f"Ошибка в альтернативном парсинге: {e}")
+            logger.debug("Ошибка в альтернативном парсинге: %s", e)
             return None
     
     def _parse_dish_generic(self, element, section_name):
@@ -369,7 +373,7 @@ class NSMParser:
             
             # Удаляем блюдо, если цена <= 0
             if price <= 0:
-                logger.debug(f"Блюдо '{name}' удалено - цена отсутствует или равна 0")
+                logger.debug("Блюдо '%s' удалено - цена отсутствует или равна 0", name)
                 return None
             
             # Описание - остальной текст
@@ -397,7 +401,7 @@ class NSMParser:
             }
             
         except Exception as e:
-            logger.debug(f"Ошибка в универсальном парсинге: {e}")
+            logger.debug("Ошибка в универсальном парсинге: %s", e)
             return None
     
     def _get_image_filename_from_url(self, url):
@@ -463,6 +467,16 @@ class NSMParser:
         if url in self.failed_urls:
             return True
         
+        # Проверяем индекс загрузок: URL, исчерпавший попытки, больше не качаем.
+        # Для задач очереди итоги заранее загружены одним запросом в known_outcomes
+        if url not in self.known_outcomes:
+            self.known_outcomes[url] = queue_retention.lookup_outcome(url)
+        outcome = self.known_outcomes[url]
+        max_retries = current_app.config.get('IMAGE_QUEUE_MAX_RETRIES', 3)
+        if outcome and outcome[0] == 'failed' and outcome[1] >= max_retries:
+            self.failed_urls.add(url)
+            return True
+        
         # Генерируем имя файла и проверяем, скачан ли он
         image_filename = self._get_image_filename_from_url(url)
         if not image_filename:
@@ -486,7 +500,8 @@ class NSMParser:
                     existing_queue.retry_count += 1
                     existing_queue.updated_at = datetime.utcnow()
                     db.session.commit()
-                    logger.debug(f"URL обновлен в очереди для повторной попытки: {image_url}")
+                    queue_stats.notify_queue_changed()
+                    logger.debug("URL обновлен в очереди для повторной попытки: %s", image_url)
                 return existing_queue.id
             
             # Создаем новую запись в очереди
@@ -498,8 +513,9 @@ class NSMParser:
             )
             db.session.add(image_queue)
             db.session.commit()
+            queue_stats.notify_queue_changed()
             
-            logger.info(f"URL добавлен в очередь загрузки: {image_url}")
+            logger.debug("URL добавлен в очередь загрузки: %s", image_url)
             return image_queue.id
             
         except Exception as e:
@@ -525,6 +541,11 @@ class NSMParser:
             if not queue_items:
                 return 0, 0, 0  # downloaded, failed, skipped
             
+            # Итоги прошлых загрузок для всех URL пачки - одним запросом
+            self.known_outcomes.update(
+                queue_retention.lookup_outcomes([item.image_url for item in queue_items])
+            )
+            
             downloaded = 0
             failed = 0
             skipped = 0
@@ -535,6 +556,7 @@ class NSMParser:
                     item.status = 'downloading'
                     item.updated_at = datetime.utcnow()
                     db.session.commit()
+                    queue_stats.notify_queue_changed()
                     
                     # Получаем блюдо
                     dish = Dish.query.get(item.dish_id)
@@ -551,10 +573,10 @@ class NSMParser:
                         item.updated_at = datetime.utcnow()
                         db.session.commit()
                         skipped += 1
-                        logger.debug(f"URL уже скачан, пропускаем: {item.image_url}")
+                        logger.debug("URL уже скачан, пропускаем: %s", item.image_url)
                         continue
                     
-                    logger.info(f"Загружаем изображение из очереди: {item.image_url}")
+                    logger.debug("Загружаем изображение из очереди: %s", item.image_url)
                     
                     # Загружаем изображение
                     image_filename = self._download_image(item.image_url, dish.name)
@@ -566,7 +588,7 @@ class NSMParser:
                         item.updated_at = datetime.utcnow()
                         db.session.commit()
                         downloaded += 1
-                        logger.info(f"Изображение успешно загружено: {image_filename}")
+                        logger.debug("Изображение успешно загружено: %s", image_filename)
                     else:
                         item.status = 'failed'
                         item.retry_count += 1
@@ -588,6 +610,9 @@ class NSMParser:
                     except:
                         pass
                     failed += 1
+                finally:
+                    # Статус задачи изменился - обновляем статистику у открытых страниц
+                    queue_stats.notify_queue_changed()
             
             return downloaded, failed, skipped
             
@@ -598,36 +623,8 @@ class NSMParser:
     def _cleanup_image_queue(self):
         """Очищает очередь от старых и завершенных задач"""
         try:
-            # Удаляем задачи, которые успешно завершены более 1 дня назад
-            day_ago = datetime.utcnow() - timedelta(days=1)
-            
-            completed_items = ImageQueue.query.filter(
-                ImageQueue.status == 'completed',
-                ImageQueue.updated_at < day_ago
-            ).all()
-            
-            deleted_count = 0
-            for item in completed_items:
-                db.session.delete(item)
-                deleted_count += 1
-            
-            # Удаляем задачи, которые неудачны и уже превысили лимит попыток
-            failed_items = ImageQueue.query.filter(
-                ImageQueue.status == 'failed',
-                ImageQueue.retry_count >= 3,
-                ImageQueue.updated_at < day_ago
-            ).all()
-            
-            for item in failed_items:
-                db.session.delete(item)
-                deleted_count += 1
-            
-            db.session.commit()
-            
-            if deleted_count > 0:
-                logger.info(f"Очищено {deleted_count} старых задач из очереди")
-            
-            return deleted_count
+            # Пакетные DELETE с архивом итогов в индекс загрузок
+            return queue_retention.compact_queue()
             
         except Exception as e:
             logger.error(f"Ошибка очистки очереди: {e}")
@@ -638,21 +635,21 @@ class NSMParser:
         """Скачивает изображение и сохраняет локально"""
         try:
             if not url:
-                logger.debug(f"Пустой URL изображения для блюда: {dish_name}")
+                logger.debug("Пустой URL изображения для блюда: %s", dish_name)
                 return None
             
             # Проверяем, не скачивали ли уже этот URL
             if self._is_url_downloaded(url):
-                logger.debug(f"URL уже был скачан или помечен как ошибочный: {url}")
+                logger.debug("URL уже был скачан или помечен как ошибочный: %s", url)
                 return self._get_image_filename_from_url(url)
             
             # Пропускаем placeholder изображения
             if any(x in url.lower() for x in ['placeholder', 'nophoto', 'default', 'no-image', 'noimage']):
-                logger.debug(f"Пропускаем placeholder: {url}")
+                logger.debug("Пропускаем placeholder: %s", url)
                 self.failed_urls.add(url)
                 return None
             
-            logger.info(f"Загружаем изображение: {url}")
+            logger.debug("Загружаем изображение: %s", url)
             
             # Ограничиваем размер загружаемых изображений и время загрузки
             response = requests.get(url, headers=self.headers, timeout=10, stream=True)
@@ -661,14 +658,14 @@ class NSMParser:
             # Проверяем Content-Type
             content_type = response.headers.get('content-type', '').lower()
             if not any(img_type in content_type for img_type in ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp']):
-                logger.warning(f"URL не является изображением или неверный тип: {content_type}")
+                logger.warning("URL не является изображением или неверный тип: %s", content_type)
                 self.failed_urls.add(url)
                 return None
             
             # Ограничиваем размер файла (макс 500KB для Render)
             content_length = int(response.headers.get('content-length', 0))
             if content_length > 500 * 1024:  # 500KB
-                logger.warning(f"Изображение слишком большое: {content_length} bytes")
+                logger.warning("Изображение слишком большое: %s bytes", content_length)
                 self.failed_urls.add(url)
                 return None
             
@@ -699,7 +696,7 @@ class NSMParser:
             
             # Проверяем размер файла
             if not file_path.exists() or file_path.stat().st_size == 0:
-                logger.warning(f"Пустой файл изображения: {image_filename}")
+                logger.warning("Пустой файл изображения: %s", image_filename)
                 try:
                     if file_path.exists():
                         file_path.unlink()
@@ -725,11 +722,13 @@ class NSMParser:
             # Добавляем в кэш скачанных изображений
             self.downloaded_urls.add(image_filename)
             
-            logger.info(f"Изображение сохранено: {image_filename} ({file_path.stat().st_size} bytes)")
+            if logger.isEnabledFor(logging.DEBUG):
+                # stat() только если отладочный лог включен
+                logger.debug("Изображение сохранено: %s (%s bytes)", image_filename, file_path.stat().st_size)
             return image_filename
             
         except requests.exceptions.Timeout:
-            logger.warning(f"Таймаут при загрузке изображения: {url}")
+            logger.warning("Таймаут при загрузке изображения: %s", url)
             self.failed_urls.add(url)
             return None
         except requests.exceptions.RequestException as e:
@@ -742,6 +741,7 @@ class NSMParser:
                 self.failed_urls.add(url)
             return None
     
+    @metrics.parser_run('parse_all_menu')
     def parse_all_menu(self):
         """Парсит все меню ресторана"""
         try:
@@ -785,6 +785,7 @@ class NSMParser:
             logger.error(f"Ошибка при парсинге всего меню: {e}")
             return []
     
+    @metrics.parser_run('save_to_database')
     def save_to_database(self, dishes):
         """Сохраняет спарсенные блюда в базу данных и добавляет URL в очередь"""
         try:
@@ -863,6 +864,7 @@ class NSMParser:
             logger.error(f"Ошибка сохранения в базу: {e}")
             return False
     
+    @metrics.parser_run('process_image_queue')
     def process_image_queue(self, limit=None, cleanup=True):
         """Обрабатывает очередь изображений"""
         try:
@@ -890,23 +892,9 @@ class NSMParser:
             }
     
     def get_queue_stats(self):
-        """Получает статистику очереди"""
+        """Получает статистику очереди (один GROUP BY, с кэшем)"""
         try:
-            total = ImageQueue.query.count()
-            pending = ImageQueue.query.filter_by(status='pending').count()
-            downloading = ImageQueue.query.filter_by(status='downloading').count()
-            completed = ImageQueue.query.filter_by(status='completed').count()
-            failed = ImageQueue.query.filter_by(status='failed').count()
-            skipped = ImageQueue.query.filter_by(status='skipped').count()
-            
-            return {
-                'total': total,
-                'pending': pending,
-                'downloading': downloading,
-                'completed': completed,
-                'failed': failed,
-                'skipped': skipped
-            }
+            return queue_stats.get_queue_stats()
             
         except Exception as e:
             logger.error(f"Ошибка получения статистики очереди: {e}")
@@ -969,17 +957,22 @@ def get_queue_stats():
     return parser.get_queue_stats()
 
 def clear_image_queue():
-    """Очищает всю очередь изображений"""
+    """Очищает очередь изображений.
+
+    Возвращает (удалено, осталось): удаление ограничено по времени
+    (IMAGE_QUEUE_DELETE_SECONDS), остаток удаляется повторным запуском.
+    """
     try:
-        deleted_count = ImageQueue.query.delete()
-        db.session.commit()
-        logger.info(f"✅ Очередь изображений очищена: удалено {deleted_count} задач")
-        return deleted_count
+        deleted_count = queue_retention.drain_queue()
+        remaining = queue_retention.remaining_count()
+        logger.info(f"✅ Очередь изображений очищена: удалено {deleted_count} задач, осталось {remaining}")
+        return deleted_count, remaining
     except Exception as e:
         logger.error(f"Ошибка очистки очереди: {e}")
         db.session.rollback()
-        return 0
+        raise
 
+@metrics.parser_run('update_category_images')
 def update_category_images_from_dishes():
     """Обновляет изображения категорий на основе первого блюда в категории"""
     try:
@@ -0,0 +1,87 @@
+from flask import current_app
+from . import bcrypt
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PasswordHasherBusy(Exception):
+    """Все слоты хеширования заняты - запрос стоит повторить позже"""
+
+# Слоты создаются лениво в каждом процессе (после fork у gunicorn)
+_slots = None
+_slots_pid = None
+_slots_lock = threading.Lock()
+
+def _get_slots():
+    global _slots, _slots_pid
+    with _slots_lock:
+        if _slots is None or _slots_pid != os.getpid():
+            _slots = threading.BoundedSemaphore(current_app.config.get('BCRYPT_MAX_WORKERS', 2))
+            _slots_pid = os.getpid()
+        return _slots
+
+def _run_bounded(func, *args):
+    """Выполняет bcrypt в потоке запроса, но не больше BCRYPT_MAX_WORKERS одновременно.
+
+    Поток запроса занят на все время хеширования: ограничение не освобождает
+    воркер, а только не дает волне входов занять все ядра и вытеснить остальные
+    запросы. Если слот не освободился за BCRYPT_QUEUE_TIMEOUT, выбрасывается
+    PasswordHasherBusy.
+    """
+    slots = _get_slots()
+    timeout = current_app.config.get('BCRYPT_QUEUE_TIMEOUT', 2.0)
+    if not slots.acquire(timeout=timeout):
+        logger.warning("Очередь хеширования паролей переполнена")
+        raise PasswordHasherBusy()
+    try:
+        return func(*args)
+    finally:
+        slots.release()
+
+def hash_password(password, rounds=None):
+    """Возвращает bcrypt-хеш пароля с текущей стоимостью (BCRYPT_LOG_ROUNDS)"""
+    if rounds is None:
+        rounds = current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+    pw_hash = _run_bounded(bcrypt.generate_password_hash, password, rounds)
+    return pw_hash.decode('utf-8')
+
+def verify_password(pw_hash, password):
+    """Проверяет пароль; может выбросить PasswordHasherBusy при перегрузке"""
+    return _run_bounded(bcrypt.check_password_hash, pw_hash, password)
+
+def get_hash_rounds(pw_hash):
+    """Извлекает стоимость из хеша вида $2b$12$..."""
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def needs_rehash(pw_hash):
+    """Нужно ли перехешировать пароль под текущую стоимость"""
+    return get_hash_rounds(pw_hash) != current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+def benchmark_rounds(rounds, samples=3):
+    """Среднее время проверки пароля в миллисекундах для заданной стоимости"""
+    pw_hash = bcrypt.generate_password_hash('calibration-password', rounds)
+    started = time.perf_counter()
+    for _ in range(samples):
+        bcrypt.check_password_hash(pw_hash, 'calibration-password')
+    return (time.perf_counter() - started) * 1000 / samples
+
+def calibrate_rounds(target_ms, min_rounds=10, max_rounds=16):
+    """Подбирает наибольшую стоимость, укладывающуюся в целевую задержку.
+
+    Возвращает (рекомендованная стоимость, [(стоимость, мс), ...]).
+    """
+    results = []
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        elapsed = benchmark_rounds(rounds)
+        results.append((rounds, elapsed))
+        if elapsed > target_ms:
+            break
+        best = rounds
+    return best, results
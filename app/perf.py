@@ -0,0 +1,204 @@
+from collections import deque
+from flask import current_app, request, has_request_context, g
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+import math
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------------
+# Отпечатки SQL: литералы и параметры заменены на ?, списки IN свернуты
+# ----------------------------------------------------------------------------
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+def fingerprint(statement):
+    statement = _PLACEHOLDERS.sub('?', _LITERALS.sub('?', statement))
+    statement = _IN_LISTS.sub('(?, ...)', statement)
+    return ' '.join(statement.split())
+
+# ----------------------------------------------------------------------------
+# Сбор метрик (в памяти процесса)
+# ----------------------------------------------------------------------------
+
+# Текущий запрос потока: время начала, время в БД, число запросов
+_local = threading.local()
+
+# endpoint -> {'count': всего запросов, 'samples': последние (wall, db, queries, bytes)}
+_endpoints = {}
+# отпечаток -> сводка медленного запроса
+_slow_queries = {}
+_lock = threading.Lock()
+# Настройки из init_perf: порог медленного запроса и сколько отпечатков хранить
+_settings = {}
+_listening = False
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('perf_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('perf_started')
+    if not started:
+        return
+    elapsed = (time.perf_counter() - started.pop()) * 1000
+
+    current = getattr(_local, 'current', None)
+    if current is not None:
+        current['db_ms'] += elapsed
+        current['queries'] += 1
+
+    threshold = _settings.get('slow_query_ms')
+    if threshold is not None and elapsed >= threshold:
+        _record_slow_query(statement, parameters, elapsed)
+
+def _handle_error(context):
+    # after_cursor_execute при ошибке не вызывается
+    started = context.connection.info.get('perf_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+def _record_slow_query(statement, parameters, elapsed):
+    key = fingerprint(statement)
+    endpoint = request.endpoint if has_request_context() else None
+    params = repr(parameters)
+    if len(params) > 500:
+        params = params[:500] + '...'
+
+    with _lock:
+        entry = _slow_queries.get(key)
+        if entry is None:
+            if len(_slow_queries) >= _settings.get('slow_queries_kept', 50):
+                # Вытесняем самый редкий отпечаток
+                del _slow_queries[min(_slow_queries, key=lambda k: _slow_queries[k]['count'])]
+            entry = _slow_queries[key] = {'fingerprint': key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        entry['count'] += 1
+        entry['total_ms'] += elapsed
+        if elapsed >= entry['max_ms']:
+            entry.update(max_ms=elapsed, params=params, endpoint=endpoint, seen=time.time())
+
+    logger.warning("Медленный запрос %.0f мс: %s", elapsed, key,
+                   extra={'duration_ms': round(elapsed, 1), 'fingerprint': key,
+                          'params': params, 'endpoint': endpoint})
+
+def _server_timing_allowed():
+    """Заголовок Server-Timing раскрывает время и число SQL: только администраторам
+    или всем при PERF_SERVER_TIMING"""
+    if current_app.config.get('PERF_SERVER_TIMING', False):
+        return True
+    # Пользователь, уже загруженный Flask-Login за этот запрос, и значения его колонок
+    # без обновления из БД (после commit они истекли) - проверка не добавляет SQL
+    state = inspect(g.get('_login_user'), raiseerr=False)
+    return bool(state is not None and state.dict.get('is_admin'))
+
+def _start_request():
+    _local.current = {
+        'started': time.perf_counter(),
+        'db_ms': 0.0,
+        'queries': 0
+    }
+
+def _finish_request(response):
+    current = getattr(_local, 'current', None)
+    if current is None:
+        return response
+    _local.current = None
+
+    wall_ms = (time.perf_counter() - current['started']) * 1000
+    size = response.content_length
+    if size is None and not response.is_streamed:
+        size = response.calculate_content_length()
+    endpoint = request.endpoint or f'[{response.status_code}]'
+
+    if _server_timing_allowed():
+        response.headers['Server-Timing'] = (
+            f"app;dur={wall_ms:.1f}, db;dur={current['db_ms']:.1f};desc=\"{current['queries']} queries\""
+        )
+
+    sample = (wall_ms, current['db_ms'], current['queries'], size or 0)
+    sample_size = current_app.config.get('PERF_SAMPLE_SIZE', 500)
+    with _lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = {'count': 0, 'samples': deque(maxlen=sample_size)}
+        stats['count'] += 1
+        stats['samples'].append(sample)
+    return response
+
+def _abandon_request(exc=None):
+    # after_request не вызывается при необработанном исключении
+    _local.current = None
+
+def init_perf(app):
+    """Подключает сбор метрик запросов: время, время в БД, число SQL, размер ответа"""
+    global _listening
+    if not app.config.get('PERF_ENABLED', True):
+        return
+
+    _settings['slow_query_ms'] = app.config.get('PERF_SLOW_QUERY_MS')
+    _settings['slow_queries_kept'] = app.config.get('PERF_SLOW_QUERIES_KEPT', 50)
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abandon_request)
+
+# ----------------------------------------------------------------------------
+# Отчеты
+# ----------------------------------------------------------------------------
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга; values отсортированы"""
+    if not values:
+        return 0
+    rank = math.ceil(percent / 100 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def endpoint_summary():
+    """Перцентили по эндпоинтам за последние PERF_SAMPLE_SIZE запросов, медленные сверху"""
+    with _lock:
+        snapshot = [(endpoint, stats['count'], list(stats['samples'])) for endpoint, stats in _endpoints.items()]
+
+    rows = []
+    for endpoint, count, samples in snapshot:
+        wall = sorted(sample[0] for sample in samples)
+        db_time = sorted(sample[1] for sample in samples)
+        queries = [sample[2] for sample in samples]
+        sizes = [sample[3] for sample in samples]
+        rows.append({
+            'endpoint': endpoint,
+            'count': count,
+            'samples': len(samples),
+            'p50': percentile(wall, 50),
+            'p95': percentile(wall, 95),
+            'p99': percentile(wall, 99),
+            'max': wall[-1],
+            'db_p50': percentile(db_time, 50),
+            'db_p95': percentile(db_time, 95),
+            'queries_avg': sum(queries) / len(queries),
+            'queries_max': max(queries),
+            'size_avg': sum(sizes) / len(sizes)
+        })
+    rows.sort(key=lambda row: row['p95'], reverse=True)
+    return rows
+
+def slow_queries():
+    """Медленные запросы по отпечаткам, самые долгие сверху"""
+    with _lock:
+        rows = [dict(entry) for entry in _slow_queries.values()]
+    rows.sort(key=lambda row: row['max_ms'], reverse=True)
+    return rows
+
+def reset():
+    with _lock:
+        _endpoints.clear()
+        _slow_queries.clear()
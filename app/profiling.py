@@ -0,0 +1,191 @@
+from collections import Counter
+from flask import Response, current_app, g, request
+from flask_login import current_user
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------------
+# Профилирование одного запроса: ?_profile=sample|cprofile или заголовок X-Profile
+# ----------------------------------------------------------------------------
+
+class StackSampler:
+    """Сэмплирующий профилировщик одного потока.
+
+    Раз в interval секунд снимает стек потока через sys._current_frames();
+    результат - свернутые стеки (folded) для flamegraph.pl или speedscope.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._fold(frame)] += 1
+
+    @staticmethod
+    def _fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common()) + '\n'
+
+def _requested_mode():
+    mode = request.args.get('_profile') or request.headers.get('X-Profile')
+    if not mode:
+        return None
+    return 'cprofile' if mode == 'cprofile' else 'sample'
+
+def _start_profile():
+    mode = _requested_mode()
+    if mode is None:
+        return
+    # Флаг работает только для администраторов, остальным запрос выполняется как обычно
+    if not (current_user.is_authenticated and current_user.is_admin):
+        return
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        interval = current_app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+        profiler = StackSampler(threading.get_ident(), interval).start()
+    g.profiler = (mode, profiler)
+    logger.info("Профилирование запроса %s (%s) для %s", request.path, mode, current_user.username)
+
+def _finish_profile(response):
+    profile = g.pop('profiler', None)
+    if profile is None:
+        return response
+    mode, profiler = profile
+
+    if mode == 'cprofile':
+        profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(current_app.config.get('PROFILE_STATS_LIMIT', 60))
+        body = output.getvalue()
+    else:
+        profiler.stop()
+        body = profiler.folded()
+
+    result = Response(body, mimetype='text/plain')
+    result.headers['X-Profiled-Status'] = str(response.status_code)
+    result.headers['Content-Disposition'] = f'inline; filename=profile-{mode}.txt'
+    return result
+
+def _abandon_profile(exc=None):
+    # При необработанном исключении after_request не вызывается: останавливаем сэмплер
+    profile = g.pop('profiler', None)
+    if profile is None:
+        return
+    mode, profiler = profile
+    if mode == 'cprofile':
+        profiler.disable()
+    else:
+        profiler.stop()
+
+def init_profiling(app):
+    """Подключает профилирование запросов по флагу для администраторов"""
+    if not app.config.get('PROFILING_ENABLED', True):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abandon_profile)
+
+# ----------------------------------------------------------------------------
+# Снимки памяти (tracemalloc), по процессу
+# ----------------------------------------------------------------------------
+
+_baseline = None
+_memory_lock = threading.Lock()
+
+def memory_status():
+    traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        'tracing': tracemalloc.is_tracing(),
+        'traced': traced,
+        'peak': peak,
+        'has_baseline': _baseline is not None,
+        'pid': os.getpid()
+    }
+
+def start_tracing(frames=None):
+    frames = frames or current_app.config.get('TRACEMALLOC_FRAMES', 25)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_tracing():
+    global _baseline
+    with _memory_lock:
+        _baseline = None
+    tracemalloc.stop()
+
+def _snapshot():
+    # Память самого tracemalloc и импортов не интересна
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ))
+
+def take_baseline():
+    """Запоминает снимок, с которым будут сравниваться следующие"""
+    global _baseline
+    start_tracing()
+    snapshot = _snapshot()
+    with _memory_lock:
+        _baseline = snapshot
+
+def _where(stat, group_by):
+    if group_by == 'traceback':
+        return '\n'.join(stat.traceback.format(most_recent_first=True))
+    return str(stat.traceback)
+
+def top_allocations(limit=25, group_by='lineno'):
+    """Крупнейшие места выделения памяти в текущем снимке"""
+    if not tracemalloc.is_tracing():
+        return []
+    return [
+        {'where': _where(stat, group_by), 'size': stat.size, 'count': stat.count}
+        for stat in _snapshot().statistics(group_by)[:limit]
+    ]
+
+def growth_since_baseline(limit=25, group_by='lineno'):
+    """Рост памяти относительно базового снимка, больший рост сверху"""
+    with _memory_lock:
+        baseline = _baseline
+    if baseline is None or not tracemalloc.is_tracing():
+        return []
+    return [
+        {'where': _where(stat, group_by), 'size_diff': stat.size_diff, 'size': stat.size,
+         'count_diff': stat.count_diff}
+        for stat in _snapshot().compare_to(baseline, group_by)[:limit]
+    ]
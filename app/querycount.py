@@ -0,0 +1,131 @@
+from sqlalchemy import event
+from . import db
+import threading
+import weakref
+
+# Счетчики, активные в текущем потоке (вложенные блоки with считают каждый)
+_active = threading.local()
+_watched = weakref.WeakSet()
+
+def _counters():
+    return getattr(_active, 'counters', ())
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in _counters():
+        if counter.engine is conn.engine:
+            counter.count += 1
+            if counter.keep_statements:
+                counter.statements.append(statement)
+
+def _on_result(conn, clauseelement, multiparams, params, execution_options, result):
+    for counter in _counters():
+        if counter.engine is conn.engine:
+            counter.on_result(result)
+
+def watch_engine(engine):
+    """Один постоянный обработчик на движок; без активного счетчика он ничего не делает"""
+    if engine not in _watched:
+        event.listen(engine, 'before_cursor_execute', _on_execute)
+        event.listen(engine, 'after_execute', _on_result)
+        _watched.add(engine)
+
+def init_querycount(app):
+    """Подключает подсчет запросов к движкам приложения один раз при старте"""
+    with app.app_context():
+        for engine in db.engines.values():
+            watch_engine(engine)
+
+class QueryCounter:
+    """Считает SQL-запросы текущего потока внутри блока with.
+
+        with QueryCounter() as counter:
+            ...
+        counter.count, counter.statements
+
+    Обработчики событий движка постоянные (init_querycount), блок with только
+    включает счетчик для своего потока.
+    """
+
+    def __init__(self, engine=None, keep_statements=False):
+        self.engine = engine
+        self.keep_statements = keep_statements
+        self.count = 0
+        self.statements = []
+
+    def on_result(self, result):
+        pass
+
+    def __enter__(self):
+        self.engine = self.engine or db.engine
+        watch_engine(self.engine)
+        _active.counters = (*_counters(), self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.counters = tuple(counter for counter in _counters() if counter is not self)
+        return False
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class _CountedFetch:
+    """Обертка стратегии выборки CursorResult: считает отданные строки"""
+
+    def __init__(self, strategy, budget):
+        self._strategy = strategy
+        self._budget = budget
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = self._strategy.fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            self._budget.rows += 1
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = self._strategy.fetchmany(result, dbapi_cursor, size)
+        self._budget.rows += len(rows)
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = self._strategy.fetchall(result, dbapi_cursor)
+        self._budget.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._strategy, name)
+
+class QueryBudget(QueryCounter):
+    """QueryCounter с пределами: число SQL-запросов и строк, прочитанных из их результатов.
+
+        with QueryBudget(max_queries=3, max_rows=50) as budget:
+            client.get('/cart')
+
+    Строки считаются для любых запросов - ORM, Core и text(), - а не только
+    загруженных в ORM-объекты. При превышении на выходе из блока бросает
+    QueryBudgetExceeded со списком запросов.
+    """
+
+    def __init__(self, max_queries=None, max_rows=None, engine=None):
+        super().__init__(engine=engine, keep_statements=True)
+        self.max_queries = max_queries
+        self.max_rows = max_rows
+        self.rows = 0
+
+    def on_result(self, result):
+        strategy = getattr(result, 'cursor_strategy', None)
+        if strategy is not None:
+            result.cursor_strategy = _CountedFetch(strategy, self)
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if exc_type is None and self.violations():
+            raise QueryBudgetExceeded('; '.join(self.violations()) + '\n' + '\n'.join(self.statements))
+        return False
+
+    def violations(self):
+        problems = []
+        if self.max_queries is not None and self.count > self.max_queries:
+            problems.append(f'запросов {self.count} > {self.max_queries}')
+        if self.max_rows is not None and self.rows > self.max_rows:
+            problems.append(f'строк {self.rows} > {self.max_rows}')
+        return problems
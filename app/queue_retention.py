@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from . import db
+from .models import ImageQueue, ImageDownload
+from . import queue_stats
+import hashlib
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Итоги, которые сохраняются в индексе загрузок. skipped нового не сообщает:
+# URL уже скачан или уже известен как неудачный
+OUTCOMES = ('completed', 'failed')
+
+def url_hash(url):
+    return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+def lookup_outcome(url):
+    """Известный итог загрузки URL из индекса: (status, attempts) или None"""
+    row = db.session.get(ImageDownload, url_hash(url))
+    return (row.status, row.attempts) if row else None
+
+def lookup_outcomes(urls, chunk_size=500):
+    """Итоги загрузки для списка URL: {url: (status, attempts) или None}.
+
+    Один запрос IN на каждые chunk_size адресов вместо запроса на каждый URL.
+    """
+    by_hash = {url_hash(url): url for url in set(urls) if url}
+    outcomes = dict.fromkeys(by_hash.values())
+    hashes = list(by_hash)
+    for start in range(0, len(hashes), chunk_size):
+        rows = db.session.query(
+            ImageDownload.url_hash, ImageDownload.status, ImageDownload.attempts
+        ).filter(ImageDownload.url_hash.in_(hashes[start:start + chunk_size])).all()
+        for key, status, attempts in rows:
+            outcomes[by_hash[key]] = (status, attempts)
+    return outcomes
+
+def _archive(rows):
+    """Переносит итоги задач в индекс загрузок одним INSERT ... ON CONFLICT"""
+    outcomes = {}
+    for image_url, status, retry_count, updated_at in rows:
+        if status not in OUTCOMES:
+            continue
+        key = url_hash(image_url)
+        previous = outcomes.get(key)
+        # Успешная загрузка важнее неудачной по тому же URL
+        if previous and (previous['status'] == 'completed' or status != 'completed'):
+            previous['attempts'] = max(previous['attempts'], retry_count or 0)
+            continue
+        outcomes[key] = {
+            'url_hash': key,
+            'status': status,
+            'attempts': retry_count or 0,
+            'updated_at': updated_at or datetime.utcnow()
+        }
+
+    if not outcomes:
+        return
+
+    values = list(outcomes.values())
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(ImageDownload).values(values)
+        current = ImageDownload.__table__.c
+        # Уже сохраненная успешная загрузка не затирается неудачей, а число
+        # попыток только растет: greatest() в Postgres, скалярный max() в SQLite
+        greatest = db.func.greatest if dialect == 'postgresql' else db.func.max
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['url_hash'],
+            set_={
+                'status': db.case(
+                    (current.status == 'completed', current.status),
+                    else_=stmt.excluded.status
+                ),
+                'attempts': greatest(current.attempts, stmt.excluded.attempts),
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    for value in values:
+        existing = db.session.get(ImageDownload, value['url_hash'])
+        if existing is None:
+            db.session.add(ImageDownload(**value))
+            continue
+        if existing.status != 'completed':
+            existing.status = value['status']
+        existing.attempts = max(existing.attempts or 0, value['attempts'])
+        existing.updated_at = value['updated_at']
+
+def _delete_in_batches(condition, batch_size, deadline):
+    """Архивирует и удаляет задачи пачками по batch_size, пока не выйдет время"""
+    deleted = 0
+    while True:
+        rows = db.session.query(
+            ImageQueue.id, ImageQueue.image_url, ImageQueue.status,
+            ImageQueue.retry_count, ImageQueue.updated_at
+        ).filter(condition).order_by(ImageQueue.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        _archive([row[1:] for row in rows])
+        ImageQueue.query.filter(
+            ImageQueue.id.in_([row[0] for row in rows])
+        ).delete(synchronize_session=False)
+        # Короткая транзакция на каждую пачку, без долгих блокировок таблицы
+        db.session.commit()
+        deleted += len(rows)
+
+        if len(rows) < batch_size or time.monotonic() >= deadline:
+            break
+    return deleted
+
+def _limits(batch_size, time_budget):
+    batch_size = batch_size or current_app.config.get('IMAGE_QUEUE_DELETE_BATCH', 500)
+    time_budget = time_budget or current_app.config.get('IMAGE_QUEUE_DELETE_SECONDS', 5)
+    return batch_size, time.monotonic() + time_budget
+
+def compact_queue(batch_size=None, time_budget=None):
+    """Удаляет из очереди завершенные задачи и исчерпавшие попытки старше срока хранения.
+
+    Возвращает число удаленных задач.
+    """
+    batch_size, deadline = _limits(batch_size, time_budget)
+    retention = current_app.config.get('IMAGE_QUEUE_RETENTION_HOURS', 24)
+    max_retries = current_app.config.get('IMAGE_QUEUE_MAX_RETRIES', 3)
+    cutoff = datetime.utcnow() - timedelta(hours=retention)
+
+    condition = db.and_(
+        ImageQueue.updated_at < cutoff,
+        db.or_(
+            ImageQueue.status.in_(['completed', 'skipped']),
+            db.and_(ImageQueue.status == 'failed', ImageQueue.retry_count >= max_retries)
+        )
+    )
+    deleted = _delete_in_batches(condition, batch_size, deadline)
+    if deleted:
+        queue_stats.notify_queue_changed()
+        logger.info(f"Очищено {deleted} старых задач из очереди")
+    return deleted
+
+def drain_queue(batch_size=None, time_budget=None):
+    """Удаляет все задачи очереди пачками (итоги сохраняются в индексе загрузок).
+
+    Работает не дольше time_budget: задачи, не успевшие удалиться, остаются
+    в очереди - их число показывает remaining_count().
+    """
+    batch_size, deadline = _limits(batch_size, time_budget)
+    deleted = _delete_in_batches(db.true(), batch_size, deadline)
+    if deleted:
+        queue_stats.notify_queue_changed()
+    return deleted
+
+def remaining_count():
+    """Сколько задач осталось в очереди"""
+    return db.session.query(db.func.count(ImageQueue.id)).scalar() or 0
@@ -0,0 +1,115 @@
+from flask import current_app
+from . import db
+from .models import ImageQueue
+from .stamps import read_stamp, touch_stamp
+from . import metrics
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pending', 'downloading', 'completed', 'failed', 'skipped')
+
+# Кэш статистики процесса: (метка изменений, истекает, статистика)
+_cache = None
+_cache_lock = threading.Lock()
+
+# Открытые SSE-потоки процесса (семафор создается в каждом воркере после fork)
+_stream_slots = None
+_stream_slots_key = None
+# Через сколько переподключаться клиенту, которому не хватило потока
+BUSY_RETRY_MS = 15000
+
+def _stamp_path():
+    return current_app.config['QUEUE_STATS_STAMP']
+
+def _query_stats():
+    """Количество задач по статусам одним GROUP BY"""
+    stats = dict.fromkeys(STATUSES, 0)
+    rows = db.session.query(ImageQueue.status, db.func.count(ImageQueue.id)).group_by(ImageQueue.status)
+    for status, count in rows:
+        status = status or 'pending'
+        stats[status] = stats.get(status, 0) + count
+    stats['total'] = sum(stats.values())
+    return stats
+
+def get_queue_stats():
+    """Статистика очереди изображений, кэшируется до изменения очереди или на QUEUE_STATS_CACHE_TTL"""
+    global _cache
+    stamp = read_stamp(_stamp_path())
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache
+    hit = bool(cached and cached[0] == stamp and cached[1] > now)
+    metrics.record_cache('queue_stats', hit)
+    if hit:
+        return dict(cached[2])
+
+    stats = _query_stats()
+    with _cache_lock:
+        _cache = (stamp, now + current_app.config.get('QUEUE_STATS_CACHE_TTL', 5), stats)
+    return dict(stats)
+
+def notify_queue_changed():
+    """Сообщает всем процессам об изменении очереди (сброс кэша и push в SSE)"""
+    global _cache
+    with _cache_lock:
+        _cache = None
+    touch_stamp(_stamp_path())
+
+def _event(stats):
+    return f"event: stats\ndata: {json.dumps(stats)}\n\n"
+
+def _get_stream_slots():
+    global _stream_slots, _stream_slots_key
+    limit = current_app.config.get('QUEUE_EVENTS_MAX_STREAMS', 2)
+    with _cache_lock:
+        if _stream_slots is None or _stream_slots_key != (os.getpid(), limit):
+            _stream_slots = threading.BoundedSemaphore(limit)
+            _stream_slots_key = (os.getpid(), limit)
+        return _stream_slots
+
+def stream_queue_events():
+    """Генератор server-sent events: статистика при каждом изменении очереди.
+
+    Метка изменений проверяется раз в секунду без запросов к БД. Поток
+    закрывается через QUEUE_EVENTS_MAX_AGE секунд, браузер переподключается сам.
+    Если в процессе уже открыто QUEUE_EVENTS_MAX_STREAMS потоков, клиент
+    получает один снимок статистики и переподключается через BUSY_RETRY_MS.
+    """
+    path = _stamp_path()
+    max_age = current_app.config.get('QUEUE_EVENTS_MAX_AGE', 25)
+    slots = _get_stream_slots()
+    # Соединение с БД, открытое при загрузке пользователя, не держим на время потока
+    db.session.remove()
+
+    if not slots.acquire(blocking=False):
+        yield f'retry: {BUSY_RETRY_MS}\n'
+        yield _event(get_queue_stats())
+        db.session.remove()
+        return
+
+    try:
+        started = last_sent = time.monotonic()
+        stamp = read_stamp(path)
+        yield 'retry: 3000\n'
+        yield _event(get_queue_stats())
+
+        while time.monotonic() - started < max_age:
+            db.session.remove()
+            time.sleep(1)
+            current = read_stamp(path)
+            if current != stamp:
+                stamp = current
+                yield _event(get_queue_stats())
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= 15:
+                # Комментарий-пинг, чтобы прокси не закрыл простаивающее соединение
+                yield ': ping\n\n'
+                last_sent = time.monotonic()
+    finally:
+        db.session.remove()
+        slots.release()
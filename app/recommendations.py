@@ -0,0 +1,144 @@
+from collections import Counter
+from flask import current_app
+from itertools import combinations, groupby, product
+from . import db
+from .models import Dish, OrderItem, DishPairCount, DishRecommendation
+from .rollups import upsert_delta
+import logging
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH = 1000
+REFRESH_CHUNK = 500
+MARK_CHUNK = 500
+
+def _order_baskets(pending_only):
+    """Отдает (набор новых блюд, набор уже учтенных блюд, ID новых позиций) по заказам.
+
+    Новые - позиции с in_recommendations = false, независимо от ID заказа:
+    так учитываются и заказы, закоммиченные позже заказов с большим ID, и
+    позиции, добавленные в старый заказ из админки. При pending_only=False
+    (полный пересчет) новыми считаются все позиции заказа.
+    """
+    query = db.session.query(
+        OrderItem.order_id, OrderItem.dish_id, OrderItem.id, OrderItem.in_recommendations
+    ).filter(OrderItem.dish_id.isnot(None))
+    if pending_only:
+        pending_orders = db.select(OrderItem.order_id).where(OrderItem.in_recommendations == False)
+        query = query.filter(OrderItem.order_id.in_(pending_orders))
+    rows = query.order_by(OrderItem.order_id).yield_per(STREAM_BATCH)
+
+    for _, items in groupby(rows, key=lambda row: row[0]):
+        new_dishes, counted_dishes, new_item_ids = set(), set(), []
+        for _, dish_id, item_id, counted in items:
+            if counted and pending_only:
+                counted_dishes.add(dish_id)
+                continue
+            new_dishes.add(dish_id)
+            if not counted:
+                new_item_ids.append(item_id)
+        if new_item_ids or not pending_only:
+            yield new_dishes - counted_dishes, counted_dishes, new_item_ids
+
+def count_pairs(baskets):
+    """Считает разреженную матрицу совместных покупок: {(a, b): n} для a < b.
+
+    Для заказа с уже учтенными блюдами добавляются только пары с новыми блюдами.
+    Возвращает (пары, ID учтенных позиций).
+    """
+    pairs = Counter()
+    item_ids = []
+    for new_dishes, counted_dishes, new_item_ids in baskets:
+        item_ids.extend(new_item_ids)
+        pairs.update(combinations(sorted(new_dishes), 2))
+        pairs.update(tuple(sorted(pair)) for pair in product(new_dishes, counted_dishes))
+    return pairs, item_ids
+
+def _mark_counted(item_ids):
+    for start in range(0, len(item_ids), MARK_CHUNK):
+        OrderItem.query.filter(OrderItem.id.in_(item_ids[start:start + MARK_CHUNK])).update(
+            {OrderItem.in_recommendations: True}, synchronize_session=False)
+
+def _store_pairs(pairs, full):
+    if full:
+        db.session.bulk_insert_mappings(DishPairCount, [
+            {'dish_id': dish_id, 'other_dish_id': other_id, 'count': count}
+            for (a, b), count in pairs.items()
+            for dish_id, other_id in ((a, b), (b, a))
+        ])
+        return
+
+    for (a, b), count in pairs.items():
+        upsert_delta(DishPairCount, {'dish_id': a, 'other_dish_id': b}, {'count': count})
+        upsert_delta(DishPairCount, {'dish_id': b, 'other_dish_id': a}, {'count': count})
+
+def _refresh_top_k(dish_ids, top_k):
+    """Пересчитывает top-K соседей для указанных блюд"""
+    dish_ids = sorted(dish_ids)
+    for start in range(0, len(dish_ids), REFRESH_CHUNK):
+        chunk = dish_ids[start:start + REFRESH_CHUNK]
+
+        rows = db.session.query(
+            DishPairCount.dish_id, DishPairCount.other_dish_id, DishPairCount.count, Dish.orders_count
+        ).join(Dish, Dish.id == DishPairCount.dish_id).filter(
+            DishPairCount.dish_id.in_(chunk)
+        ).order_by(DishPairCount.dish_id, DishPairCount.count.desc(), DishPairCount.other_dish_id).all()
+
+        DishRecommendation.query.filter(
+            DishRecommendation.dish_id.in_(chunk)
+        ).delete(synchronize_session=False)
+
+        mappings = []
+        for dish_id, neighbours in groupby(rows, key=lambda row: row[0]):
+            for rank, (_, other_id, count, orders_count) in enumerate(neighbours):
+                if rank >= top_k:
+                    break
+                # Доля заказов блюда, в которых было и соседнее блюдо
+                score = count / orders_count if orders_count else float(count)
+                mappings.append({
+                    'dish_id': dish_id,
+                    'rank': rank,
+                    'recommended_dish_id': other_id,
+                    'score': score
+                })
+        db.session.bulk_insert_mappings(DishRecommendation, mappings)
+
+def build_recommendations(full=False):
+    """Обновляет матрицу совместных покупок по неучтенным позициям и top-K соседей.
+
+    При full=True всё пересчитывается с нуля. Возвращает число обработанных пар.
+    """
+    if full:
+        DishRecommendation.query.delete(synchronize_session=False)
+        DishPairCount.query.delete(synchronize_session=False)
+
+    pairs, item_ids = count_pairs(_order_baskets(pending_only=not full))
+    _store_pairs(pairs, full)
+
+    affected = {dish_id for pair in pairs for dish_id in pair}
+    _refresh_top_k(affected, current_app.config.get('RECOMMENDATIONS_TOP_K', 10))
+
+    # Отмечаются только прочитанные позиции: закоммиченные во время пересчета учтутся в следующий раз
+    _mark_counted(item_ids)
+    db.session.commit()
+
+    logger.info(f"Рекомендации обновлены: {len(pairs)} пар, {len(affected)} блюд, "
+                f"{len(item_ids)} новых позиций")
+    return len(pairs)
+
+def recommendations_for(dish_ids, limit=4):
+    """Блюда, которые чаще всего заказывают вместе с переданными (один запрос)"""
+    dish_ids = [int(dish_id) for dish_id in dish_ids]
+    if not dish_ids:
+        return []
+
+    score = db.func.sum(DishRecommendation.score)
+    rows = db.session.query(Dish, score).join(
+        DishRecommendation, DishRecommendation.recommended_dish_id == Dish.id
+    ).filter(
+        DishRecommendation.dish_id.in_(dish_ids),
+        DishRecommendation.recommended_dish_id.notin_(dish_ids),
+        Dish.is_available == True
+    ).group_by(Dish.id).order_by(score.desc()).limit(limit).all()
+
+    return [dish for dish, _ in rows]
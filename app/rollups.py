@@ -0,0 +1,294 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from . import db
+from .models import Order, OrderItem, Dish, DailyOrderStats, DishDailySales
+from . import metrics
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATUS = 'Новый'
+
+def upsert_delta(model, keys, deltas):
+    """Добавляет дельты к строке сводки, создавая её при необходимости"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(model).values(**keys, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={
+                name: getattr(model, name) + getattr(stmt.excluded, name)
+                for name in deltas
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    updated = model.query.filter_by(**keys).update({
+        getattr(model, name): getattr(model, name) + value
+        for name, value in deltas.items()
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(model(**keys, **deltas))
+
+def apply_order_delta(created_at, status, orders=0, revenue=0):
+    """Изменяет сводку за день заказа в текущей транзакции"""
+    if not (orders or revenue):
+        return
+    day = (created_at or datetime.utcnow()).date()
+    upsert_delta(DailyOrderStats,
+                 {'day': day, 'status': status or DEFAULT_STATUS},
+                 {'orders_count': orders, 'revenue': revenue or 0})
+
+def record_order(order, items=()):
+    """Учитывает новый заказ; items - пары (dish_id, quantity) его позиций"""
+    apply_order_delta(order.created_at, order.status, 1, order.total)
+    record_dish_sales(order.created_at, items)
+
+def record_dish_sales(created_at, items):
+    """Увеличивает счетчики популярности блюд из одного заказа"""
+    day = (created_at or datetime.utcnow()).date()
+    for dish_id, quantity in items:
+        Dish.query.filter_by(id=dish_id).update({
+            Dish.orders_count: Dish.orders_count + 1,
+            Dish.quantity_sold: Dish.quantity_sold + quantity
+        }, synchronize_session=False)
+        upsert_delta(DishDailySales,
+                     {'day': day, 'dish_id': dish_id},
+                     {'orders_count': 1, 'quantity': quantity})
+
+def forget_order(order):
+    """Убирает удаляемый заказ из сводки"""
+    apply_order_delta(order.created_at, order.status, -1, -(order.total or 0))
+
+def move_order(created_at, old_status, old_total, new_status, new_total):
+    """Переносит заказ между статусами и/или меняет его сумму в сводке"""
+    old_status = old_status or DEFAULT_STATUS
+    new_status = new_status or DEFAULT_STATUS
+    if old_status == new_status:
+        apply_order_delta(created_at, new_status, 0, (new_total or 0) - (old_total or 0))
+        return
+    apply_order_delta(created_at, old_status, -1, -(old_total or 0))
+    apply_order_delta(created_at, new_status, 1, new_total or 0)
+
+def _to_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+
+def move_orders_status(orders, new_status):
+    """Переводит заказы в новый статус и переносит их в сводке.
+
+    orders - список ID или подзапрос ID (все заказы текущего фильтра админки).
+    На каждый прежний статус - один UPDATE с этим статусом в WHERE, сводка
+    правится по строкам из его RETURNING: заказ, который параллельно уже
+    перевели в другой статус, не обновится и не будет учтен в сводке дважды.
+    Возвращает число измененных заказов; коммит за вызывающим кодом.
+    """
+    if isinstance(orders, (list, tuple, set)) and not orders:
+        return 0
+
+    selected = Order.id.in_(orders)
+    status = db.func.coalesce(Order.status, DEFAULT_STATUS)
+    old_statuses = [value for value, in db.session.query(status).filter(
+        selected, status != new_status).distinct()]
+
+    updated = 0
+    for old_status in old_statuses:
+        rows = db.session.execute(
+            db.update(Order)
+            .where(selected, status == old_status)
+            .values(status=new_status)
+            .returning(db.func.date(Order.created_at), db.func.coalesce(Order.total, 0)),
+            execution_options={'synchronize_session': False}
+        ).all()
+
+        # Сводка правится по дням, а не по заказам
+        days = {}
+        for row_day, total in rows:
+            count, revenue = days.get(row_day, (0, 0))
+            days[row_day] = (count + 1, revenue + total)
+        for row_day, (count, revenue) in days.items():
+            row_day = _to_date(row_day)
+            upsert_delta(DailyOrderStats,
+                         {'day': row_day, 'status': old_status},
+                         {'orders_count': -count, 'revenue': -revenue})
+            upsert_delta(DailyOrderStats,
+                         {'day': row_day, 'status': new_status},
+                         {'orders_count': count, 'revenue': revenue})
+        updated += len(rows)
+    return updated
+
+def rebuild_daily_stats():
+    """Полностью пересобирает сводку из таблицы заказов. Возвращает число строк"""
+    day = db.func.date(Order.created_at)
+    status = db.func.coalesce(Order.status, DEFAULT_STATUS)
+    rows = db.session.query(
+        day, status, db.func.count(Order.id), db.func.coalesce(db.func.sum(Order.total), 0)
+    ).group_by(day, status).all()
+
+    DailyOrderStats.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(DailyOrderStats, [
+        {
+            'day': _to_date(row_day),
+            'status': row_status,
+            'orders_count': count,
+            'revenue': revenue
+        }
+        for row_day, row_status, count, revenue in rows
+    ])
+    db.session.commit()
+    logger.info(f"Сводка заказов пересобрана: {len(rows)} строк")
+    return len(rows)
+
+def rebuild_dish_stats():
+    """Пересобирает счетчики популярности блюд из позиций заказов"""
+    orders_count = db.select(db.func.count(db.distinct(OrderItem.order_id))).where(
+        OrderItem.dish_id == Dish.id
+    ).scalar_subquery()
+    quantity_sold = db.select(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).where(
+        OrderItem.dish_id == Dish.id
+    ).scalar_subquery()
+    db.session.execute(db.update(Dish).values(
+        orders_count=orders_count,
+        quantity_sold=quantity_sold
+    ))
+
+    day = db.func.date(Order.created_at)
+    rows = db.session.query(
+        day, OrderItem.dish_id,
+        db.func.count(db.distinct(OrderItem.order_id)),
+        db.func.sum(OrderItem.quantity)
+    ).join(Order, Order.id == OrderItem.order_id).filter(
+        OrderItem.dish_id.isnot(None)
+    ).group_by(day, OrderItem.dish_id).all()
+
+    DishDailySales.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(DishDailySales, [
+        {'day': _to_date(row_day), 'dish_id': dish_id, 'orders_count': count, 'quantity': quantity}
+        for row_day, dish_id, count, quantity in rows
+    ])
+    db.session.commit()
+    clear_popular_cache()
+    logger.info(f"Популярность блюд пересобрана: {len(rows)} дневных строк")
+    return len(rows)
+
+# ----------------------------------------------------------------------------
+# Популярные блюда (кэш в памяти процесса)
+# ----------------------------------------------------------------------------
+
+_popular_cache = {}
+_popular_lock = threading.Lock()
+
+def clear_popular_cache():
+    with _popular_lock:
+        _popular_cache.clear()
+
+def _query_popular(days, limit, available_only):
+    if days:
+        since = datetime.now().date() - timedelta(days=days)
+        orders = db.func.sum(DishDailySales.orders_count)
+        quantity = db.func.sum(DishDailySales.quantity)
+        query = db.session.query(Dish, orders, quantity).join(
+            DishDailySales, DishDailySales.dish_id == Dish.id
+        ).filter(DishDailySales.day >= since).group_by(Dish.id)
+    else:
+        orders = Dish.orders_count
+        quantity = Dish.quantity_sold
+        query = db.session.query(Dish, orders, quantity).filter(Dish.orders_count > 0)
+
+    if available_only:
+        query = query.filter(Dish.is_available == True)
+
+    rows = query.order_by(orders.desc(), quantity.desc()).limit(limit).all()
+    return [
+        {
+            'id': dish.id,
+            'name': dish.name,
+            'price': dish.price,
+            'image': dish.image,
+            'count': dish_orders,
+            'quantity': dish_quantity
+        }
+        for dish, dish_orders, dish_quantity in rows
+    ]
+
+def popular_dishes(days=None, limit=5, available_only=False):
+    """Топ блюд по числу заказов: за всё время или за последние days дней.
+
+    Результат кэшируется на POPULAR_DISHES_CACHE_TTL секунд.
+    """
+    key = (days, limit, available_only)
+    ttl = current_app.config.get('POPULAR_DISHES_CACHE_TTL', 300)
+    now = time.monotonic()
+    with _popular_lock:
+        cached = _popular_cache.get(key)
+    metrics.record_cache('popular_dishes', bool(cached and cached[0] > now))
+    if cached and cached[0] > now:
+        return cached[1]
+
+    result = _query_popular(days, limit, available_only)
+    with _popular_lock:
+        _popular_cache[key] = (now + ttl, result)
+    return result
+
+# ----------------------------------------------------------------------------
+# Запросы для дашбордов
+# ----------------------------------------------------------------------------
+
+def order_totals():
+    """Количество заказов и выручка за всё время"""
+    count, revenue = db.session.query(
+        db.func.coalesce(db.func.sum(DailyOrderStats.orders_count), 0),
+        db.func.coalesce(db.func.sum(DailyOrderStats.revenue), 0)
+    ).one()
+    return count, revenue
+
+def status_totals():
+    """Заказы и выручка по статусам"""
+    return db.session.query(
+        DailyOrderStats.status.label('status'),
+        db.func.sum(DailyOrderStats.orders_count).label('count'),
+        db.func.sum(DailyOrderStats.revenue).label('revenue')
+    ).group_by(DailyOrderStats.status).having(
+        db.func.sum(DailyOrderStats.orders_count) > 0
+    ).all()
+
+def daily_totals(limit=30):
+    """Заказы и выручка по дням, начиная с последнего"""
+    return db.session.query(
+        DailyOrderStats.day.label('date'),
+        db.func.sum(DailyOrderStats.orders_count).label('count'),
+        db.func.sum(DailyOrderStats.revenue).label('revenue')
+    ).group_by(DailyOrderStats.day).having(
+        db.func.sum(DailyOrderStats.orders_count) > 0
+    ).order_by(DailyOrderStats.day.desc()).limit(limit).all()
+
+def dashboard_periods(today=None):
+    """Заказы и выручка за сегодня, неделю и месяц одним запросом"""
+    today = today or datetime.now().date()
+    week_ago = today - timedelta(days=7)
+    month_ago = today - timedelta(days=30)
+
+    def window(condition, column):
+        return db.func.coalesce(db.func.sum(db.case((condition, column), else_=0)), 0)
+
+    row = db.session.query(
+        window(DailyOrderStats.day == today, DailyOrderStats.orders_count),
+        window(DailyOrderStats.day >= week_ago, DailyOrderStats.orders_count),
+        window(DailyOrderStats.day >= month_ago, DailyOrderStats.orders_count),
+        window(DailyOrderStats.day == today, DailyOrderStats.revenue),
+        window(DailyOrderStats.day >= week_ago, DailyOrderStats.revenue),
+        window(DailyOrderStats.day >= month_ago, DailyOrderStats.revenue)
+    ).filter(DailyOrderStats.day >= month_ago).one()
+
+    return {
+        'orders_today': row[0],
+        'orders_week': row[1],
+        'orders_month': row[2],
+        'revenue_today': row[3],
+        'revenue_week': row[4],
+        'revenue_month': row[5]
+    }
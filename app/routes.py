@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, flash, session, redirect, url_for, jsonify
 from flask_login import current_user, login_required
 from . import db
-from .models import Category, Dish, Order, OrderItem, Favorite
+from .models import Category, Dish, Order, OrderItem, Favorite, User
+from .favorites import get_favorite_ids, toggle_favorite, invalidate_favorites
+from .rollups import record_order, popular_dishes
+from .recommendations import recommendations_for
 import json
 import logging
 
@@ -10,15 +13,55 @@ logger = logging.getLogger(__name__)
 # ЭТА СТРОКА ОБЯЗАТЕЛЬНО ДОЛЖНА БЫТЬ:
 main = Blueprint('main', __name__)
 
+CART_BATCH_MAX_OPS = 50
+CART_MAX_QUANTITY = 99
+
+def _is_json_int(value):
+    """Целое число из JSON; true/false в Python тоже int, их отклоняем"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _save_cart(cart):
+    """Сохраняет корзину в сессии и увеличивает её версию"""
+    session['cart'] = cart
+    session['cart_version'] = session.get('cart_version', 0) + 1
+    session.modified = True
+
+def _cart_summary(cart):
+    """Пересчитывает корзину по актуальным ценам одним запросом"""
+    dish_ids = [int(dish_id) for dish_id in cart]
+    dishes = {}
+    if dish_ids:
+        dishes = {d.id: d for d in Dish.query.filter(Dish.id.in_(dish_ids)).all()}
+
+    items = {}
+    total_price = 0
+    total_items = 0
+    for dish_id, item in cart.items():
+        dish = dishes.get(int(dish_id))
+        if not dish:
+            continue
+        subtotal = dish.price * item['quantity']
+        items[dish_id] = {'quantity': item['quantity'], 'subtotal': subtotal}
+        total_price += subtotal
+        total_items += item['quantity']
+
+    return {
+        'version': session.get('cart_version', 0),
+        'items': items,
+        'total_price': total_price,
+        'cart_total': total_items
+    }
+
 @main.route('/')
 def index():
     try:
         categories = Category.query.all()
-        return render_template('index.html', categories=categories)
+        popular = popular_dishes(days=30, limit=4, available_only=True)
+        return render_template('index.html', categories=categories, popular=popular)
     except Exception as e:
         logger.error(f"Ошибка загрузки главной страницы: {str(e)}")
         flash('Ошибка загрузки главной страницы', 'danger')
-        return render_template('index.html', categories=[])
+        return render_template('index.html', categories=[], popular=[])
 
 @main.route('/menu/<int:category_id>')
 def menu(category_id):
@@ -26,15 +69,17 @@ def menu(category_id):
         category = Category.query.get_or_404(category_id)
         dishes = Dish.query.filter_by(category_id=category_id, is_available=True).all()
         
-        favorite_ids = []
+        favorite_ids = set()
         if current_user.is_authenticated:
-            favorites = Favorite.query.filter_by(user_id=current_user.id).all()
-            favorite_ids = [f.dish_id for f in favorites]
+            favorite_ids = get_favorite_ids(current_user.id, [d.id for d in dishes])
+        
+        recommendations = recommendations_for(session.get('cart', {}).keys())
         
         return render_template('menu.html', 
                             category=category, 
                             dishes=dishes,
-                            favorite_ids=favorite_ids)
+                            favorite_ids=favorite_ids,
+                            recommendations=recommendations)
     except Exception as e:
         logger.error(f"Ошибка загрузки меню категории {category_id}: {str(e)}")
         flash('Ошибка загрузки меню', 'danger')
@@ -67,14 +112,18 @@ def cart():
         return render_template('cart.html', 
                             cart_items=cart_items,
                             total_price=total_price,
-                            total_items=total_items)
+                            total_items=total_items,
+                            cart_version=session.get('cart_version', 0),
+                            recommendations=recommendations_for(cart.keys()))
     except Exception as e:
         logger.error(f"Ошибка загрузки корзины: {str(e)}")
         flash('Ошибка загрузки корзины', 'danger')
         return render_template('cart.html', 
                             cart_items=[],
                             total_price=0,
-                            total_items=0)
+                            total_items=0,
+                            cart_version=session.get('cart_version', 0),
+                            recommendations=[])
 
 @main.route('/add_to_cart/<int:dish_id>', methods=['POST'])
 def add_to_cart(dish_id):
@@ -95,8 +144,7 @@ def add_to_cart(dish_id):
                 'quantity': 1
             }
         
-        session['cart'] = cart
-        session.modified = True
+        _save_cart(cart)
         
         total_items = sum(item['quantity'] for item in cart.values())
         
@@ -129,8 +177,7 @@ def update_cart(dish_id):
             else:
                 cart[str(dish_id)]['quantity'] = quantity
         
-        session['cart'] = cart
-        session.modified = True
+        _save_cart(cart)
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Ошибка обновления корзины {dish_id}: {str(e)}")
@@ -143,8 +190,7 @@ def remove_from_cart(dish_id):
         
         if str(dish_id) in cart:
             del cart[str(dish_id)]
-            session['cart'] = cart
-            session.modified = True
+            _save_cart(cart)
             return jsonify({'success': True})
         
         return jsonify({'success': False, 'message': 'Товар не найден'}), 404
@@ -152,28 +198,99 @@ def remove_from_cart(dish_id):
         logger.error(f"Ошибка удаления из корзины {dish_id}: {str(e)}")
         return jsonify({'success': False, 'message': 'Ошибка сервера'}), 500
 
+@main.route('/cart/batch', methods=['POST'])
+def cart_batch():
+    """Применяет пачку операций add/set/remove к корзине за один запрос.
+
+    Тело запроса: {"version": <int>, "ops": [{"op": "set", "dish_id": 1, "quantity": 2}, ...]}.
+    Операции применяются все или ни одной; при устаревшей версии возвращается 409
+    с актуальным состоянием корзины.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('ops'), list):
+            return jsonify({'success': False, 'message': 'Нет данных'}), 400
+
+        ops = data['ops']
+        if len(ops) > CART_BATCH_MAX_OPS:
+            return jsonify({'success': False, 'message': 'Слишком много операций'}), 400
+
+        cart = session.get('cart', {})
+        version = data.get('version')
+        if version is not None and not _is_json_int(version):
+            return jsonify({'success': False, 'message': 'Некорректная версия корзины'}), 400
+        if version is not None and version != session.get('cart_version', 0):
+            summary = _cart_summary(cart)
+            summary.update({'success': False, 'message': 'Корзина была изменена'})
+            return jsonify(summary), 409
+
+        # Проверяем все операции до изменения корзины
+        dish_ids = set()
+        for op in ops:
+            if not isinstance(op, dict) or op.get('op') not in ('add', 'set', 'remove'):
+                return jsonify({'success': False, 'message': 'Некорректная операция'}), 400
+            if not _is_json_int(op.get('dish_id')):
+                return jsonify({'success': False, 'message': 'Некорректный ID блюда'}), 400
+            quantity = op.get('quantity', 1)
+            if op['op'] != 'remove' and (not _is_json_int(quantity) or quantity < 0):
+                return jsonify({'success': False, 'message': 'Некорректное количество'}), 400
+            if op['op'] != 'remove':
+                dish_ids.add(op['dish_id'])
+
+        dishes = {}
+        if dish_ids:
+            dishes = {d.id: d for d in Dish.query.filter(Dish.id.in_(dish_ids)).all()}
+
+        new_cart = {dish_id: dict(item) for dish_id, item in cart.items()}
+        for op in ops:
+            dish_id_str = str(op['dish_id'])
+
+            if op['op'] == 'remove':
+                new_cart.pop(dish_id_str, None)
+                continue
+
+            quantity = op.get('quantity', 1)
+            if op['op'] == 'add':
+                quantity += new_cart.get(dish_id_str, {}).get('quantity', 0)
+
+            if quantity <= 0:
+                new_cart.pop(dish_id_str, None)
+                continue
+
+            dish = dishes.get(op['dish_id'])
+            if not dish or not dish.is_available:
+                return jsonify({'success': False, 'message': 'Товар недоступен',
+                                'dish_id': op['dish_id']}), 400
+
+            new_cart[dish_id_str] = {
+                'name': dish.name,
+                'price': float(dish.price),
+                'quantity': min(quantity, CART_MAX_QUANTITY)
+            }
+
+        _save_cart(new_cart)
+
+        summary = _cart_summary(new_cart)
+        summary['success'] = True
+        return jsonify(summary)
+    except Exception as e:
+        logger.error(f"Ошибка пакетного обновления корзины: {str(e)}")
+        return jsonify({'success': False, 'message': 'Ошибка сервера'}), 500
+
 @main.route('/add_to_favorites/<int:dish_id>', methods=['POST'])
 @login_required
 def add_to_favorites(dish_id):
     try:
-        dish = Dish.query.get_or_404(dish_id)
-        
-        favorite = Favorite.query.filter_by(
-            user_id=current_user.id, 
-            dish_id=dish_id
-        ).first()
+        Dish.query.get_or_404(dish_id)
         
-        if favorite:
-            db.session.delete(favorite)
-            action = 'removed'
-            message = 'Удалено из избранного'
-        else:
-            favorite = Favorite(user_id=current_user.id, dish_id=dish_id)
-            db.session.add(favorite)
-            action = 'added'
+        action = toggle_favorite(current_user.id, dish_id)
+        if action == 'added':
             message = 'Добавлено в избранное'
+        else:
+            message = 'Удалено из избранного'
         
         db.session.commit()
+        invalidate_favorites(current_user.id)
         
         return jsonify({
             'success': True,
@@ -250,10 +367,12 @@ def checkout():
                 )
                 db.session.add(order_item)
             
+            User.adjust_counters(current_user.id, orders=1)
+            record_order(order, [(item['dish'].id, item['quantity']) for item in order_items])
             db.session.commit()
             
             # Очищаем корзину
-            session.pop('cart', None)
+            _save_cart({})
             
             flash(f'Заказ #{order.id} успешно оформлен!', 'success')
             return redirect(url_for('user_bp.orders'))
@@ -0,0 +1,325 @@
+"""Генератор данных в промышленных объемах: flask seed-scale.
+
+Одинаковые seed и until на пустой базе дают одинаковые данные (кроме соли
+хеша пароля). Строки пишутся пакетами: executemany через insert() по таблице,
+а на PostgreSQL - через COPY. Идентификаторы назначаются здесь же, поэтому
+позиции ссылаются на заказы без возврата ID из базы; последовательности
+PostgreSQL после загрузки сдвигаются на максимальный ID.
+"""
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+from . import db
+from .models import Category, Dish, User, Order, OrderItem, Favorite, ImageQueue
+from .passwords import hash_password
+import csv
+import io
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_NAMES = ['Пицца', 'Бургеры', 'Суши', 'Роллы', 'Супы', 'Салаты', 'Паста', 'Горячее',
+                  'Завтраки', 'Десерты', 'Напитки', 'Закуски', 'Гриль', 'Вок', 'Выпечка']
+DISH_WORDS = ['Классический', 'Острый', 'Домашний', 'Фирменный', 'Летний', 'Сливочный',
+              'Копченый', 'Овощной', 'Мясной', 'Рыбный', 'Сырный', 'Грибной']
+STREETS = ['Ленина', 'Мира', 'Советская', 'Гагарина', 'Садовая', 'Пушкина', 'Лесная',
+           'Школьная', 'Набережная', 'Центральная']
+
+# Заказы по часам суток: обеденный и вечерний пики
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 1, 2, 4, 6, 6, 7, 10, 14, 13, 9, 7, 7, 10, 15, 16, 14, 10, 6, 3]
+# Число позиций в заказе (1-5) и количество одного блюда (1-3)
+ITEMS_WEIGHTS = [30, 35, 20, 10, 5]
+QUANTITY_WEIGHTS = [75, 20, 5]
+# Статусы очереди изображений в бэклоге
+QUEUE_STATUSES = [('pending', 70), ('failed', 18), ('completed', 10), ('downloading', 2)]
+
+# Небольшой набор для локальных прогонов на пустой базе (flask bench, flask sqlite-bench)
+SMALL_DATASET = {'dishes': 30, 'categories': 3, 'users': 20, 'orders': 200, 'favorites': 40,
+                 'image_queue': 20, 'days': 30}
+
+class _Writer:
+    """Пакетная запись строк одной таблицы: COPY на PostgreSQL, иначе executemany"""
+
+    def __init__(self, model, batch_size, progress=None, depends_on=None):
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.progress = progress
+        # Таблица, на строки которой ссылаются наши: ее пакет записывается первым
+        self.depends_on = depends_on
+        self.rows = []
+        self.written = 0
+        self.copy = db.session.get_bind().dialect.name == 'postgresql'
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.depends_on is not None:
+            self.depends_on.flush()
+        if not self.rows:
+            return
+        if self.copy:
+            self._copy()
+        else:
+            db.session.execute(self.table.insert(), self.rows)
+        db.session.commit()
+        self.written += len(self.rows)
+        self.rows = []
+        if self.progress:
+            self.progress(self.table.name, self.written)
+
+    def _copy(self):
+        columns = list(self.rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self.rows:
+            # Пустое значение без кавычек COPY читает как NULL
+            writer.writerow(['' if value is None else
+                             ('t' if value else 'f') if isinstance(value, bool) else value
+                             for value in (row[column] for column in columns)])
+        buffer.seek(0)
+
+        preparer = db.session.get_bind().dialect.identifier_preparer
+        sql = (f"COPY {preparer.format_table(self.table)} "
+               f"({', '.join(preparer.quote(column) for column in columns)}) FROM STDIN WITH (FORMAT csv)")
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, buffer)
+        finally:
+            cursor.close()
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def _reset_sequences(models):
+    """После вставки с явными ID последовательности PostgreSQL нужно сдвинуть"""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    for model in models:
+        table = preparer.format_table(model.__table__)
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"
+        ))
+    db.session.commit()
+
+def _order_times(rng, count, start, days, growth):
+    """Отсортированные моменты заказов: рост к концу периода, пятница и суббота чаще"""
+    day_weights = []
+    for day in range(days):
+        weight = 1 + growth * day / max(days - 1, 1)
+        if (start + timedelta(days=day)).weekday() in (4, 5):
+            weight *= 1.25
+        day_weights.append(weight)
+
+    day_offsets = rng.choices(range(days), cum_weights=list(accumulate(day_weights)), k=count)
+    hours = rng.choices(range(24), cum_weights=list(accumulate(HOUR_WEIGHTS)), k=count)
+    times = [day * 86400 + hour * 3600 + rng.randrange(3600) for day, hour in zip(day_offsets, hours)]
+    times.sort()
+    return times
+
+def _order_status(rng, age):
+    if age < timedelta(hours=1):
+        return rng.choice(['Новый', 'В обработке', 'Готовится', 'В пути'])
+    if age < timedelta(hours=3):
+        return rng.choices(['В пути', 'Доставлен', 'Отменен'], [20, 75, 5])[0]
+    return 'Отменен' if rng.random() < 0.07 else 'Доставлен'
+
+def existing_rows():
+    """Таблицы, в которые пишет seed_scale и в которых уже есть данные: {таблица: строк}.
+
+    Администратор, созданный prepare-db, не считается.
+    """
+    counts = {}
+    for model in (Category, Dish, User, Order, OrderItem, Favorite, ImageQueue):
+        query = db.session.query(db.func.count()).select_from(model)
+        if model is User:
+            query = query.filter(User.is_admin.is_(False))
+        count = query.scalar()
+        if count:
+            counts[model.__tablename__] = count
+    return counts
+
+def seed_scale(dishes=3000, categories=15, users=100_000, orders=1_000_000, favorites=300_000,
+               image_queue=50_000, days=365, growth=1.0, seed=42, until=None, password='scale-pass',
+               batch_size=10_000, progress=None):
+    """Генерирует каталог, пользователей, заказы, избранное и бэклог очереди изображений.
+
+    Возвращает словарь с числом вставленных строк по таблицам.
+    """
+    rng = random.Random(seed)
+    until = until or date.today()
+    end = datetime.combine(until, time(23, 59, 59))
+    start = datetime.combine(until - timedelta(days=days - 1), time())
+    counts = {}
+
+    # Каталог
+    writer = _Writer(Category, batch_size, progress)
+    first_category = _next_id(Category)
+    category_ids = list(range(first_category, first_category + categories))
+    for number, category_id in enumerate(category_ids):
+        name = CATEGORY_NAMES[number % len(CATEGORY_NAMES)]
+        if number >= len(CATEGORY_NAMES):
+            name = f'{name} {number // len(CATEGORY_NAMES) + 1}'
+        writer.add({'id': category_id, 'name': name, 'image': 'default.jpg'})
+    writer.flush()
+    counts['category'] = writer.written
+
+    writer = _Writer(Dish, batch_size, progress)
+    first_dish = _next_id(Dish)
+    dish_ids = list(range(first_dish, first_dish + dishes))
+    dish_prices = {}
+    available_ids = []
+    for dish_id in dish_ids:
+        price = float(min(max(round(rng.lognormvariate(5.8, 0.5), -1), 60), 3000))
+        is_available = rng.random() < 0.95
+        dish_prices[dish_id] = price
+        if is_available:
+            available_ids.append(dish_id)
+        writer.add({
+            'id': dish_id,
+            'name': f'{rng.choice(DISH_WORDS)} {rng.choice(CATEGORY_NAMES).lower()} №{dish_id}',
+            'description': 'Сгенерировано flask seed-scale',
+            'price': price,
+            'image': 'default.jpg',
+            'category_id': rng.choice(category_ids),
+            'is_available': is_available,
+            'orders_count': 0,
+            'quantity_sold': 0,
+        })
+    writer.flush()
+    counts['dish'] = writer.written
+    if not available_ids and orders:
+        # Заказывать нечего: rng.choices по пустому списку упал бы
+        logger.warning("seed-scale: нет доступных блюд, заказы не создаются")
+        orders = 0
+    if not dish_ids and image_queue:
+        logger.warning("seed-scale: нет блюд, очередь изображений не создается")
+        image_queue = 0
+
+    # Спрос на блюда и активность пользователей - с длинным хвостом
+    dish_cum = list(accumulate(rng.paretovariate(1.2) for _ in available_ids))
+    user_cum = list(accumulate(rng.paretovariate(1.5) for _ in range(users)))
+
+    order_times = _order_times(rng, orders, start, days, growth)
+    order_users = rng.choices(range(users), cum_weights=user_cum, k=orders)
+
+    first_order_at = {}
+    orders_per_user = [0] * users
+    for offset, user in zip(order_times, order_users):
+        orders_per_user[user] += 1
+        if user not in first_order_at:
+            first_order_at[user] = offset
+
+    favorite_pairs = set()
+    favorites_per_user = [0] * users
+    if available_ids:
+        for user in rng.choices(range(users), cum_weights=user_cum, k=favorites):
+            pair = (user, rng.choices(available_ids, cum_weights=dish_cum)[0])
+            if pair not in favorite_pairs:
+                favorite_pairs.add(pair)
+                favorites_per_user[user] += 1
+
+    # Пользователи: регистрация до первого заказа; пароль у всех один (хеш считается один раз)
+    writer = _Writer(User, batch_size, progress)
+    first_user = _next_id(User)
+    password_hash = hash_password(password)
+    user_created = []
+    for user in range(users):
+        if user in first_order_at:
+            created = start + timedelta(seconds=first_order_at[user]) - timedelta(seconds=rng.randrange(30 * 86400))
+        else:
+            created = start + timedelta(seconds=rng.randrange(days * 86400))
+        user_created.append(created)
+        writer.add({
+            'id': first_user + user,
+            'username': f'scale_user_{first_user + user}',
+            'password_hash': password_hash,
+            'avatar': 'default_avatar.jpg',
+            'is_active': True,
+            'is_admin': False,
+            'created_at': created,
+            'auth_version': 0,
+            'orders_count': orders_per_user[user],
+            'favorites_count': favorites_per_user[user],
+        })
+    writer.flush()
+    counts['user'] = writer.written
+
+    # Заказы и позиции: ID растут вместе со временем, как в рабочей базе
+    order_writer = _Writer(Order, batch_size, progress)
+    item_writer = _Writer(OrderItem, batch_size, progress, depends_on=order_writer)
+    order_id = _next_id(Order)
+    item_id = _next_id(OrderItem)
+    for offset, user in zip(order_times, order_users):
+        created = start + timedelta(seconds=offset)
+        chosen = rng.choices(available_ids, cum_weights=dish_cum, k=rng.choices(range(1, 6), ITEMS_WEIGHTS)[0])
+        items = [(dish_id, rng.choices((1, 2, 3), QUANTITY_WEIGHTS)[0]) for dish_id in dict.fromkeys(chosen)]
+        order_writer.add({
+            'id': order_id,
+            'customer_name': f'scale_user_{first_user + user}',
+            'address': f'ул. {rng.choice(STREETS)}, дом {rng.randint(1, 120)}, кв. {rng.randint(1, 300)}',
+            'phone': f'+79{rng.randrange(10 ** 9):09d}',
+            'total': round(sum(dish_prices[dish_id] * quantity for dish_id, quantity in items), 2),
+            'status': _order_status(rng, end - created),
+            'created_at': created,
+            'user_id': first_user + user,
+        })
+        for dish_id, quantity in items:
+            item_writer.add({'id': item_id, 'order_id': order_id, 'dish_id': dish_id,
+                             'quantity': quantity, 'price': dish_prices[dish_id]})
+            item_id += 1
+        order_id += 1
+    item_writer.flush()
+    counts['order'] = order_writer.written
+    counts['order_item'] = item_writer.written
+
+    writer = _Writer(Favorite, batch_size, progress)
+    favorite_id = _next_id(Favorite)
+    for user, dish_id in sorted(favorite_pairs):
+        added = user_created[user] + (end - user_created[user]) * rng.random()
+        writer.add({'id': favorite_id, 'user_id': first_user + user, 'dish_id': dish_id, 'added_at': added})
+        favorite_id += 1
+    writer.flush()
+    counts['favorite'] = writer.written
+
+    # Бэклог очереди изображений за последние две недели
+    writer = _Writer(ImageQueue, batch_size, progress)
+    queue_id = _next_id(ImageQueue)
+    statuses, weights = zip(*QUEUE_STATUSES)
+    for number in range(image_queue):
+        dish_id = rng.choice(dish_ids)
+        status = rng.choices(statuses, weights)[0]
+        created = end - timedelta(seconds=rng.randrange(14 * 86400))
+        writer.add({
+            'id': queue_id,
+            'dish_id': dish_id,
+            'image_url': f'https://cdn.example.com/dishes/{dish_id}/{number}.jpg',
+            'priority': rng.randint(1, 5),
+            'status': status,
+            'retry_count': rng.randint(1, 3) if status == 'failed' else 0,
+            'created_at': created,
+            'updated_at': created + timedelta(seconds=rng.randrange(3600)) if status != 'pending' else created,
+        })
+        queue_id += 1
+    writer.flush()
+    counts['image_queue'] = writer.written
+
+    _reset_sequences([Category, Dish, User, Order, OrderItem, Favorite, ImageQueue])
+    logger.info("seed-scale: вставлено %s", counts)
+    return counts
+
+def rebuild_derived(recommendations=True):
+    """Пересобирает сводки, счетчики блюд, рекомендации и статистику планировщика"""
+    from .rollups import rebuild_daily_stats, rebuild_dish_stats
+    from .recommendations import build_recommendations
+
+    rebuild_daily_stats()
+    rebuild_dish_stats()
+    if recommendations:
+        build_recommendations(full=True)
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
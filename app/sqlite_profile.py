@@ -0,0 +1,301 @@
+"""Профиль SQLite для работы под несколькими воркерами.
+
+На каждом новом соединении включаются WAL, synchronous=NORMAL, увеличенный
+кэш страниц, mmap и ожидание блокировки (busy_timeout) вместо немедленного
+"database is locked". В режиме WAL чтение не блокируется записью, в том числе
+долгой транзакцией парсера.
+
+SQLITE_WRITE_QUEUE дополнительно выстраивает пишущие транзакции в очередь:
+они начинаются с BEGIN IMMEDIATE, а внутри процесса ждут на общей блокировке
+по порядку. Пишущей считается первая транзакция небезопасного HTTP-запроса
+(POST и т.п.), команды CLI или фоновой задачи. Так транзакция, которая сначала
+читает, а потом пишет (оформление заказа), не получает SQLITE_BUSY при
+повышении блокировки: между воркерами запись упорядочивает сам SQLite через
+busy_timeout.
+
+Остальные транзакции начинаются обычным BEGIN и идут параллельно; блокировку
+очереди они берут только на первом INSERT/UPDATE/DELETE. Так работают GET-
+запросы, транзакции после уже завершенной пишущей (отрисовка страницы после
+commit) и представления с @deferred_write - вход и регистрация, где до записи
+идет долгий bcrypt и запись редкая.
+"""
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from config import Config
+from . import db
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_write_lock = threading.Lock()
+
+def _pragmas(config):
+    pragmas = [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        # Отрицательное значение - размер в килобайтах, а не в страницах
+        ('cache_size', -int(config.get('SQLITE_CACHE_SIZE_KB', 65536))),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 268435456))),
+        ('temp_store', 'MEMORY'),
+    ]
+    return [(name, value) for name, value in pragmas if value not in (None, '')]
+
+def deferred_write(view):
+    """Транзакции представления начинаются обычным BEGIN, очередь записи - с первой записи"""
+    view.sqlite_deferred_write = True
+    return view
+
+def is_write_context():
+    """Транзакция будет писать: первая в небезопасном HTTP-запросе или работа вне запроса"""
+    if has_request_context():
+        if request.method in READ_METHODS or g.get('sqlite_write_done'):
+            return False
+        view = current_app.view_functions.get(request.endpoint)
+        return not getattr(view, 'sqlite_deferred_write', False)
+    return True
+
+def _watch_engine(engine, config):
+    pragmas = _pragmas(config)
+    busy_timeout = int(config.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+    write_queue = config.get('SQLITE_WRITE_QUEUE', False)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+        if write_queue:
+            # BEGIN выдается в on_begin, а не неявно драйвером pysqlite
+            dbapi_connection.isolation_level = None
+
+    if not write_queue:
+        return
+
+    def _acquire(conn):
+        conn.info['sqlite_writer'] = True
+        started = time.perf_counter()
+        if not _write_lock.acquire(timeout=busy_timeout / 1000):
+            # Дальше ждет сам SQLite; очередь процесса не должна вешать запрос навсегда
+            logger.warning("Очередь записи SQLite: блокировка не получена за %d мс", busy_timeout)
+        else:
+            conn.info['sqlite_write_lock'] = True
+        waited = (time.perf_counter() - started) * 1000
+        if waited > 100:
+            logger.info("Очередь записи SQLite: ожидание %.0f мс", waited)
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        if not is_write_context():
+            conn.exec_driver_sql('BEGIN')
+            return
+
+        _acquire(conn)
+        try:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        except Exception:
+            _release(conn)
+            raise
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        # Транзакция с обычным BEGIN встает в очередь процесса на первой записи
+        if 'sqlite_writer' not in conn.info and statement.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            _acquire(conn)
+
+    def _release(conn, *args):
+        if conn.info.pop('sqlite_writer', False) and has_request_context():
+            # Следующие транзакции запроса (отрисовка после commit) - снова обычный BEGIN
+            g.sqlite_write_done = True
+        if conn.info.pop('sqlite_write_lock', False):
+            _write_lock.release()
+
+    event.listen(engine, 'commit', _release)
+    event.listen(engine, 'rollback', _release)
+
+def init_sqlite(app):
+    """Настраивает соединения SQLite-движков приложения (для других СУБД ничего не делает)"""
+    if not app.config.get('SQLITE_TUNING', True):
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+                _watch_engine(engine, app.config)
+
+# ----------------------------------------------------------------------------
+# Сравнение с настройками по умолчанию: flask sqlite-bench
+# ----------------------------------------------------------------------------
+
+BENCH_PROFILES = {
+    'default': {'SQLITE_TUNING': False, 'SQLITE_WRITE_QUEUE': False},
+    'wal': {'SQLITE_TUNING': True, 'SQLITE_WRITE_QUEUE': False},
+    'wal+queue': {'SQLITE_TUNING': True, 'SQLITE_WRITE_QUEUE': True},
+}
+
+def _bench_config(database_path, overrides):
+    return type('SqliteBenchConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}',
+        'AUTO_INIT_DB': False,
+        'LOG_TO_STDOUT': True,
+        'LOG_LEVEL': 'ERROR',
+        'METRICS_ENABLED': False,
+        'PERF_ENABLED': False,
+        **overrides
+    })
+
+def _checkout(rng):
+    """Как оформление заказа: сначала чтение, потом запись в нескольких таблицах"""
+    from .models import Dish, Order, OrderItem, User
+    from .rollups import record_order
+
+    dish = db.session.get(Dish, rng.randint(1, 27))
+    order = Order(customer_name='bench', address='ул. Ленина, дом 1, кв. 1', total=dish.price, user_id=1)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, dish_id=dish.id, quantity=1, price=dish.price))
+    User.adjust_counters(1, orders=1)
+    record_order(order, [(dish.id, 1)])
+    db.session.commit()
+
+def _browse(rng):
+    """Как просмотр меню и истории заказов"""
+    from .models import Dish, Order
+
+    Dish.query.filter_by(category_id=rng.randint(1, 3), is_available=True).all()
+    Order.query.filter_by(user_id=1).order_by(Order.created_at.desc()).limit(20).all()
+    db.session.query(db.func.count(Order.id)).scalar()
+
+def _long_write():
+    """Как сохранение результатов парсера: долгая пишущая транзакция"""
+    from .models import ImageQueue
+
+    ImageQueue.query.update({ImageQueue.retry_count: ImageQueue.retry_count + 1},
+                            synchronize_session=False)
+    time.sleep(0.5)
+    db.session.commit()
+
+def _bench_process(config_class, number, threads, seconds, write_share, parser, results):
+    from . import create_app
+
+    app = create_app(config_class)
+    samples = {'read': [], 'write': [], 'parser': []}
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run(kind, job, rng):
+        method = 'GET' if kind == 'read' else 'POST'
+        started = time.perf_counter()
+        try:
+            if kind == 'parser':
+                with app.app_context():
+                    job()
+            else:
+                with app.test_request_context(method=method):
+                    job(rng)
+            ok = True
+        except OperationalError as e:
+            ok = False
+            reason = 'locked' if 'locked' in str(e) or 'busy' in str(e) else 'other'
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            if ok:
+                samples[kind].append(elapsed)
+            else:
+                errors[f'{kind}:{reason}'] += 1
+
+    def client(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            if rng.random() < write_share:
+                run('write', _checkout, rng)
+            else:
+                run('read', _browse, rng)
+
+    def parser_loop():
+        while time.monotonic() < deadline:
+            run('parser', _long_write, None)
+            time.sleep(0.5)
+
+    workers = [threading.Thread(target=client, args=(number * 100 + thread,)) for thread in range(threads)]
+    if parser:
+        workers.append(threading.Thread(target=parser_loop))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with app.app_context():
+        from .bootstrap import dispose_engines
+        dispose_engines()
+    results.put((samples, dict(errors)))
+
+def compare_profiles(profiles=None, processes=4, threads=4, seconds=10, write_share=0.3, parser=True):
+    """Нагружает одну и ту же схему в разных профилях. Возвращает {профиль: сводка}.
+
+    Каждый процесс - как воркер gunicorn со своими потоками; в первом процессе
+    дополнительно идет долгая пишущая транзакция, как у парсера.
+    """
+    from . import create_app
+    from .bootstrap import create_schema, dispose_engines
+    from .perf import percentile
+    from .seed_scale import SMALL_DATASET, rebuild_derived, seed_scale
+
+    context = multiprocessing.get_context('fork')
+    report = {}
+    for name in profiles or BENCH_PROFILES:
+        workdir = tempfile.mkdtemp(prefix='sqlite-bench-')
+        try:
+            config_class = _bench_config(os.path.join(workdir, 'bench.db'), BENCH_PROFILES[name])
+            app = create_app(config_class)
+            with app.app_context():
+                create_schema()
+                seed_scale(**SMALL_DATASET)
+                rebuild_derived()
+                dispose_engines()
+
+            results = context.Queue()
+            children = [
+                context.Process(target=_bench_process,
+                                args=(config_class, number, threads, seconds, write_share,
+                                      parser and number == 0, results))
+                for number in range(processes)
+            ]
+            for child in children:
+                child.start()
+            collected = [results.get() for _ in children]
+            for child in children:
+                child.join()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        summary = {'errors': Counter()}
+        for kind in ('read', 'write', 'parser'):
+            values = sorted(value for samples, _ in collected for value in samples[kind])
+            summary[kind] = {
+                'count': len(values),
+                'per_second': round(len(values) / seconds, 1),
+                'p50': round(percentile(values, 50), 1),
+                'p95': round(percentile(values, 95), 1),
+                'p99': round(percentile(values, 99), 1),
+            }
+        for _, errors in collected:
+            summary['errors'].update(errors)
+        summary['errors'] = dict(summary['errors'])
+        report[name] = summary
+    return report
@@ -0,0 +1,23 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Метки изменений - пустые файлы, mtime которых видят все процессы (воркеры gunicorn, CLI)
+
+def read_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+def touch_stamp(path):
+    """Отмечает изменение: время метки строго растет даже при грубом разрешении mtime"""
+    try:
+        now = max(time.time_ns(), read_stamp(path) + 1)
+        with open(path, 'a'):
+            pass
+        os.utime(path, ns=(now, now))
+    except OSError as e:
+        logger.warning(f"Не удалось обновить метку {path}: {e}")
@@ -3,7 +3,11 @@ from flask_login import login_required, current_user
 from . import db
 from .models import Order, Favorite, Dish, User, OrderItem
 from .forms import UpdateProfileForm
-from sqlalchemy.orm import joinedload
+from .favorites import invalidate_favorites
+from .identity import invalidate_user
+from .pagination import keyset_paginate
+from sqlalchemy.orm import contains_eager, joinedload
+from werkzeug.exceptions import HTTPException
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,19 +32,20 @@ def profile():
             else:
                 current_user.username = form.username.data
                 db.session.commit()
+                invalidate_user(current_user.id)
                 flash('Ваш профиль успешно обновлен!', 'success')
                 return redirect(url_for('user_bp.profile'))
         
         elif request.method == 'GET':
             form.username.data = current_user.username
         
-        orders_count = Order.query.filter_by(user_id=current_user.id).count()
-        favorites_count = Favorite.query.filter_by(user_id=current_user.id).count()
+        # Пользователь может быть взят из кэша - счетчики читаем из БД
+        db.session.refresh(current_user, ['orders_count', 'favorites_count'])
         
         return render_template('user/profile.html', 
                              form=form,
-                             orders_count=orders_count,
-                             favorites_count=favorites_count)
+                             orders_count=current_user.orders_count,
+                             favorites_count=current_user.favorites_count)
     except Exception as e:
         logger.error(f"Ошибка в профиле пользователя {current_user.id}: {str(e)}")
         flash('Ошибка загрузки профиля', 'danger')
@@ -50,11 +55,18 @@ def profile():
 @login_required
 def orders():
     try:
-        page = request.args.get('page', 1, type=int)
-        orders = Order.query.filter_by(user_id=current_user.id)\
-            .order_by(Order.created_at.desc())\
-            .paginate(page=page, per_page=10)
+        # Keyset-пагинация: стоимость страницы не растет с ее номером
+        orders = keyset_paginate(
+            Order.query.filter_by(user_id=current_user.id),
+            [Order.created_at, Order.id],
+            per_page=10,
+            after=request.args.get('after'),
+            before=request.args.get('before')
+        )
         return render_template('user/orders.html', orders=orders)
+    except HTTPException:
+        # Испорченный курсор пагинации - 400, а не ошибка загрузки
+        raise
     except Exception as e:
         logger.error(f"Ошибка загрузки заказов пользователя {current_user.id}: {str(e)}")
         flash('Ошибка загрузки заказов', 'danger')
@@ -85,6 +97,7 @@ def favorites():
         favorites = Favorite.query.filter_by(user_id=current_user.id)\
             .join(Dish)\
             .filter(Dish.is_available == True)\
+            .options(contains_eager(Favorite.dish))\
             .order_by(Favorite.added_at.desc())\
             .all()
         
@@ -104,7 +117,9 @@ def remove_favorite(favorite_id):
             return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
         
         db.session.delete(favorite)
+        User.adjust_counters(current_user.id, favorites=-1)
         db.session.commit()
+        invalidate_favorites(current_user.id)
         
         flash('Удалено из избранного', 'success')
         return redirect(url_for('user_bp.favorites'))
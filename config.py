@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,8 +14,128 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL or 'sqlite:///food_delivery.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    # Настройки логирования
+    # Создавать таблицы и администратора при запуске приложения. Локально
+    # (без DATABASE_URL) включено, в продакшене это шаг релиза: flask prepare-db
+    AUTO_INIT_DB = os.environ.get('AUTO_INIT_DB', 'false' if DATABASE_URL else 'true').lower() == 'true'
+    
+    # Профиль движка БД: web, worker (CLI и фоновые задачи) или small (мало соединений).
+    # Если не задан - worker для команд flask, web для остальных.
+    # DB_POOL_* и DB_STATEMENT_TIMEOUT_MS переопределяют значения профиля (см. app/engines.py)
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE')
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_POOL_TIMEOUT = int(os.environ['DB_POOL_TIMEOUT']) if os.environ.get('DB_POOL_TIMEOUT') else None
+    DB_POOL_RECYCLE = int(os.environ['DB_POOL_RECYCLE']) if os.environ.get('DB_POOL_RECYCLE') else None
+    DB_POOL_PRE_PING = os.environ['DB_POOL_PRE_PING'].lower() == 'true' if os.environ.get('DB_POOL_PRE_PING') else None
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ['DB_STATEMENT_TIMEOUT_MS']) if os.environ.get('DB_STATEMENT_TIMEOUT_MS') else None
+    
+    # Реплика для чтения: главная, меню, статистика и экспорт админки. После записи клиент
+    # DB_REPLICA_STICKY_SECONDS секунд читает с основной базы. DB_REPLICA_ENDPOINTS -
+    # дополнительные эндпоинты через запятую. Проверка на двух локальных базах:
+    # tests/test_replica_routing.py
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL', '')
+    if DATABASE_REPLICA_URL.startswith('postgres://'):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace('postgres://', 'postgresql://', 1)
+    DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+    DB_REPLICA_ENDPOINTS = [item.strip() for item in os.environ.get('DB_REPLICA_ENDPOINTS', '').split(',') if item.strip()]
+    
+    # SQLite: WAL, synchronous, кэш страниц (КБ) и mmap на каждом соединении и ожидание
+    # блокировки вместо "database is locked". SQLITE_WRITE_QUEUE - пишущие транзакции
+    # (POST-запросы, CLI, фоновые задачи) по очереди через BEGIN IMMEDIATE, чтение параллельно,
+    # вход и регистрация - в очередь только на первой записи.
+    # Сравнение с настройками по умолчанию: flask sqlite-bench
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', 'true').lower() == 'true'
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+    SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE', 'false').lower() == 'true'
+    
+    # Настройки логирования: LOG_FORMAT json или text, LOG_TO_STDOUT - без файла logs/app.log,
+    # LOG_LEVELS - уровни отдельных логгеров вида "app.parsers=DEBUG,sqlalchemy.engine=INFO"
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = {
+        'urllib3': 'WARNING',
+        'PIL': 'WARNING',
+        **dict(item.strip().split('=', 1) for item in os.environ.get('LOG_LEVELS', '').split(',') if '=' in item)
+    }
+    LOG_FILE_MAX_BYTES = int(os.environ.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_FILE_BACKUP_COUNT = int(os.environ.get('LOG_FILE_BACKUP_COUNT', 5))
+    
+    # Кэш избранного в памяти процесса (секунды, 0 - выключен)
+    FAVORITES_CACHE_TTL = int(os.environ.get('FAVORITES_CACHE_TTL', 0))
+    
+    # Кэш пользователей Flask-Login (секунды, 0 - выключен) и общая метка сброса для воркеров
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+    IDENTITY_CACHE_SIZE = 1024
+    IDENTITY_CACHE_STAMP = os.environ.get('IDENTITY_CACHE_STAMP') or \
+        os.path.join(tempfile.gettempdir(), 'food_delivery_identity.stamp')
+    
+    # Кэш списков популярных блюд (секунды)
+    POPULAR_DISHES_CACHE_TTL = int(os.environ.get('POPULAR_DISHES_CACHE_TTL', 300))
+    
+    # Статистика очереди изображений: кэш (секунды), метка изменений для всех
+    # процессов и время жизни одного SSE-потока на странице парсинга. Поток занимает
+    # поток gthread, поэтому их не больше QUEUE_EVENTS_MAX_STREAMS на процесс
+    # (остальные вкладки получают снимок статистики и переподключаются позже)
+    QUEUE_STATS_CACHE_TTL = int(os.environ.get('QUEUE_STATS_CACHE_TTL', 5))
+    QUEUE_STATS_STAMP = os.environ.get('QUEUE_STATS_STAMP') or \
+        os.path.join(tempfile.gettempdir(), 'food_delivery_queue.stamp')
+    QUEUE_EVENTS_MAX_AGE = int(os.environ.get('QUEUE_EVENTS_MAX_AGE', 25))
+    QUEUE_EVENTS_MAX_STREAMS = int(os.environ.get('QUEUE_EVENTS_MAX_STREAMS', 2))
+    
+    # Срок хранения завершенных задач очереди изображений и пакетное удаление
+    # (размер пачки и ограничение по времени для одного запуска из веба)
+    IMAGE_QUEUE_RETENTION_HOURS = int(os.environ.get('IMAGE_QUEUE_RETENTION_HOURS', 24))
+    IMAGE_QUEUE_MAX_RETRIES = 3
+    IMAGE_QUEUE_DELETE_BATCH = 500
+    IMAGE_QUEUE_DELETE_SECONDS = 5
+    
+    # Предупреждение в логе (в режиме DEBUG или TESTING - ошибка), если страница списка
+    # админки делает больше запросов
+    ADMIN_LIST_QUERY_BUDGET = int(os.environ.get('ADMIN_LIST_QUERY_BUDGET', 10))
+    
+    # Метрики запросов (страница /admin/perf): последние PERF_SAMPLE_SIZE запросов на
+    # эндпоинт и SQL дольше PERF_SLOW_QUERY_MS миллисекунд в журнале медленных запросов
+    PERF_ENABLED = os.environ.get('PERF_ENABLED', 'true').lower() == 'true'
+    PERF_SAMPLE_SIZE = int(os.environ.get('PERF_SAMPLE_SIZE', 500))
+    PERF_SLOW_QUERY_MS = int(os.environ.get('PERF_SLOW_QUERY_MS', 200))
+    PERF_SLOW_QUERIES_KEPT = 50
+    # Заголовок Server-Timing (время приложения и БД) видят только администраторы;
+    # true - отдавать его в каждом ответе (нагрузочные прогоны, отладка)
+    PERF_SERVER_TIMING = os.environ.get('PERF_SERVER_TIMING', 'false').lower() == 'true'
+    
+    # Эндпоинт /metrics для Prometheus: нужен заголовок Authorization: Bearer <METRICS_TOKEN>;
+    # без METRICS_TOKEN он отвечает 403 (открыт только в режиме отладки)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Профилирование по запросу администратора (?_profile=sample|cprofile или заголовок
+    # X-Profile) и снимки памяти tracemalloc на странице /admin/memory
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'true').lower() == 'true'
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_STATS_LIMIT = 60
+    TRACEMALLOC_FRAMES = 25
+    
+    # Пагинация: выше порога берется оценка числа строк планировщиком PostgreSQL,
+    # ниже - точный COUNT(*), закэшированный на COUNT_CACHE_TTL секунд
+    ESTIMATED_COUNT_THRESHOLD = int(os.environ.get('ESTIMATED_COUNT_THRESHOLD', 10000))
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+    
+    # Сжимать потоковый CSV-экспорт админки, если клиент принимает gzip
+    ADMIN_EXPORT_GZIP = os.environ.get('ADMIN_EXPORT_GZIP', 'true').lower() == 'true'
+    
+    # Число соседей на блюдо для рекомендаций "с этим также заказывают"
+    RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', 10))
+    
+    # Хеширование паролей: стоимость подбирается командой flask calibrate-bcrypt
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Одновременных хеширований в процессе; остальные запросы ждут слот до BCRYPT_QUEUE_TIMEOUT
+    BCRYPT_MAX_WORKERS = int(os.environ.get('BCRYPT_MAX_WORKERS', 2))
+    BCRYPT_QUEUE_TIMEOUT = 2.0
     
     # Настройки парсера
     PARSER_TIMEOUT = 15
@@ -0,0 +1,38 @@
+# Настройки gunicorn (файл подхватывается автоматически из рабочего каталога)
+import glob
+import os
+import tempfile
+
+# Общий каталог метрик Prometheus: каждый процесс пишет свои mmap-файлы,
+# /metrics суммирует их. Переменная должна быть задана до импорта приложения.
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'food_delivery_metrics')
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+    os.remove(stale)
+
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork:
+# быстрый старт воркеров и общая память для кода. Схема БД готовится заранее
+# командой flask prepare-db, поэтому create_app не ходит в базу.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def post_fork(server, worker):
+    """Пулы соединений, унаследованные от мастера, воркер не использует"""
+    if not preload_app:
+        return
+    from wsgi import app
+    from app.bootstrap import dispose_engines
+    with app.app_context():
+        dispose_engines(close=False)
+
+def child_exit(server, worker):
+    """Метрики-гейджи завершившегося воркера больше не учитываются"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,133 @@
+"""Общие фикстуры тестов: приложение на временной SQLite-базе с фиксированными данными.
+
+Кэши процесса выключены, поэтому тесты видят худший случай - холодный запрос.
+"""
+from datetime import datetime, timedelta
+from config import Config
+import pytest
+
+USER = ('budget_user', 'budget-pass')
+# Администратор, которого создает prepare_database на новой базе
+ADMIN = ('admin', '25102510')
+METRICS_TOKEN = 'test-metrics'
+
+ORDER_STATUSES = ['Новый', 'Подтвержден', 'Готовится', 'В пути', 'Доставлен', 'Отменен']
+
+def make_config(database_path, **overrides):
+    """Конфигурация тестов: отдельная база и выключенные кэши"""
+    return type('TestConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}',
+        'AUTO_INIT_DB': True,
+        'TESTING': True,
+        'PROPAGATE_EXCEPTIONS': False,
+        'WTF_CSRF_ENABLED': False,
+        'LOG_TO_STDOUT': True,
+        'LOG_LEVEL': 'WARNING',
+        'BCRYPT_LOG_ROUNDS': 4,
+        # В очереди записи SQLite каждый BEGIN - отдельная команда и попал бы в счетчик
+        'SQLITE_WRITE_QUEUE': False,
+        'METRICS_TOKEN': METRICS_TOKEN,
+        'IDENTITY_CACHE_TTL': 0,
+        'FAVORITES_CACHE_TTL': 0,
+        'POPULAR_DISHES_CACHE_TTL': 0,
+        'QUEUE_STATS_CACHE_TTL': 0,
+        'COUNT_CACHE_TTL': 0,
+        'IDENTITY_CACHE_STAMP': database_path + '.identity.stamp',
+        'QUEUE_STATS_STAMP': database_path + '.queue.stamp',
+        **overrides
+    })
+
+def seed_data():
+    """Небольшие фиксированные данные: 3 категории, 30 блюд, 25 заказов, избранное, очередь"""
+    from app import db, rollups
+    from app.models import Category, Dish, User, Order, OrderItem, Favorite, ImageQueue
+    from app.recommendations import build_recommendations
+
+    categories = [Category(name=name, image=f'{image}.jpg')
+                  for name, image in (('Пицца', 'pizza'), ('Бургеры', 'burger'), ('Напитки', 'drinks'))]
+    db.session.add_all(categories)
+    db.session.flush()
+
+    dishes = []
+    for category in categories:
+        for number in range(10):
+            dishes.append(Dish(
+                name=f'{category.name} {number + 1}',
+                description='Блюдо для тестов',
+                price=100 + 10 * number,
+                category_id=category.id,
+                image='default.jpg',
+                is_available=number != 9
+            ))
+    db.session.add_all(dishes)
+
+    user = User(username=USER[0])
+    user.set_password(USER[1])
+    db.session.add(user)
+    db.session.flush()
+
+    started = datetime(2024, 1, 1, 12, 0)
+    for number in range(25):
+        items = [dishes[(number + shift) % 27] for shift in range(3)]
+        order = Order(
+            customer_name=user.username,
+            address='ул. Ленина, дом 1, кв. 1',
+            total=sum(dish.price for dish in items),
+            status=ORDER_STATUSES[number % len(ORDER_STATUSES)],
+            created_at=started + timedelta(hours=7 * number),
+            user_id=user.id
+        )
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all(OrderItem(order_id=order.id, dish_id=dish.id, quantity=1, price=dish.price)
+                           for dish in items)
+
+    db.session.add_all(Favorite(user_id=user.id, dish_id=dishes[number].id) for number in range(5))
+    db.session.add_all(
+        ImageQueue(dish_id=dishes[number].id, image_url=f'https://example.com/{number}.jpg',
+                   status=('pending', 'completed', 'failed')[number % 3])
+        for number in range(10)
+    )
+    user.orders_count = 25
+    user.favorites_count = 5
+    db.session.commit()
+
+    rollups.rebuild_daily_stats()
+    rollups.rebuild_dish_stats()
+    build_recommendations(full=True)
+
+def log_in(client, user):
+    """Входит тестовым клиентом как 'admin' или 'user'"""
+    username, password = ADMIN if user == 'admin' else USER
+    client.post('/auth/login', data={'username': username, 'password': password})
+
+@pytest.fixture(scope='module')
+def make_app(tmp_path_factory):
+    """Фабрика приложений на новой заполненной базе: make_app(**настройки) -> (app, путь к базе)"""
+    from app import create_app
+    from app.bootstrap import dispose_engines
+
+    created = []
+
+    def make(**overrides):
+        database_path = str(tmp_path_factory.mktemp('db') / 'app.db')
+        app = create_app(make_config(database_path, **overrides))
+        with app.app_context():
+            seed_data()
+        created.append(app)
+        return app, database_path
+
+    yield make
+    for app in created:
+        with app.app_context():
+            dispose_engines()
+
+@pytest.fixture(scope='module')
+def app(make_app):
+    """Приложение на заполненной базе, общее для тестов модуля"""
+    return make_app()[0]
+
+@pytest.fixture(scope='session')
+def login():
+    """login(client, 'admin' | 'user')"""
+    return log_in
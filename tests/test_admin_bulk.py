@@ -0,0 +1,57 @@
+"""Массовая смена статуса заказов: выбранные заказы и все заказы текущего фильтра."""
+from app import db, rollups
+from app.models import DailyOrderStats, Order
+import pytest
+
+# Фильтр списка заказов "статус равен"
+STATUS_EQUALS = 'flt0_2'
+
+@pytest.fixture(scope='module')
+def admin_client(app, login):
+    client = app.test_client()
+    login(client, 'admin')
+    return client
+
+def _stats(app):
+    with app.app_context():
+        return sorted((str(row.day), row.status, row.orders_count, round(row.revenue, 2))
+                      for row in DailyOrderStats.query.filter(DailyOrderStats.orders_count != 0))
+
+def _statuses(app):
+    with app.app_context():
+        return dict(db.session.query(Order.id, Order.status).all())
+
+def _assert_stats_match_rebuild(app):
+    moved = _stats(app)
+    with app.app_context():
+        rollups.rebuild_daily_stats()
+    assert moved == _stats(app)
+
+def test_list_links_bulk_status_to_current_filter(app, admin_client):
+    html = admin_client.get(f'/admin/order/?{STATUS_EQUALS}=Доставлен').get_data(as_text=True)
+    assert 'bulk-status/?scope=filter' in html
+    assert STATUS_EQUALS in html.split('bulk-status/?scope=filter', 1)[1].split('"', 1)[0]
+
+def test_filter_scope_updates_every_filtered_order(app, admin_client):
+    before = _statuses(app)
+    delivered = {order_id for order_id, status in before.items() if status == 'Доставлен'}
+    assert delivered
+
+    url = f'/admin/order/bulk-status/?scope=filter&{STATUS_EQUALS}=Доставлен'
+    assert f'Записей по текущему фильтру: {len(delivered)}' in admin_client.get(url).get_data(as_text=True)
+    assert admin_client.post(url, data={'status': 'Отменен'}).status_code == 302
+
+    after = _statuses(app)
+    assert {order_id for order_id, status in after.items() if status != before[order_id]} == delivered
+    assert all(after[order_id] == 'Отменен' for order_id in delivered)
+    _assert_stats_match_rebuild(app)
+
+def test_selected_ids_skip_orders_already_in_status(app, admin_client):
+    statuses = _statuses(app)
+    ids = sorted(statuses)[:8]
+    response = admin_client.post('/admin/order/bulk-status/', data={
+        'ids': ','.join(map(str, ids)), 'status': 'В пути'
+    }, follow_redirects=True)
+    changed = sum(1 for order_id in ids if statuses[order_id] != 'В пути')
+    assert f'установлен у {changed} заказов' in response.get_data(as_text=True)
+    _assert_stats_match_rebuild(app)
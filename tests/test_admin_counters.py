@@ -0,0 +1,42 @@
+"""Счетчики пользователя при правке избранного в админке."""
+from app.models import Favorite, User
+import re
+import pytest
+
+# Токен формы Flask-Admin (SecureForm), а не общий токен Flask-WTF из шаблона
+CSRF_INPUT = re.compile(r'id="csrf_token" name="csrf_token" type="hidden" value="([^"]*)"')
+
+@pytest.fixture(scope='module')
+def admin_client(app, login):
+    client = app.test_client()
+    login(client, 'admin')
+    return client
+
+def _csrf(html):
+    match = CSRF_INPUT.search(html)
+    return match.group(1) if match else ''
+
+def _counters(app):
+    with app.app_context():
+        return {user.username: user.favorites_count for user in User.query}
+
+def test_moving_favorite_to_another_user_adjusts_both_counters(app, admin_client):
+    with app.app_context():
+        favorite = Favorite.query.join(User).filter(User.username == 'budget_user').first()
+        admin = User.query.filter_by(username='admin').one()
+        favorite_id, dish_id, admin_id = favorite.id, favorite.dish_id, admin.id
+    before = _counters(app)
+
+    url = f'/admin/favorite/edit/?id={favorite_id}'
+    page = admin_client.get(url).get_data(as_text=True)
+    response = admin_client.post(url, data={
+        'csrf_token': _csrf(page), 'user': admin_id, 'dish': dish_id
+    })
+    assert response.status_code == 302
+
+    after = _counters(app)
+    assert after['budget_user'] == before['budget_user'] - 1
+    assert after['admin'] == before['admin'] + 1
+    with app.app_context():
+        for user in User.query:
+            assert user.favorites_count == Favorite.query.filter_by(user_id=user.id).count()
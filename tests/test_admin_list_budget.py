@@ -0,0 +1,44 @@
+"""Бюджет запросов страниц списка админки (ADMIN_LIST_QUERY_BUDGET).
+
+В тестах и отладке превышение - ошибка страницы, в рабочем режиме - строка в логе.
+"""
+import pytest
+
+@pytest.fixture(scope='module')
+def admin_client(make_app, login):
+    def make(**overrides):
+        app = make_app(**overrides)[0]
+        client = app.test_client()
+        login(client, 'admin')
+        return client
+    return make
+
+def test_list_within_budget(admin_client):
+    client = admin_client(ADMIN_LIST_QUERY_BUDGET=10)
+    assert client.get('/admin/dish/').status_code == 200
+
+def test_list_over_budget_fails_in_testing(admin_client):
+    client = admin_client(ADMIN_LIST_QUERY_BUDGET=1)
+    assert client.get('/admin/dish/').status_code == 500
+
+def test_list_over_budget_only_logged_in_production(admin_client, caplog):
+    client = admin_client(ADMIN_LIST_QUERY_BUDGET=1, TESTING=False)
+    with caplog.at_level('WARNING', logger='app.admin'):
+        assert client.get('/admin/dish/').status_code == 200
+    assert 'SQL-запросов при бюджете 1' in caplog.text
+
+def test_counter_uses_permanent_engine_listener(admin_client):
+    from app import db
+    from app.querycount import QueryCounter
+
+    client = admin_client(ADMIN_LIST_QUERY_BUDGET=10)
+    with client.application.app_context():
+        listeners = db.engine.dispatch.before_cursor_execute
+        registered = len(listeners)
+        with QueryCounter() as counter:
+            # Счетчик включается без event.listen на каждый запрос
+            assert len(listeners) == registered
+            db.session.execute(db.text('SELECT 1'))
+        assert counter.count == 1
+        db.session.execute(db.text('SELECT 1'))
+        assert counter.count == 1
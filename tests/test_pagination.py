@@ -0,0 +1,34 @@
+"""Keyset-пагинация истории заказов и списка заказов в админке."""
+from app.pagination import encode_cursor
+import pytest
+
+@pytest.fixture(scope='module')
+def clients(app, login):
+    user, admin = app.test_client(), app.test_client()
+    login(user, 'user')
+    login(admin, 'admin')
+    return {'user': user, 'admin': admin}
+
+@pytest.mark.parametrize('client, url', [
+    ('user', '/user/orders?after=not-a-cursor'),
+    ('user', f"/user/orders?before={encode_cursor(['2024-01-01T12:00:00'])}"),
+    ('user', f"/user/orders?after={encode_cursor(['None', 5])}"),
+    ('admin', '/admin/order/?after=not-a-cursor'),
+])
+def test_malformed_cursor_is_rejected(clients, client, url):
+    assert clients[client].get(url).status_code == 400
+
+def test_pages_cover_every_order_once(app, clients):
+    from app.models import Order
+    import re
+
+    with app.app_context():
+        expected = {order.id for order in Order.query}
+    seen = []
+    url = '/user/orders'
+    while url:
+        html = clients['user'].get(url).get_data(as_text=True)
+        seen += [int(number) for number in re.findall(r'/user/order/(\d+)"', html)]
+        cursor = re.search(r'\?after=([\w-]+)', html)
+        url = f'/user/orders?after={cursor.group(1)}' if cursor else None
+    assert sorted(seen) == sorted(expected)
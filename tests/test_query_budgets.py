@@ -0,0 +1,183 @@
+"""Бюджеты SQL-запросов для маршрутов приложения.
+
+Каждый маршрут выполняется тестовым клиентом внутри QueryBudget: число
+SQL-запросов и строк, прочитанных из их результатов, не должно превышать
+бюджет. Новый маршрут без бюджета (и без причины в SKIPPED) - тоже ошибка.
+"""
+from app import db
+from app.querycount import QueryBudget, QueryBudgetExceeded
+from conftest import USER, METRICS_TOKEN
+import pytest
+
+# Маршруты, которые не измеряются, и почему
+SKIPPED = {
+    'static': 'статические файлы',
+    'admin.static': 'статические файлы',
+    'admin_parsing.parse_nsm_action': 'ходит на внешний сайт',
+    'admin_parsing.process_image_queue': 'скачивает изображения из сети',
+    'admin_parsing.queue_events': 'бесконечный поток SSE',
+    'memory_action': 'управляет tracemalloc, без БД',
+    'order.create_view': 'создание заказов в админке выключено (can_create = False)',
+}
+# Служебные маршруты Flask-Admin (формы с SecureForm, ajax без настроенных полей)
+SKIPPED_SUFFIXES = {
+    '.action_view': 'действия проверяются через bulk_*_view',
+    '.ajax_lookup': 'ajax-поля не настроены',
+    '.ajax_update': 'редактирование в списке не включено',
+    '.delete_view': 'удаление меняет данные фикстуры',
+}
+
+def _admin_view_budgets(endpoint, budgets):
+    """Страницы одного представления Flask-Admin: (список, детали, правка, создание, экспорт).
+
+    None вместо бюджета - страницы нет (причина в SKIPPED).
+    """
+    url = f'/admin/{endpoint}/'
+    pages = [url, f'{url}details/?id=1', f'{url}edit/?id=1', f'{url}new/', f'{url}export/csv/']
+    return [{'url': page, 'user': 'admin', 'budget': budget}
+            for page, budget in zip(pages, budgets) if budget is not None]
+
+# budget - (максимум запросов, максимум прочитанных строк).
+# setup - запросы до измерения (не считаются); status - ожидаемый код ответа
+# GET-запроса, если не 200. Порядок важен: изменяющие данные маршруты идут
+# в конце, и удаляют они не те строки, которые открывают страницы админки (id=1).
+ROUTES = [
+    # Витрина
+    {'url': '/', 'user': None, 'budget': (2, 3)},
+    {'url': '/menu/1', 'user': None, 'budget': (2, 10)},
+    {'url': '/cart', 'user': None, 'budget': (2, 3),
+     'setup': [('POST', '/cart/batch', {'json': {'ops': [{'op': 'add', 'dish_id': 1, 'quantity': 2}]}})]},
+    {'url': '/', 'user': 'user', 'budget': (3, 4)},
+    {'url': '/menu/1', 'user': 'user', 'budget': (4, 16)},
+    {'url': '/cart', 'user': 'user', 'budget': (3, 4),
+     'setup': [('POST', '/cart/batch', {'json': {'ops': [{'op': 'add', 'dish_id': 1, 'quantity': 2}]}})]},
+    {'method': 'POST', 'url': '/add_to_cart/2', 'user': None, 'budget': (1, 1)},
+    {'method': 'POST', 'url': '/cart/batch', 'user': None, 'budget': (2, 6),
+     'kwargs': {'json': {'ops': [{'op': 'add', 'dish_id': 1}, {'op': 'set', 'dish_id': 2, 'quantity': 3},
+                                 {'op': 'add', 'dish_id': 3}]}}},
+    {'method': 'POST', 'url': '/update_cart/1', 'user': None, 'budget': (0, 0),
+     'kwargs': {'json': {'quantity': 4}},
+     'setup': [('POST', '/add_to_cart/1', {})]},
+    {'method': 'POST', 'url': '/remove_from_cart/1', 'user': None, 'budget': (0, 0),
+     'setup': [('POST', '/add_to_cart/1', {})]},
+    {'method': 'POST', 'url': '/add_to_favorites/7', 'user': 'user', 'budget': (8, 3)},
+    {'url': '/checkout', 'user': 'user', 'budget': (2, 2),
+     'setup': [('POST', '/cart/batch', {'json': {'ops': [{'op': 'add', 'dish_id': 1, 'quantity': 2}]}})]},
+    {'method': 'POST', 'url': '/checkout', 'user': 'user', 'budget': (13, 4),
+     'kwargs': {'data': {'address': 'ул. Ленина, дом 1, кв. 1', 'phone': '+79990000000'}},
+     'setup': [('POST', '/cart/batch', {'json': {'ops': [{'op': 'add', 'dish_id': 1, 'quantity': 2},
+                                                         {'op': 'add', 'dish_id': 2}]}})]},
+
+    # Авторизация
+    {'url': '/auth/login', 'user': None, 'budget': (0, 0)},
+    {'url': '/auth/register', 'user': None, 'budget': (0, 0)},
+    {'method': 'POST', 'url': '/auth/login', 'user': None, 'budget': (1, 1),
+     'kwargs': {'data': {'username': USER[0], 'password': USER[1]}}},
+    {'method': 'POST', 'url': '/auth/register', 'user': None, 'budget': (2, 0),
+     'kwargs': {'data': {'username': 'budget_new', 'password': 'budget-pass',
+                         'confirm_password': 'budget-pass'}}},
+
+    # Личный кабинет
+    {'url': '/user/profile', 'user': 'user', 'budget': (2, 2)},
+    {'method': 'POST', 'url': '/user/profile', 'user': 'user', 'budget': (3, 2),
+     'kwargs': {'data': {'username': USER[0]}}},
+    {'url': '/user/orders', 'user': 'user', 'budget': (2, 12)},
+    {'url': '/user/order/1', 'user': 'user', 'budget': (2, 4)},
+    {'url': '/user/favorites', 'user': 'user', 'budget': (2, 7)},
+    {'method': 'POST', 'url': '/user/remove_favorite/5', 'user': 'user', 'budget': (5, 3)},
+
+    # Админка: статистика и служебные страницы
+    {'url': '/admin/', 'user': 'admin', 'budget': (10, 26)},
+    {'url': '/admin/user-stats', 'user': 'admin', 'budget': (6, 6)},
+    {'url': '/admin/order-stats', 'user': 'admin', 'budget': (5, 18)},
+    {'url': '/admin/perf', 'user': 'admin', 'budget': (1, 1)},
+    {'url': '/admin/memory', 'user': 'admin', 'budget': (1, 1)},
+    {'method': 'POST', 'url': '/admin/perf/reset', 'user': 'admin', 'budget': (1, 1)},
+    {'url': '/admin-parsing/parse-nsm', 'user': 'admin', 'budget': (1, 1)},
+    {'url': '/admin-parsing/queue-stats', 'user': 'admin', 'budget': (2, 4)},
+    {'url': '/metrics', 'user': None, 'budget': (1, 3),
+     'kwargs': {'headers': {'Authorization': f'Bearer {METRICS_TOKEN}'}}},
+    {'url': '/admin/dish/bulk-price/?ids=1,2,3', 'user': 'admin', 'budget': (1, 1)},
+    {'url': '/admin/order/bulk-status/?ids=1,2,3', 'user': 'admin', 'budget': (1, 1)},
+
+    # Админка: представления моделей
+    *_admin_view_budgets('user', [(3, 5), (2, 2), (2, 2), (1, 1), (2, 4)]),
+    *_admin_view_budgets('category', [(3, 5), (3, 3), (2, 2), (1, 1), (2, 4)]),
+    *_admin_view_budgets('dish', [(3, 32), (3, 3), (4, 6), (2, 4), (2, 31)]),
+    *_admin_view_budgets('order', [(3, 28), (3, 3), (4, 6), None, (2, 27)]),
+    *_admin_view_budgets('orderitem', [(3, 52), (4, 4), (6, 60), (3, 57), (2, 78)]),
+    *_admin_view_budgets('favorite', [(3, 7), (4, 4), (6, 37), (3, 34), (2, 6)]),
+    *_admin_view_budgets('imagequeue', [(3, 12), (3, 3), (4, 33), (2, 31), (2, 11)]),
+
+    # Изменяющие действия админки
+    {'method': 'POST', 'url': '/admin/dish/bulk-price/', 'user': 'admin', 'budget': (2, 1),
+     'kwargs': {'data': {'ids': '1,2,3', 'percent': '10'}}},
+    # По UPDATE ... RETURNING на каждый прежний статус: у заказов 1-3 их три
+    {'method': 'POST', 'url': '/admin/order/bulk-status/', 'user': 'admin', 'budget': (11, 7),
+     'kwargs': {'data': {'ids': '1,2,3', 'status': 'Доставлен'}}},
+    {'method': 'POST', 'url': '/admin-parsing/update-category-images', 'user': 'admin', 'budget': (5, 4)},
+    {'method': 'POST', 'url': '/admin-parsing/clear-image-queue', 'user': 'admin', 'budget': (5, 12)},
+    {'url': '/auth/logout', 'user': 'user', 'budget': (1, 1), 'status': 302},
+]
+
+
+def _endpoint(app, method, url):
+    path = url.split('?', 1)[0]
+    try:
+        return app.url_map.bind('localhost').match(path, method=method)[0]
+    except Exception:
+        return None
+
+def _route_id(route):
+    return f"{route.get('method', 'GET')} {route['url']} ({route.get('user') or 'anon'})"
+
+@pytest.fixture(scope='module')
+def clients():
+    """Клиенты по пользователям: вход выполняется один раз на модуль"""
+    return {}
+
+@pytest.mark.parametrize('route', ROUTES, ids=_route_id)
+def test_route_within_budget(app, clients, login, route):
+    method = route.get('method', 'GET')
+    user = route.get('user')
+    # Анонимный клиент на каждый маршрут: корзина в сессии не переходит дальше
+    client = clients.get(user) if user else None
+    if client is None:
+        client = app.test_client()
+        if user:
+            login(client, user)
+            clients[user] = client
+
+    for setup_method, setup_url, kwargs in route.get('setup', []):
+        client.open(setup_url, method=setup_method, **kwargs)
+
+    with app.app_context():
+        engine = db.engine
+    max_queries, max_rows = route['budget']
+    budget = QueryBudget(max_queries=max_queries, max_rows=max_rows, engine=engine)
+    try:
+        with budget:
+            response = client.open(route['url'], method=method, **route.get('kwargs', {}))
+            # Экспорт отдается потоком: читаем его внутри замера и закрываем
+            response.get_data()
+            response.close()
+    except QueryBudgetExceeded:
+        pass
+
+    assert not budget.violations(), '\n'.join([*budget.violations(), *budget.statements])
+    if method == 'GET':
+        assert response.status_code == route.get('status', 200)
+    else:
+        assert response.status_code < 500
+
+def test_every_route_has_budget(app):
+    covered = {_endpoint(app, route.get('method', 'GET'), route['url']) for route in ROUTES}
+    missing = set()
+    for rule in app.url_map.iter_rules():
+        endpoint = rule.endpoint
+        if endpoint in covered or endpoint in SKIPPED or endpoint.endswith('.static'):
+            continue
+        if any(endpoint.endswith(suffix) for suffix in SKIPPED_SUFFIXES):
+            continue
+        missing.add(endpoint)
+    assert not missing, f'Маршруты без бюджета (ROUTES или SKIPPED): {sorted(missing)}'
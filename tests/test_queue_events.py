@@ -0,0 +1,35 @@
+"""SSE-поток статистики очереди: ограничение числа потоков на процесс."""
+import pytest
+
+@pytest.fixture(scope='module')
+def admin_client(make_app, login):
+    app = make_app(QUEUE_EVENTS_MAX_STREAMS=1, QUEUE_EVENTS_MAX_AGE=1)[0]
+    client = app.test_client()
+    login(client, 'admin')
+    return client
+
+def _chunks(response):
+    return [chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in response.response]
+
+def test_stream_sends_stats_and_closes(admin_client):
+    response = admin_client.get('/admin-parsing/queue-events', buffered=False)
+    chunks = _chunks(response)
+    response.close()
+    assert chunks[0] == 'retry: 3000\n'
+    assert chunks[1].startswith('event: stats\n')
+
+def test_busy_process_sends_snapshot_and_retry(admin_client):
+    from app.queue_stats import BUSY_RETRY_MS
+
+    first = admin_client.get('/admin-parsing/queue-events', buffered=False)
+    stream = iter(first.response)
+    next(stream)  # поток занял единственный слот
+    try:
+        second = admin_client.get('/admin-parsing/queue-events', buffered=False)
+        chunks = _chunks(second)
+        second.close()
+    finally:
+        first.close()
+    assert chunks[0] == f'retry: {BUSY_RETRY_MS}\n'
+    assert chunks[1].startswith('event: stats\n')
+    assert len(chunks) == 2
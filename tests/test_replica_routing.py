@@ -0,0 +1,83 @@
+"""Чтение с реплики: read-only страницы читают с bind 'replica', запись и
+остальные страницы - с основной базы.
+
+Реплика - копия основной SQLite-базы, сделанная после заполнения данными.
+"""
+from app import db
+from app.engines import REPLICA_BIND
+from sqlalchemy import event
+import sqlite3
+import pytest
+
+# (пользователь, метод, url, bind, на который должны уйти все запросы)
+ROUTING_CHECKS = [
+    (None, 'GET', '/', REPLICA_BIND),
+    (None, 'GET', '/menu/1', REPLICA_BIND),
+    ('admin', 'GET', '/admin/', REPLICA_BIND),
+    ('admin', 'GET', '/admin/user-stats', REPLICA_BIND),
+    ('admin', 'GET', '/admin/order-stats', REPLICA_BIND),
+    ('admin', 'GET', '/admin-parsing/queue-stats', REPLICA_BIND),
+    ('admin', 'GET', '/admin/order/export/csv/', REPLICA_BIND),
+    ('user', 'GET', '/cart', 'primary'),
+    ('user', 'GET', '/user/profile', 'primary'),
+    ('user', 'GET', '/menu/1', REPLICA_BIND),
+    ('user', 'POST', '/add_to_favorites/7', 'primary'),
+    # Сразу после записи тот же клиент читает свои изменения с основной базы
+    ('user', 'GET', '/menu/1', 'primary'),
+]
+
+@pytest.fixture(scope='module')
+def replica_app(make_app, tmp_path_factory):
+    replica_path = str(tmp_path_factory.mktemp('replica') / 'replica.db')
+    app, primary_path = make_app(DATABASE_REPLICA_URL=f'sqlite:///{replica_path}')
+
+    # Реплика - точная копия основной базы на момент проверки
+    source, target = sqlite3.connect(primary_path), sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return app
+
+@pytest.fixture(scope='module')
+def bind_counts(replica_app):
+    """Число SQL-запросов по bind ('primary', 'replica'); обнуляется перед каждой проверкой"""
+    counts = {}
+    with replica_app.app_context():
+        engines = dict(db.engines)
+    listeners = []
+    for key, engine in engines.items():
+        def count(*args, name=key or 'primary'):
+            counts[name] = counts.get(name, 0) + 1
+
+        event.listen(engine, 'before_cursor_execute', count)
+        listeners.append((engine, count))
+    yield counts
+    for engine, count in listeners:
+        event.remove(engine, 'before_cursor_execute', count)
+
+@pytest.fixture(scope='module')
+def clients():
+    return {}
+
+@pytest.mark.parametrize('user, method, url, expected', ROUTING_CHECKS,
+                         ids=[f"{method} {url} ({user or 'anon'})" for user, method, url, _ in ROUTING_CHECKS])
+def test_queries_use_expected_bind(replica_app, bind_counts, clients, login, user, method, url, expected):
+    client = clients.get(user)
+    if client is None:
+        client = clients[user] = replica_app.test_client()
+        if user:
+            login(client, user)
+            # Вход пишет в базу; для проверки чтения отметку о записи сбрасываем
+            with client.session_transaction() as flask_session:
+                flask_session.pop('db_primary_until', None)
+
+    bind_counts.clear()
+    response = client.open(url, method=method)
+    # Экспорт отдается потоком: контекст запроса закрывается вместе с ответом
+    response.get_data()
+    response.close()
+
+    assert response.status_code < 500
+    assert bind_counts and set(bind_counts) == {expected}, bind_counts
@@ -0,0 +1,53 @@
+"""Очередь записи SQLite (SQLITE_WRITE_QUEUE): какие транзакции начинаются с BEGIN IMMEDIATE."""
+from app import db
+from app.sqlite_profile import _write_lock
+from sqlalchemy import event
+import pytest
+
+@pytest.fixture(scope='module')
+def queue_app(make_app):
+    return make_app(SQLITE_WRITE_QUEUE=True)[0]
+
+@pytest.fixture
+def begins(queue_app):
+    """Команды BEGIN запроса в порядке выполнения"""
+    statements = []
+    with queue_app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, *args):
+        if statement.startswith('BEGIN'):
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+def test_login_does_not_take_write_queue(queue_app, begins):
+    client = queue_app.test_client()
+    response = client.post('/auth/login', data={'username': 'budget_user', 'password': 'budget-pass'})
+    assert response.status_code == 302
+    assert begins and 'BEGIN IMMEDIATE' not in begins
+    assert not _write_lock.locked()
+
+def test_only_first_write_transaction_is_immediate(queue_app, begins, login):
+    client = queue_app.test_client()
+    login(client, 'user')
+    begins.clear()
+    assert client.post('/add_to_favorites/12').status_code == 200
+    # После commit страница дочитывает данные обычной транзакцией
+    assert begins[0] == 'BEGIN IMMEDIATE'
+    assert set(begins[1:]) <= {'BEGIN'}
+    assert not _write_lock.locked()
+
+def test_read_request_takes_queue_only_on_write(queue_app):
+    from app.models import Dish
+
+    with queue_app.test_request_context(method='GET'):
+        Dish.query.first()
+        assert not _write_lock.locked()
+        Dish.query.filter_by(id=1).update({Dish.orders_count: Dish.orders_count})
+        assert _write_lock.locked()
+        db.session.commit()
+        assert not _write_lock.locked()
+        db.session.remove()